@@ -0,0 +1,55 @@
+import sys; sys.path.extend(['../../'])
+import random
+import time
+from Dash2.core.event_queue import make_event_queue
+
+
+# Benchmark for the discrete event simulation's event queues in the hold model: with a given number of events
+# pending, repeatedly pop the earliest event and push the agent's next event, a day later with some jitter, as
+# in a simulation where each agent acts about once a day. Checks that every queue pops the same events in the
+# same order, including ties between agents at the same time, which are broken by agent id.
+# Run with the numbers of pending events as arguments, e.g. 100000 1000000 10000000, which needs several GB
+# of memory at the largest size.
+
+SECONDS_IN_DAY = 86400
+
+
+def hold(queue, pending, holds, seed=0, record=False):
+    rng = random.Random(seed)
+    for agent_id in range(pending):
+        queue.push(rng.randrange(SECONDS_IN_DAY), agent_id)  # whole seconds, so many events share a time
+    popped = []
+    start = time.perf_counter()
+    for _ in range(holds):
+        (event_time, agent_id) = queue.pop()
+        if record:
+            popped.append((event_time, agent_id))
+        queue.push(event_time + SECONDS_IN_DAY + rng.randrange(-3600, 3600), agent_id)
+    return time.perf_counter() - start, popped
+
+
+def check(kinds, pending=20000, holds=100000):
+    expected = None
+    for kind in kinds:
+        queue = make_event_queue(kind)
+        popped = hold(queue, pending, holds, record=True)[1]
+        while len(queue):
+            popped.append(queue.pop())
+        assert popped == sorted(popped), kind + " popped events out of order"
+        if expected is None:
+            expected = popped
+        assert popped == expected, kind + " popped different events"
+
+
+def benchmark(kinds, pending, holds=1000000):
+    for kind in kinds:
+        options = {'bucket_width': 2 * SECONDS_IN_DAY / pending} if kind == 'bucketed' else {}
+        seconds = hold(make_event_queue(kind, **options), pending, holds)[0]
+        print("%9d pending, %-8s %6.2f us per hold" % (pending, kind, seconds * 1e6 / holds))
+
+
+if __name__ == "__main__":
+    kinds = ['heap', 'calendar', 'bucketed']
+    check(kinds)
+    for pending in [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]:
+        benchmark(kinds, pending)
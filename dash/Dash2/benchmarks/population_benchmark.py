@@ -0,0 +1,64 @@
+import sys; sys.path.extend(['../../'])
+import random
+import timeit
+import numpy
+from Dash2.core.system1_matrix import MatrixSystem1Agent, System1Population
+
+
+# Benchmark for one tick of system 1 across a population of agents that share a vocabulary, such as a ward of
+# nurses: every agent spreads its activation and decays. Compares a batched System1Population, spread and decayed
+# with system1_update_all and system1_step_all, against the same agents each updating its own ActivationNetwork.
+# The gain is largest for many agents with small vocabularies, where the separate networks spend their time in
+# per-call overhead rather than arithmetic.
+
+
+def build_agents(agents, vocabulary, links, population=None, seed=0):
+    rng = random.Random(seed)
+    members = []
+    for i in range(agents):
+        agent = MatrixSystem1Agent()
+        if population is not None:
+            population.add_agent(agent)
+        members.append(agent)
+    builders = members[:1] if population is not None else members
+    for agent in builders:
+        nodes = [agent.fact_to_node(('seen', j)) for j in range(vocabulary)]
+        link_rng = random.Random(seed)
+        for _ in range(links):
+            link_rng.choice(nodes).add_neighbor(link_rng.choice(nodes), link_rng.uniform(-1, 1))
+    for agent in members:
+        for j in rng.sample(range(vocabulary), vocabulary // 10):
+            agent.add_activation(('seen', j), rng.uniform(0, 1))
+    return members
+
+
+def separate_tick(agents):
+    for agent in agents:
+        agent.system1_update()
+        agent.system1_step()
+
+
+def population_tick(population):
+    population.system1_update_all()
+    population.system1_step_all()
+
+
+def benchmark(agents, vocabulary, links, number=20):
+    separate = build_agents(agents, vocabulary, links)
+    population = System1Population(batched=True)
+    build_agents(agents, vocabulary, links, population)
+    separate_tick(separate)
+    population_tick(population)
+    assert numpy.allclose(numpy.array([agent.network.activation[:vocabulary] for agent in separate]),
+                          population.activation[:vocabulary, :agents].T)
+    old = min(timeit.repeat(lambda: separate_tick(separate), number=number, repeat=3))
+    new = min(timeit.repeat(lambda: population_tick(population), number=number, repeat=3))
+    print("%5d agents, %6d nodes, %7d links: separate %9.1f us, population %8.1f us per tick, speedup %.0fx"
+          % (agents, vocabulary, links, old * 1e6 / number, new * 1e6 / number, old / new))
+
+
+if __name__ == "__main__":
+    for agents in [10, 100, 1000]:
+        benchmark(agents, 100, 300)
+        benchmark(agents, 1000, 3000)
+    benchmark(100, 10000, 30000)
@@ -0,0 +1,79 @@
+import sys; sys.path.extend(['../../'])
+import io
+import timeit
+import collections.abc
+from contextlib import redirect_stdout
+from Dash2.core.system2 import substitute, isVar
+from Dash2.nurse.nurse01 import Nurse
+from Dash2.nurse.bcma import BCMAAgent
+
+
+# Microbenchmark for substitute over the goal requirements of the nurse and BCMA agents, comparing against the
+# previous implementation that rebuilt every term. Each requirement is substituted with no bindings, with half of
+# its variables bound and with all of them bound, as nextAction does while working through a requirements body.
+
+
+def rebuild_substitute(predicate, bindings):
+    if isinstance(predicate, (list, tuple)):
+        args = [rebuild_substitute_argument(arg, bindings) for arg in predicate[1:]]
+        return tuple([predicate[0]] + args)
+    return rebuild_substitute_argument(predicate, bindings)
+
+
+def rebuild_substitute_argument(arg, bindings):
+    if isinstance(arg, list):
+        return [rebuild_substitute_argument(x, bindings) for x in arg]
+    elif isinstance(arg, tuple):
+        return tuple([rebuild_substitute_argument(x, bindings) for x in arg])
+    elif not isinstance(arg, collections.abc.Hashable) or arg not in bindings:
+        return arg
+    else:
+        return bindings[arg]
+
+
+def variables(term, found):
+    if isinstance(term, (list, tuple)):
+        for arg in term[1:]:
+            variables(arg, found)
+    elif isVar(term) and term not in found:
+        found.append(term)
+    return found
+
+
+# Return (requirement, bindings) pairs for every requirement of every goalRequirements clause of the agent
+def substitution_cases(agent):
+    cases = []
+    for clauses in agent.goalRequirementsDict.values():
+        for (goal, requirements) in clauses:
+            clause_vars = variables(goal, [])
+            for requirement in requirements:
+                variables(requirement, clause_vars)
+            half = dict([(v, '_' + v) for v in clause_vars[:len(clause_vars) // 2]])
+            full = dict([(v, '_' + v) for v in clause_vars])
+            for requirement in requirements:
+                cases += [(requirement, {}), (requirement, half), (requirement, full)]
+    return cases
+
+
+def run_cases(function, cases):
+    for (term, bindings) in cases:
+        function(term, bindings)
+
+
+def benchmark(name, agent, number=2000):
+    cases = substitution_cases(agent)
+    for (term, bindings) in cases:
+        assert substitute(term, bindings) == rebuild_substitute(term, bindings)
+    old = min(timeit.repeat(lambda: run_cases(rebuild_substitute, cases), number=number, repeat=3))
+    new = min(timeit.repeat(lambda: run_cases(substitute, cases), number=number, repeat=3))
+    per_call = 1e9 / (number * len(cases))
+    print("%-6s %4d substitutions: rebuild %7.1f ns, fast path %7.1f ns, speedup %.2fx"
+          % (name, len(cases), old * per_call, new * per_call, old / new))
+
+
+if __name__ == "__main__":
+    with redirect_stdout(io.StringIO()):  # the agents print while being set up
+        nurse = Nurse()
+        bcma = BCMAAgent()
+    benchmark("nurse", nurse)
+    benchmark("bcma", bcma)
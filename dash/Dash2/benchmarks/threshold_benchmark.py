@@ -0,0 +1,37 @@
+import sys; sys.path.extend(['../../'])
+import timeit
+from Dash2.core.system1 import System1Agent
+
+
+# Benchmark for proposing system 1 actions with a large action vocabulary, where only a few actions have been
+# activated recently. Compares actions_over_threshold, which checks the agent's active action nodes, against
+# scanning every action node as before.
+
+
+def scan_actions_over_threshold(agent, threshold):
+    return [n for n in agent.action_nodes if n.activation >= threshold]
+
+
+def build_agent(vocabulary, active):
+    agent = System1Agent()
+    for i in range(vocabulary):
+        agent.fact_to_node(('action', 'act' + str(i)))
+    for i in range(0, vocabulary, vocabulary // active):
+        agent.add_activation(('action', 'act' + str(i)), 0.5)
+    return agent
+
+
+def benchmark(vocabulary, active, number=200):
+    agent = build_agent(vocabulary, active)
+    threshold = agent.system1_threshold
+    assert set(agent.actions_over_threshold(threshold)) == set(scan_actions_over_threshold(agent, threshold))
+    old = min(timeit.repeat(lambda: scan_actions_over_threshold(agent, threshold), number=number, repeat=3))
+    new = min(timeit.repeat(lambda: agent.actions_over_threshold(threshold), number=number, repeat=3))
+    print("%7d actions, %3d active: scan %9.1f us, index %7.1f us, speedup %.0fx"
+          % (vocabulary, active, old * 1e6 / number, new * 1e6 / number, old / new))
+
+
+if __name__ == "__main__":
+    for vocabulary in [1000, 10000, 100000]:
+        benchmark(vocabulary, 10)
+        benchmark(vocabulary, 100)
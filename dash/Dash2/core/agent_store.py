@@ -0,0 +1,254 @@
+import os
+import shutil
+from collections.abc import MutableMapping, Sequence
+import numpy
+
+
+# Agent data for large populations, for use as LocalWorkProcessor's agents_data in place of a dict of dicts.
+# Fields with a fixed type, given as numpy (name, dtype) pairs such as ('count', 'i8') or ('name', 'U16'), are kept
+# in a structured array with a row per agent, memory-mapped to a file when path is given so that the operating system
+# pages agents in and out and the population can be larger than memory. Any other fields go in a dict kept for each
+# agent that has them. store[agent_id] is an AgentRecord, which reads and writes the agent's row like a dict:
+#
+#   store = AgentStore([('last_event_time', 'i8'), ('count', 'i4')], path='agents.dat')
+#   store['a1'] = {'last_event_time': 1483228800, 'count': 0, 'friends': ['a2']}
+#   store['a1']['count'] += 1
+#
+# As in a dict, a record only has the fixed fields that have been set for the agent: each row also holds a flag for
+# every fixed field, so 'last_event_time' in record is False for an agent that was never given one. Strings longer
+# than their field are cut short. Agents can be added but not removed. Records are views of the store, so keep
+# dict(record) to hold on to an agent's data as it is now. Pickling a store copies the array into the pickle, and an
+# unpickled store is held in memory; checkpoints instead copy a memory-mapped store's file, keeping only its layout
+# in the pickle, and reopen it with AgentStore.reopen (see checkpoint.py).
+class AgentStore(MutableMapping):
+
+    def __init__(self, fields, path=None, capacity=1024):
+        self.dtype = numpy.dtype(fields)
+        if fields_set in self.dtype.names:
+            raise ValueError(fields_set + " is used by the AgentStore and can't be a field")
+        self.path = path
+        self.rows = dict()  # agent id -> row
+        self.extra = dict()  # row -> dict of the agent's other fields
+        self.mode = 'r+'
+        self.array = self.allocate(max(1, capacity))
+        self.view_columns()
+
+    # Plain ndarray views of each field and of the flags for which fields are set, as indexing a memmap goes through
+    # slower Python code
+    def view_columns(self):
+        self.columns = dict((name, self.array[name].view(numpy.ndarray)) for name in self.dtype.names)
+        self.field_numbers = dict((name, i) for (i, name) in enumerate(self.dtype.names))
+        self.set_flags = self.array[fields_set].view(numpy.ndarray)
+
+    # The type of the rows in the array: the fields, followed by a flag for each field that is set for the agent
+    def row_dtype(self):
+        return numpy.dtype([(name, self.dtype.fields[name][0]) for name in self.dtype.names] +
+                           [(fields_set, '?', (len(self.dtype.names),))])
+
+    def allocate(self, capacity, old=None):
+        dtype = self.row_dtype()
+        if self.path is None:
+            array = numpy.zeros(capacity, dtype=dtype)
+            if old is not None:
+                array[:len(old)] = old
+            return array
+        if old is None:
+            return numpy.memmap(self.path, dtype=dtype, mode='w+', shape=(capacity,))
+        old.flush()
+        with open(self.path, 'r+b') as f:
+            f.truncate(capacity * dtype.itemsize)
+        return numpy.memmap(self.path, dtype=dtype, mode=self.mode, shape=(capacity,))
+
+    def __getitem__(self, agent_id):
+        return AgentRecord(self, self.rows[agent_id])
+
+    def __setitem__(self, agent_id, agent_data):
+        agent_data = dict(agent_data)  # agent_data may be a record of this store
+        row = self.rows.get(agent_id)
+        if row is None:
+            row = len(self.rows)
+            if row == len(self.array):
+                self.array = self.allocate(2 * len(self.array), self.array)
+                self.view_columns()
+            self.rows[agent_id] = row
+        else:
+            self.array[row] = numpy.zeros(1, dtype=self.array.dtype)[0]
+        for name, column in self.columns.items():
+            if name in agent_data:
+                column[row] = agent_data.pop(name)
+                self.set_flags[row, self.field_numbers[name]] = True
+        if agent_data:
+            self.extra[row] = agent_data
+        else:
+            self.extra.pop(row, None)
+
+    def __delitem__(self, agent_id):
+        raise TypeError("agents can't be removed from an AgentStore")
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, agent_id):
+        return agent_id in self.rows
+
+    # The (agent, agent data) pairs that LocalWorkProcessor passes to agents, without an object for each agent
+    def agent_tuples(self, agent):
+        return AgentTuples(self, agent)
+
+    def flush(self):
+        if isinstance(self.array, numpy.memmap):
+            self.array.flush()
+
+    # Keep later changes in this process only, for a process forked with a memory-mapped store
+    def copy_on_write(self):
+        if self.path is not None and self.mode != 'c':
+            self.array.flush()
+            self.mode = 'c'
+            self.array = numpy.memmap(self.path, dtype=self.array.dtype, mode='c', shape=(len(self.array),))
+            self.view_columns()
+
+    # Everything but the array, for a memory-mapped store whose file is saved on its own
+    def layout(self):
+        return {'dtype': self.dtype, 'path': self.path, 'rows': self.rows, 'extra': self.extra}
+
+    # A memory-mapped store from its layout, mapping data_file copied to the store's path, or the file already there
+    @classmethod
+    def reopen(cls, layout, data_file=None):
+        store = cls.__new__(cls)
+        store.dtype = layout['dtype']
+        store.path = layout['path']
+        store.rows = layout['rows']
+        store.extra = layout['extra']
+        store.mode = 'r+'
+        if data_file is not None:
+            copy_file(data_file, store.path)
+        dtype = store.row_dtype()
+        store.array = numpy.memmap(store.path, dtype=dtype, mode='r+',
+                                   shape=(os.path.getsize(store.path) // dtype.itemsize,))
+        store.view_columns()
+        return store
+
+    def __getstate__(self):
+        return {'dtype': self.dtype, 'rows': self.rows, 'extra': self.extra, 'array': numpy.array(self.array[:len(self)])}
+
+    def __setstate__(self, state):
+        self.dtype = state['dtype']
+        self.path = None
+        self.mode = 'r+'
+        self.rows = state['rows']
+        self.extra = state['extra']
+        self.array = self.allocate(max(1, len(self.rows)), state['array'])
+        self.view_columns()
+
+
+# One agent's data in an AgentStore, read and written like a dict. Fixed fields come back as Python values, and
+# removing one clears it.
+class AgentRecord(MutableMapping):
+
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key):
+        column = self.store.columns.get(key)
+        if column is not None:
+            if self.store.set_flags[self.row, self.store.field_numbers[key]]:
+                return column.item(self.row)
+            raise KeyError(key)
+        extra = self.store.extra.get(self.row)
+        if extra is None:
+            raise KeyError(key)
+        return extra[key]
+
+    def __setitem__(self, key, value):
+        column = self.store.columns.get(key)
+        if column is not None:
+            column[self.row] = value
+            self.store.set_flags[self.row, self.store.field_numbers[key]] = True
+        else:
+            self.store.extra.setdefault(self.row, dict())[key] = value
+
+    def __delitem__(self, key):
+        column = self.store.columns.get(key)
+        if column is not None:
+            if key not in self:
+                raise KeyError(key)
+            column[self.row] = numpy.zeros(1, dtype=column.dtype)[0]
+            self.store.set_flags[self.row, self.store.field_numbers[key]] = False
+            return
+        extra = self.store.extra.get(self.row)
+        if extra is None:
+            raise KeyError(key)
+        del extra[key]
+        if not extra:
+            del self.store.extra[self.row]
+
+    def __iter__(self):
+        flags = self.store.set_flags[self.row]
+        for (i, name) in enumerate(self.store.dtype.names):
+            if flags[i]:
+                yield name
+        for key in self.store.extra.get(self.row, ()):
+            yield key
+
+    def __len__(self):
+        return int(self.store.set_flags[self.row].sum()) + len(self.store.extra.get(self.row, ()))
+
+    def __contains__(self, key):
+        if key in self.store.columns:
+            return bool(self.store.set_flags[self.row, self.store.field_numbers[key]])
+        return key in self.store.extra.get(self.row, ())
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+# The name of the flags in each row of an AgentStore for which fixed fields are set
+fields_set = 'fields_set'
+
+
+class AgentTuples(Sequence):
+
+    def __init__(self, store, agent):
+        self.store = store
+        self.agent = agent
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return (self.agent, AgentRecord(self.store, index))
+
+
+# The (agent, agent data) pairs passed to agents' decision cycles
+def agent_tuples(agent, agents_data):
+    if isinstance(agents_data, AgentStore):
+        return agents_data.agent_tuples(agent)
+    return [(agent, agent_data) for agent_data in agents_data.values()]
+
+
+# Copy a file through a temporary file that is then renamed, so that neither a reader of path, such as a store that
+# has it mapped, nor a crash sees it half written
+def copy_file(source, path):
+    temporary = path + '.tmp'
+    with open(source, 'rb') as f, open(temporary, 'wb') as out:
+        shutil.copyfileobj(f, out, 1 << 20)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temporary, path)
+
+
+# Agent data that can be pickled on its own, copying records out of their store
+def detached(agent_data):
+    return dict(agent_data) if isinstance(agent_data, AgentRecord) else agent_data
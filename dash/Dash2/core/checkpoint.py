@@ -0,0 +1,160 @@
+import os
+import pickle
+import random
+import numpy
+from Dash2.core.event_log import EventLogWriter, ColumnarEventWriter
+from Dash2.core.agent_store import AgentStore, copy_file, detached
+
+
+# Checkpoints of a LocalWorkProcessor run, so that a long run that dies can be resumed from its last checkpoint with
+# the resume_from option. A checkpoint directory holds
+#   agents-<n>.pkl        the data of every agent, written at the first checkpoint and again when the changes since
+#                         then add up to more records than there are agents
+#   agents-<n>.dat        with a memory-mapped AgentStore, a copy of its file, while agents-<n>.pkl holds the rest of
+#                         the store; on resume the copy is copied back to the store's path and mapped again
+#   changes-<n>-<m>.pkl   the data of the agents activated since the previous checkpoint
+#   state.pkl             the event queue, time, iteration and event counters, the states of the random and
+#                         numpy.random generators, the length of the output log, the files above that make up the
+#                         agents' data, and the agent's own state if it has checkpoint_state and restore_state methods
+# Files are pickled and written to a temporary file that is then renamed, and state.pkl is written last, so a run that
+# dies while writing a checkpoint resumes from the one before. Agent data is assumed to change only when its agent is
+# activated; call save(full=True) after changing other agents' data.
+class Checkpointer(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.generation = 0  # number of the current agents file
+        self.changes = []  # changes files since the current agents file
+        self.changed_records = 0
+        self.dirty = set()  # ids of agents activated since the last checkpoint
+        self.started = False  # the first checkpoint writes all agents' data, replacing any files already there
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, 'state.pkl')):
+            with open(os.path.join(directory, 'state.pkl'), 'rb') as f:
+                files = pickle.load(f)['files']
+            self.generation = int(files[0][len('agents-'):-len('.pkl')])
+            self.changes = files[1:]
+
+    def save(self, processor, full=False):
+        agents_data = processor.agents_data
+        old_files = []
+        if full or not self.started or self.changed_records + len(self.dirty) > len(agents_data):
+            old_files = self.data_files()
+            self.generation += 1
+            self.changes = []
+            self.changed_records = 0
+            name = self.data_files()[0]
+            if isinstance(agents_data, AgentStore) and agents_data.path is not None and agents_data.mode == 'r+':
+                agents_data.flush()
+                copy_file(agents_data.path, os.path.join(self.directory, mapped_file(name)))
+                write_atomically(os.path.join(self.directory, name),
+                                 MappedAgents(agents_data.layout(), mapped_file(name)))
+            else:
+                write_atomically(os.path.join(self.directory, name), agents_data)
+            self.started = True
+        elif self.dirty:
+            name = 'changes-%d-%d.pkl' % (self.generation, len(self.changes))
+            write_atomically(os.path.join(self.directory, name),
+                             dict((agent_id, detached(agents_data[agent_id])) for agent_id in self.dirty))
+            self.changes.append(name)
+            self.changed_records += len(self.dirty)
+        self.dirty.clear()
+        state = {'files': self.data_files(),
+                 'queue': processor.event_queue,
+                 'time': processor.time,
+                 'iteration': processor.iteration,
+                 'event_counter': processor.event_counter,
+                 'random': random.getstate(),
+                 'numpy_random': numpy.random.get_state(),
+                 'log': log_position(processor.json_log_file)}
+        if hasattr(processor.agent, 'checkpoint_state'):
+            state['agent'] = processor.agent.checkpoint_state()
+        write_atomically(os.path.join(self.directory, 'state.pkl'), state)
+        for name in old_files + [mapped_file(name) for name in old_files[:1]]:
+            if os.path.exists(os.path.join(self.directory, name)):
+                os.remove(os.path.join(self.directory, name))
+
+    def data_files(self):
+        return ['agents-%d.pkl' % self.generation] + self.changes
+
+
+# A memory-mapped AgentStore in a checkpoint: its layout, and the name of the copy of its file
+class MappedAgents(object):
+
+    def __init__(self, layout, data_file):
+        self.layout = layout
+        self.data_file = data_file
+
+
+def mapped_file(name):
+    return name[:-len('.pkl')] + '.dat'
+
+
+# Read the latest checkpoint in directory, returning the state with the agents' data under 'agents_data'
+def load_checkpoint(directory):
+    with open(os.path.join(directory, 'state.pkl'), 'rb') as f:
+        state = pickle.load(f)
+    files = state['files']
+    with open(os.path.join(directory, files[0]), 'rb') as f:
+        agents_data = pickle.load(f)
+    if isinstance(agents_data, MappedAgents):
+        agents_data = AgentStore.reopen(agents_data.layout, os.path.join(directory, agents_data.data_file))
+    for name in files[1:]:
+        with open(os.path.join(directory, name), 'rb') as f:
+            agents_data.update(pickle.load(f))
+    state['agents_data'] = agents_data
+    return state
+
+
+def write_atomically(path, data):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+# Where the output log is at a checkpoint. A line log writes out what is buffered and syncs it to disk, since a resume
+# truncates the log to this offset and must not find it shorter. The events waiting to make up a columnar log's next
+# chunk are kept in the checkpoint instead, so checkpoints don't cut chunks short.
+def log_position(writer):
+    if isinstance(writer, ColumnarEventWriter):
+        return {'chunks': writer.chunks, 'schema': writer.schema, 'rows': list(writer.rows)}
+    writer.flush()
+    if isinstance(writer, EventLogWriter):
+        try:
+            os.fsync(writer.file.fileno())
+        except (AttributeError, OSError, ValueError):
+            pass  # a stream with no file behind it
+        return {'offset': writer.file.tell()}
+    return None
+
+
+def restore_checkpoint(processor, checkpoint):
+    processor.agents_data = checkpoint['agents_data']
+    processor.event_queue = checkpoint['queue']
+    processor.time = checkpoint['time']
+    processor.iteration = checkpoint['iteration']
+    processor.event_counter = checkpoint['event_counter']
+    random.setstate(checkpoint['random'])
+    numpy.random.set_state(checkpoint['numpy_random'])
+    if 'agent' in checkpoint:
+        processor.agent.restore_state(checkpoint['agent'])
+    if isinstance(processor.json_log_file, ColumnarEventWriter) and checkpoint['log'] is not None:
+        processor.json_log_file.chunks = checkpoint['log']['chunks']
+        processor.json_log_file.schema = checkpoint['log']['schema']
+        processor.json_log_file.rows = list(checkpoint['log'].get('rows', []))
+
+
+# Drop whatever was logged after a checkpoint from the output, so the resumed run doesn't log events twice
+def truncate_log(path, position):
+    if position is None:
+        return
+    if 'offset' in position:
+        if os.path.exists(path):
+            os.truncate(path, position['offset'])
+    else:
+        for name in os.listdir(path) if os.path.isdir(path) else []:
+            if name.startswith('part-') and int(name.split('.')[0][len('part-'):]) >= position['chunks']:
+                os.remove(os.path.join(path, name))
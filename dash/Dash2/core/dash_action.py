@@ -1,4 +1,3 @@
-from Dash2.core.string_aux import convert_camel
 from Dash2.core.system2 import System2Agent, substitute
 from Dash2.core.system1 import System1Agent
 from Dash2.core.client import Client
@@ -108,7 +107,8 @@ class DASHAction(Client, System1Agent, System2Agent):
 
     # If system1 proposes some actions, should the agent just go with them or opt to employ deliberative reasoning?
     def bypass_system2(self, system1_action_nodes):
-        print('considering system1 suggested actions ', system1_action_nodes)
+        if self.traceAction:
+            print('considering system1 suggested actions ', system1_action_nodes)
         return True  # try system 1 by default if it's available
 
     def primitiveActions(self, l):
@@ -119,21 +119,15 @@ class DASHAction(Client, System1Agent, System2Agent):
                 self.primitiveActionDict[item] = item # store the name and look for the function at planning time
             else:
                 self.primitiveActionDict[item[0]] = item[1]
+        self.primitiveFunctionCache = dict()  # resolved functions may now be out of date
+        self.plan_frames = None  # and so may a cached plan
 
-    # This format is now inefficient since we have different ways that a predicate can be a primitive action
+    # The function is found by primitive_function in system2, which caches it for the agent
     def perform_action(self, action):
         if self.isPrimitive(action):
-            predicate = action[0]
-            if predicate in self.primitiveActionDict:
-                function = self.primitiveActionDict[action[0]]
-            elif hasattr(self, predicate) and callable(getattr(self, predicate)):
-                function = getattr(self, predicate)
-            else:
-                underscore_action = convert_camel(predicate)
-                if hasattr(self, underscore_action) and callable(getattr(self, underscore_action)):
-                    function = getattr(self, underscore_action)
-                else:
-                    return
+            function = self.primitive_function(action[0])
+            if function is None:
+                return
             return function(action)
 
     def update_beliefs(self, result, action):
@@ -3,6 +3,7 @@ SECONDS_IN_DAY = 24 * 3600
 import json
 import pickle
 from Dash2.core.string_aux import convert_camel
+from Dash2.core.event_log import EventLogWriter, ColumnarEventWriter, event_log_writer
 
 class DESAgent(object):
     """
@@ -10,6 +11,7 @@ class DESAgent(object):
     DES agent API includes these methods
     - agent_loop(self, **kwargs)
     - agent_decision_cycle(self, **kwargs)
+    - batch_decision_cycle(self, agent_data_list, event_time, **kwargs)
     - next_event_time(self, **kwargs)
     """
 
@@ -65,6 +67,23 @@ class DESAgent(object):
         return None
         # return action
 
+    ####################################################################################################################
+    # Decision step for several agents activated at the same time.
+    ####################################################################################################################
+    def batch_decision_cycle(self, agent_data_list, event_time, **kwargs):
+        """
+        Called when several agents are activated at the same event time, or in the same time window, e.g. by
+        LocalWorkProcessor with batch_events. Sub-classes that can decide for many agents at once, such as with one
+        vectorized prediction, override this. By default it calls agent_decision_cycle for each agent in turn.
+        :param agent_data_list: the activated agents' data objects
+        :param event_time: the earliest of the agents' event times
+        :param event_times: optional list of each agent's own event time
+        :return: list of the results of each agent's decision cycle
+        """
+        event_times = kwargs.pop('event_times', None) or [event_time] * len(agent_data_list)
+        return [self.agent_decision_cycle(agent_data=agent_data, event_time=agent_time, **kwargs)
+                for agent_data, agent_time in zip(agent_data_list, event_times)]
+
     # this is an example of an action. Descendants of DESAgent class must implement their own action methods.
     def do_nothing(self, **kwargs):
         print("DES agent empty action.")
@@ -94,10 +113,11 @@ class DESAgent(object):
     ####################################################################################################################
     def log_event(self, log_data, log_file=None, format='json', verbose=False):
         """
-        Print log data.
+        Log event data. Events go through a buffered EventLogWriter, so logging doesn't wait for the disk.
         :param log_data:
-        :param log_file: if string opens file, otherwise interprets it as fp
-        :param format: 'json' or 'pickle'
+        :param log_file: an EventLogWriter or ColumnarEventWriter, a path, which is opened once and shared by everything logging to it, or
+        a file object
+        :param format: 'json' or 'pickle', used when log_file is a path or a file object
         :param verbose:
         :return:
         """
@@ -107,29 +127,31 @@ class DESAgent(object):
                 log_file.write("\n")
             elif format == 'pickle':
                 pickle.dump(log_data, log_file)
-                log_file.write("\n")
 
         def _dump_to_file(log_data, log_file):
-            if isinstance(log_file, str):
-                with open(log_file, "a+") as fp:
-                    _dump_data(log_data, fp)
+            if isinstance(log_file, (EventLogWriter, ColumnarEventWriter)):
+                log_file.write(log_data)
+            elif isinstance(log_file, str):
+                event_log_writer(log_file, 'pickle' if format == 'pickle' else 'ndjson').write(log_data)
             else:
                 _dump_data(log_data, log_file)
 
         if verbose:
             print(log_data)
 
+        targets = []
         if log_file is not None:
-            _dump_to_file(log_data, log_file)
-
+            targets.append(log_file)
         if self.log_file is not None:
-            _dump_to_file(log_data, self.log_file)
-
+            targets.append(self.log_file)
         if self.log_file is None and log_file is None and self.hub is not None:
             if hasattr(self.hub, 'json_log_file'):
-                _dump_to_file(log_data, self.hub.json_log_file)
+                targets.append(self.hub.json_log_file)
             if hasattr(self.hub, 'log_file'):
-                _dump_to_file(log_data, self.hub.log_file)
+                targets.append(self.hub.log_file)
+        for i, target in enumerate(targets):
+            if target is not None and target not in targets[:i]:  # log each event once to each target
+                _dump_to_file(log_data, target)
 
 
     ####################################################################################################################
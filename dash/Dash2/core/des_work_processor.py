@@ -3,9 +3,18 @@ sys.path.extend(['../../']) # need to have 'webdash' directory in $PYTHONPATH, i
 import json
 import time
 import os
+import io
+import pickle
+import multiprocessing
+import traceback
+from collections.abc import Mapping
 from datetime import  datetime
-from heapq import heappush, heappop
 from pathlib import Path
+from Dash2.core.event_log import EventLogWriter, ColumnarEventWriter
+from Dash2.core.event_queue import make_event_queue
+from Dash2.core.agent_store import AgentStore, agent_tuples, detached
+from Dash2.core.telemetry import Telemetry
+from Dash2.core.checkpoint import Checkpointer, load_checkpoint, restore_checkpoint, truncate_log
 
 MAX_NUMBER_OF_ITERATIONS = 15000000
 
@@ -27,6 +36,8 @@ class WorkProcessor:
 
         #self.log_file = open(task_full_id + '_event_log_file.txt', 'w')
         self.iteration = 0
+        # progress metrics, published when metrics_port and/or metrics_file are among the parameters:
+        self.telemetry = Telemetry(self)
         # init agents and their relationships with repos
 
     def initialize(self):
@@ -37,6 +48,8 @@ class WorkProcessor:
     def process_task(self):
         self.initialize()
         if self.zk is not None and self.task_full_id is not None:
+            self.telemetry.publish(port=getattr(self, 'metrics_port', None), path=getattr(self, 'metrics_file', None),
+                                   interval=getattr(self, 'metrics_interval', 10.0))
             while not self.should_stop():
                 self.run_one_iteration()
                 self.process_after_iteration()
@@ -44,11 +57,13 @@ class WorkProcessor:
                 if self.iteration % 100000 == 0 :
                     node_path = "/tasks/nodes/" + str(self.host_id) + "/" + self.task_full_id
                     self.zk.ensure_path(node_path + "/status")
-                    self.zk.set(node_path + "/status", json.dumps({"status": "in progress", "iteration": self.iteration, "update time": time.time()}))
+                    self.zk.set(node_path + "/status", json.dumps({"status": "in progress", "iteration": self.iteration, "update time": time.time(),
+                                                                   "metrics": self.telemetry.snapshot()}))
                     print("Iteration " + str(self.iteration) + " " \
                           + str({"status": "in progress", "iteration": self.iteration, "update time": time.strftime("%H:%M:%S", time.gmtime(time.time()))}))
 
             self.process_after_run()
+            self.telemetry.close()
 
             result_path = "/experiments/" + str(self.exp_id) + "/trials/" + str(self.trial_id) + "/nodes/" + str(self.host_id) + "/dependent_variables/"
             dep_vars = self.get_dependent_vars()
@@ -72,6 +87,7 @@ class WorkProcessor:
         for agent in self.agents:
             if not self.agent_should_stop(agent):
                 next_action = agent.agent_decision_cycle(max_iterations=1, disconnect_at_end=False)  # don't disconnect since will run again
+                self.telemetry.count_action(next_action)
                 self.process_after_agent_action(agent, next_action)
 
     def get_dependent_vars(self):
@@ -98,11 +114,25 @@ class LocalWorkProcessor(object):
 
     def __init__(self, output_file_name, start_time, end_time, agent, create_initial_state_fn, settings=None, **kwargs):
         self.agents_data = {} # decision data objects; each agent's state is kept in agent's data object
-        self.events_heap = [] # work queue for discrete event simulation
+        # work queue for discrete event simulation: 'heap', 'calendar' or 'bucketed', see event_queue.py
+        self.event_queue = make_event_queue(kwargs.get('event_queue', 'heap'), **kwargs.get('event_queue_options', {}))
         self.event_counter = 0 # counter of events logged into output file
         self.iteration = 0 # how many times agent loop was called
         self.max_iterations = kwargs.get('max_iterations', MAX_NUMBER_OF_ITERATIONS) # max number of times agent's loop can be called.
+        # with batch_events, each iteration activates all the agents with events at the next event time together, or
+        # with events within batch_window seconds of it:
+        self.batch_events = kwargs.get('batch_events', False)
+        self.batch_window = kwargs.get('batch_window', 0)
+        self.activated = None # set to a set to collect the ids of the agents activated
+        self.agent_stream = None # streamed agents still to be admitted, with lazy_admission
+        self.next_agent = None # the next of them, read ahead, as (first event time, agent id, agent data)
+        self.admitted_time = None # first event time of the last agent admitted
         verbose = kwargs.get('verbose', True)
+        # progress metrics (see telemetry.py), served on metrics_port and/or written to the Prometheus text file
+        # metrics_file every metrics_interval seconds while the experiment runs:
+        self.telemetry = Telemetry(self)
+        self.metrics_options = {'port': kwargs.get('metrics_port'), 'path': kwargs.get('metrics_file'),
+                                'interval': kwargs.get('metrics_interval', 10.0)}
         self.time = start_time # global event clock
         self.env = dict() # environment object
         self.agent = agent
@@ -110,33 +140,127 @@ class LocalWorkProcessor(object):
         # simulation start and end time:
         self.start_time = time.mktime(datetime.strptime(str(start_time) + ' 00:00:00', "%Y-%m-%d %H:%M:%S").timetuple())
         self.max_time = time.mktime(datetime.strptime(str(end_time) + ' 23:59:59', "%Y-%m-%d %H:%M:%S").timetuple())
-        # output file:
+        # with resume_from, a checkpoint directory, the run continues from the checkpoint instead of the initial state
+        checkpoint = load_checkpoint(kwargs['resume_from']) if kwargs.get('resume_from') is not None else None
+
+        # output file, written in batches by a background thread, or with output_format 'columnar' a directory of
+        # columnar chunk files (see ColumnarEventWriter). A resumed run drops what was logged after the checkpoint.
         self.output_file_name = output_file_name
-        self.json_log_file = open(self.output_file_name, 'w')
+        if checkpoint is not None:
+            truncate_log(self.output_file_name, checkpoint['log'])
+        if kwargs.get('output_format', 'lines') == 'columnar':
+            self.json_log_file = ColumnarEventWriter(self.output_file_name, mode='w' if checkpoint is None else 'a',
+                                                     chunk_size=kwargs.get('log_chunk_size', 100000))
+        else:
+            self.json_log_file = EventLogWriter(self.output_file_name, mode='w' if checkpoint is None else 'a',
+                                                format=kwargs.get('log_format', 'ndjson'),
+                                                flush_size=kwargs.get('log_flush_size', 1000),
+                                                flush_interval=kwargs.get('log_flush_interval', 1.0))
 
-        # create initial state, load it from dataframe
-        self.agents_data = create_initial_state_fn(kwargs["training_file"], kwargs["initial_state_file"], **kwargs)
-        self.agents_data_tuples = [(self.agent, d) for d in self.agents_data.values()]
-
-        # populate queue (initial state)
-        for agent_id in self.agents_data.keys():
-            if 'last_event_time' in self.agents_data[agent_id]:
-                let = self.agents_data[agent_id]['last_event_time']
-                last_event_time = int(let)#time.mktime(datetime.strptime(str(let), "%Y-%m-%d %H:%M:%S").timetuple())
-                next_event_time = self.agent.next_event_time(agent_data=self.agents_data[agent_id],
-                                                             curr_time=last_event_time,
-                                                             start_time=self.start_time,
-                                                             max_time= self.max_time)
+        # checkpoints every checkpoint_every iterations into checkpoint_dir, writing only the data of agents
+        # activated since the last one (see checkpoint.py):
+        self.checkpointer = None
+        if kwargs.get('checkpoint_dir') is not None:
+            if kwargs.get('lazy_admission', False):
+                raise ValueError("runs with lazy_admission can't be checkpointed")
+            self.checkpointer = Checkpointer(kwargs['checkpoint_dir'])
+            self.checkpoint_every = kwargs.get('checkpoint_every', 100000)
+            self.activated = self.checkpointer.dirty
+
+        if checkpoint is not None:
+            restore_checkpoint(self, checkpoint)
+            self.agents_data_tuples = agent_tuples(self.agent, self.agents_data)
+            if verbose:
+                print("INFO: Resumed at iteration ", str(self.iteration), " with agents ", str(len(self.agents_data)))
+            return
+
+        # create initial state, load it from dataframe. create_initial_state_fn returns a dict of each agent's data, or
+        # for large populations an AgentStore (see agent_store.py), or it streams agents as an iterable of
+        # (agent id, agent data) pairs, e.g. from stream_initial_state. Streamed agents are scheduled as they are read,
+        # into the agent_store given, or a dict. With lazy_admission, they are read only when the clock reaches their
+        # first event, so the stream must be in order of the agents' first events, and the agents passed to
+        # agent_decision_cycle are only those admitted so far: leave it off for agents that look through the
+        # population, e.g. to pick others to interact with, unless they should only see agents already active.
+        initial_state = create_initial_state_fn(kwargs["training_file"], kwargs["initial_state_file"], **kwargs)
+        if isinstance(initial_state, Mapping):
+            self.agents_data = initial_state
+            self.agents_data_tuples = agent_tuples(self.agent, self.agents_data)
+            # populate queue (initial state)
+            for agent_id in self.agents_data.keys():
+                next_event_time = self.first_event_time(self.agents_data[agent_id])
                 if next_event_time is not None:
-                    heappush(self.events_heap, (next_event_time, agent_id))
+                    self.event_queue.push(next_event_time, agent_id)
+        else:
+            self.agents_data = kwargs['agent_store'] if kwargs.get('agent_store') is not None else dict()
+            self.agents_data_tuples = agent_tuples(self.agent, self.agents_data)
+            self.agent_stream = iter(initial_state)
+            if not kwargs.get('lazy_admission', False):
+                for agent_id, agent_data in self.agent_stream:
+                    next_event_time = self.first_event_time(self.add_agent(agent_id, agent_data))
+                    if next_event_time is not None:
+                        self.event_queue.push(next_event_time, agent_id)
+                self.agent_stream = None
 
         if verbose:
             print("INFO: Agents instantiated ", str(len(self.agents_data)))
 
+    # The old name of the work queue, when it was a heapq list: for a 'heap' queue this is still that list of
+    # (time, agent_id) events, so code using heapq on it keeps working; other queues have no such list.
+    @property
+    def events_heap(self):
+        heap = getattr(self.event_queue, 'heap', None)
+        if heap is None:
+            raise AttributeError("events_heap is only available with the 'heap' event queue, use event_queue")
+        return heap
+
+    # Time of an agent's first event, after its last_event_time, or None if it has none
+    def first_event_time(self, agent_data):
+        if 'last_event_time' not in agent_data:
+            return None
+        let = agent_data['last_event_time']
+        last_event_time = int(let)#time.mktime(datetime.strptime(str(let), "%Y-%m-%d %H:%M:%S").timetuple())
+        return self.agent.next_event_time(agent_data=agent_data,
+                                          curr_time=last_event_time,
+                                          start_time=self.start_time,
+                                          max_time= self.max_time)
+
+    # Add a streamed agent, returning its data as stored, e.g. a record of the agent store
+    def add_agent(self, agent_id, agent_data):
+        self.agents_data[agent_id] = agent_data
+        agent_data = self.agents_data[agent_id]
+        if isinstance(self.agents_data_tuples, list):
+            self.agents_data_tuples.append((self.agent, agent_data))
+        return agent_data
+
+    # With lazy_admission, add the streamed agents whose first events come before or with the next event in the queue
+    def admit_agents(self):
+        while self.agent_stream is not None:
+            if self.next_agent is None:
+                record = next(self.agent_stream, None)
+                if record is None:
+                    self.agent_stream = None
+                    return
+                agent_id, agent_data = record
+                self.next_agent = (self.first_event_time(agent_data), agent_id, agent_data)
+            (next_event_time, agent_id, agent_data) = self.next_agent
+            if next_event_time is not None:
+                if len(self.event_queue) > 0 and next_event_time > self.event_queue.peek()[0]:
+                    return
+                if self.admitted_time is not None and next_event_time < self.admitted_time:
+                    raise ValueError("agent " + str(agent_id) + " was streamed after agents with later first events")
+                self.admitted_time = next_event_time
+            self.next_agent = None
+            self.add_agent(agent_id, agent_data)
+            if next_event_time is not None:
+                self.event_queue.push(next_event_time, agent_id)
+
     def run_experiment(self):
+        self.telemetry.publish(**self.metrics_options)
         while not self.should_stop():
             self.run_one_iteration()
             self.iteration += 1
+            if self.checkpointer is not None and self.iteration % self.checkpoint_every == 0:
+                self.checkpointer.save(self)
             if self.iteration % 1000 == 0:
                 print("Iteration ", str(self.iteration), " ",
                       str({"iteration": self.iteration,
@@ -148,31 +272,283 @@ class LocalWorkProcessor(object):
         if self.agent is None:
             raise ValueError('WorkProcessor.agent is None.')
 
-        event_time, agent_id = heappop(self.events_heap)
+        if self.agent_stream is not None:
+            self.admit_agents()
+
+        if self.batch_events:
+            self.run_one_batch()
+            return
+
+        event_time, agent_id = self.event_queue.pop()
+        if self.activated is not None:
+            self.activated.add(agent_id)
         self.set_curr_time(event_time)
-        self.agent.agent_decision_cycle(agent_data=self.agents_data[agent_id], event_time=event_time, agents=self.agents_data_tuples)
+        action = self.agent.agent_decision_cycle(agent_data=self.agents_data[agent_id], event_time=event_time, agents=self.agents_data_tuples)
+        self.telemetry.count_action(action)
         next_event_time = self.agent.next_event_time(agent_data=self.agents_data[agent_id],
                                                      curr_time=event_time,
                                                      start_time=self.start_time,
                                                      max_time=self.max_time)
         if next_event_time is not None:
-            heappush(self.events_heap, (next_event_time, agent_id))
+            self.event_queue.push(next_event_time, agent_id)
         self.event_counter += 1
 
+    # Pop every event at the earliest event time, or before batch_window seconds after it, and hand the agents' data
+    # to the agent's batch_decision_cycle, with each agent's own event time in event_times, so that it can decide for
+    # the whole cohort at once, or call agent_decision_cycle for each agent in turn if it has no batch_decision_cycle.
+    # Next events are scheduled after the whole batch has been processed, so with a window an agent acts at most once
+    # per batch, and no earlier than the last event time in the batch, so that simulated time never goes back.
+    def run_one_batch(self):
+        event_time, agent_id = self.event_queue.pop()
+        agent_ids = [agent_id]
+        event_times = [event_time]
+        window_end = event_time + self.batch_window
+        while len(self.event_queue) > 0:
+            next_time = self.event_queue.peek()[0]
+            if next_time != event_time and next_time >= window_end:
+                break
+            agent_ids.append(self.event_queue.pop()[1])
+            event_times.append(next_time)
+        if self.activated is not None:
+            self.activated.update(agent_ids)
+        self.set_curr_time(event_time)
+        agent_data_list = [self.agents_data[agent_id] for agent_id in agent_ids]
+        batch_decision_cycle = getattr(self.agent, 'batch_decision_cycle', None)
+        if batch_decision_cycle is not None:
+            actions = batch_decision_cycle(agent_data_list, event_time, event_times=event_times, agents=self.agents_data_tuples)
+        else:
+            actions = [self.agent.agent_decision_cycle(agent_data=agent_data, event_time=agent_time, agents=self.agents_data_tuples)
+                       for agent_data, agent_time in zip(agent_data_list, event_times)]
+        for action in actions or []:
+            self.telemetry.count_action(action)
+        for agent_id, agent_data, agent_time in zip(agent_ids, agent_data_list, event_times):
+            next_event_time = self.agent.next_event_time(agent_data=agent_data,
+                                                         curr_time=agent_time,
+                                                         start_time=self.start_time,
+                                                         max_time=self.max_time)
+            if next_event_time is not None:
+                self.event_queue.push(max(next_event_time, event_times[-1]), agent_id)
+        self.event_counter += len(agent_ids)
+
     def should_stop(self):
         if self.max_iterations > 0 and self.iteration >= self.max_iterations:
             print('reached end of iterations for trial')
             return True
-        if len(self.events_heap) == 0:
+        if self.agent_stream is not None:
+            self.admit_agents()
+        if len(self.event_queue) == 0:
             print('reached end of event queue, no more events')
             return True
         return False
 
+    # Process the events before end_time, for running in windows of simulated time
+    def run_until(self, end_time):
+        next_time = self.next_time()
+        while next_time is not None and next_time < end_time:
+            self.run_one_iteration()
+            self.iteration += 1
+            next_time = self.next_time()
+
+    # Time of the next event, or None if there are no more events to process
+    def next_time(self):
+        if self.agent_stream is not None:
+            self.admit_agents()
+        if len(self.event_queue) == 0 or (self.max_iterations > 0 and self.iteration >= self.max_iterations):
+            return None
+        return self.event_queue.peek()[0]
+
     def set_curr_time(self, curr_time):
         self.time = curr_time
 
     def process_after_run(self):  # do any post processing before closing the output file
-        self.json_log_file.close() # close log
+        self.json_log_file.close() # flush and close log
+        self.telemetry.close()
+
+
+# Discrete event simulation in several processes. The agents from create_initial_state_fn are divided among the
+# processes, each running a LocalWorkProcessor with its own event queue for its share of the agents. The processes
+# advance together in windows of lookahead seconds of simulated time, starting from the earliest pending event: each
+# processes its events before the end of the window and then waits at a barrier for the others. At the barrier the
+# data of the agents that acted in the window is sent to the other processes, with share_agent_data, so agents see
+# each other's data as of the end of the last window. This is a conservative parallel simulation when lookahead is
+# at most the shortest time in which one agent's action can affect another, which only the model knows: it must be
+# given, as lookahead or as the agent's min_event_interval.
+# Each process logs to its own file, output_file_name.part<n>, and the files are merged window by window into the
+# output file after the run, each window's events sorted by time and agent id. max_iterations applies to each
+# process. Processes are forked, so the agent and create_initial_state_fn need not be picklable, but agent data that
+# is shared must be; on platforms without fork, such as Windows, use LocalWorkProcessor.
+class ParallelWorkProcessor(object):
+
+    def __init__(self, output_file_name, start_time, end_time, agent, create_initial_state_fn, settings=None,
+                 processes=None, lookahead=None, **kwargs):
+        if kwargs.get('output_format', 'lines') == 'columnar':
+            raise ValueError("ParallelWorkProcessor writes line logs, not columnar output")
+        if kwargs.get('resume_from') is not None or kwargs.get('checkpoint_dir') is not None:
+            raise ValueError("ParallelWorkProcessor runs can't be checkpointed")
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("ParallelWorkProcessor forks its processes, which this platform can't do, "
+                               "use LocalWorkProcessor instead")
+        if lookahead is None:
+            lookahead = getattr(agent, 'min_event_interval', None)
+        if lookahead is None or lookahead <= 0:
+            raise ValueError("ParallelWorkProcessor needs a positive lookahead, the shortest time in simulated seconds "
+                             "in which an agent's action can affect another agent, given as lookahead or as the "
+                             "agent's min_event_interval")
+        self.output_file_name = output_file_name
+        self.start_time = start_time
+        self.end_time = end_time
+        self.agent = agent
+        self.settings = settings
+        self.kwargs = kwargs
+        self.lookahead = lookahead
+        self.share_agent_data = kwargs.get('share_agent_data', True)
+        self.agents_data = create_initial_state_fn(kwargs["training_file"], kwargs["initial_state_file"], **kwargs)
+        if not isinstance(self.agents_data, Mapping): # streamed agents
+            agents_data = kwargs['agent_store'] if kwargs.get('agent_store') is not None else dict()
+            for agent_id, agent_data in self.agents_data:
+                agents_data[agent_id] = agent_data
+            self.agents_data = agents_data
+        self.processes = max(1, min(processes or os.cpu_count() or 1, len(self.agents_data)))
+        self.event_counter = 0 # events processed by all processes
+        self.windows = 0
+        self.time = None
+        if kwargs.get('verbose', True):
+            print("INFO: Agents instantiated ", str(len(self.agents_data)), " in ", str(self.processes), " processes")
+
+    def partitions(self):
+        parts = [dict() for _ in range(self.processes)]
+        for i, (agent_id, agent_data) in enumerate(self.agents_data.items()):
+            parts[i % self.processes][agent_id] = agent_data
+        return parts
+
+    def run_experiment(self):
+        context = multiprocessing.get_context('fork')
+        part_files = [self.output_file_name + '.part' + str(number) for number in range(self.processes)]
+        connections = []
+        workers = []
+        for part_file, part in zip(part_files, self.partitions()):
+            connection, worker_connection = context.Pipe()
+            worker = context.Process(target=self.run_partition, args=(worker_connection, part_file, part))
+            worker.start()
+            worker_connection.close()
+            connections.append(connection)
+            workers.append(worker)
+        finished = False
+        try:
+            times = [self.receive(connection)[1] for connection in connections]
+            offsets = [[0] for _ in workers] # each part file's length at the end of each window
+            counts = [0 for _ in workers]
+            updates = [dict() for _ in workers] # agent data to send to each process
+            while any(t is not None for t in times):
+                window_end = min(t for t in times if t is not None) + self.lookahead
+                for connection, update in zip(connections, updates):
+                    connection.send((window_end, update))
+                updates = [dict() for _ in workers]
+                for number, connection in enumerate(connections):
+                    (_, times[number], offset, changed, counts[number]) = self.receive(connection)
+                    offsets[number].append(offset)
+                    for other in range(len(workers)):
+                        if other != number:
+                            updates[other].update(changed)
+                self.windows += 1
+                self.time = window_end
+            for connection in connections:
+                connection.send(None)
+                self.receive(connection)
+            finished = True
+        finally:
+            for worker in workers:
+                if not finished:
+                    worker.terminate()
+                worker.join()
+        self.event_counter = sum(counts)
+        self.merge_logs(part_files, offsets)
+
+    def receive(self, connection):
+        message = connection.recv()
+        if message[0] == 'error':
+            raise RuntimeError("ParallelWorkProcessor worker failed:\n" + message[1])
+        return message
+
+    # Runs in each process: answers each window from the parent with the time of the next event, the length of the
+    # log so far, the data of the agents that acted and the number of events processed
+    def run_partition(self, connection, part_file, part):
+        try:
+            kwargs = dict(self.kwargs, verbose=False, metrics_port=None, metrics_file=None)
+            processor = LocalWorkProcessor(part_file, self.start_time, self.end_time, self.agent,
+                                           lambda *args, **_: part, self.settings, **kwargs)
+            if isinstance(self.agents_data, AgentStore):
+                self.agents_data.copy_on_write() # updates from other processes are then written to this process's copy
+            else:
+                positions = dict((agent_id, i) for (i, agent_id) in enumerate(self.agents_data))
+            processor.agents_data_tuples = agent_tuples(processor.agent, self.agents_data)
+            processor.activated = set()
+            connection.send(('ready', processor.next_time()))
+            while True:
+                message = connection.recv()
+                if message is None:
+                    break
+                (window_end, updates) = message
+                for agent_id, agent_data in updates.items():
+                    if isinstance(self.agents_data, AgentStore):
+                        self.agents_data[agent_id] = agent_data
+                    else:
+                        processor.agents_data_tuples[positions[agent_id]] = (processor.agent, agent_data)
+                processor.run_until(window_end)
+                processor.json_log_file.flush()
+                changed = dict((agent_id, detached(processor.agents_data[agent_id])) for agent_id in processor.activated) \
+                    if self.share_agent_data else dict()
+                processor.activated.clear()
+                connection.send(('window', processor.next_time(), processor.json_log_file.file.tell(), changed,
+                                 processor.event_counter))
+            processor.process_after_run()
+            connection.send(('done',))
+        except Exception:
+            connection.send(('error', traceback.format_exc()))
+        finally:
+            connection.close()
+
+    def merge_logs(self, part_files, offsets):
+        parts = [open(part_file, 'rb') for part_file in part_files]
+        with open(self.output_file_name, 'wb') as output:
+            log_format = self.kwargs.get('log_format', 'ndjson')
+            for window in range(1, self.windows + 1):
+                records = []
+                for part, part_offsets in zip(parts, offsets):
+                    records.extend(log_records(part.read(part_offsets[window] - part_offsets[window - 1]), log_format))
+                for (_, record) in sorted(records, key=lambda keyed: keyed[0]):
+                    output.write(record)
+            for part in parts: # anything logged after the last window
+                output.write(part.read())
+        for part, part_file in zip(parts, part_files):
+            part.close()
+            os.remove(part_file)
+
+
+# The events one process logged in a window, as (key, record) pairs where record is the event as written. Events are
+# keyed by time and agent id, the type name keeping ids of different types comparable. An event without them keeps
+# the key of the one before it, so a stable sort leaves it where it was logged.
+def log_records(chunk, format='ndjson'):
+    records = []
+    key = ()
+    if format == 'pickle':
+        stream = io.BytesIO(chunk)
+        while stream.tell() < len(chunk):
+            start = stream.tell()
+            key = event_key(pickle.load(stream), key)
+            records.append((key, chunk[start:stream.tell()]))
+    else:
+        for line in chunk.splitlines(True):
+            if line.strip():
+                key = event_key(json.loads(line), key)
+            records.append((key, line))
+    return records
+
+
+def event_key(event, previous):
+    if isinstance(event, dict) and 't' in event and 'id' in event:
+        return (event['t'], type(event['id']).__name__, event['id'])
+    return previous
 
 
 def is_number(s):
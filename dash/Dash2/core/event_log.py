@@ -0,0 +1,311 @@
+import atexit
+import glob
+import json
+import os
+import pickle
+import threading
+import numpy
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# Buffered writer for event logs. Events are serialized when they are written, so later changes to the logged
+# objects don't show up in the log, and the lines are kept in memory and written out in batches, either when
+# flush_size events are waiting or, with a background thread, every flush_interval seconds.
+# Formats are 'ndjson', one JSON object per line, and 'pickle', a stream of pickled events that is more compact
+# and keeps Python types; read_event_log reads either back. A path given as the target is opened with mode, in
+# binary for 'pickle', and closed with the writer.
+class EventLogWriter(object):
+
+    def __init__(self, target, format='ndjson', flush_size=1000, flush_interval=1.0, background=True, mode='a'):
+        if format not in ['ndjson', 'pickle']:
+            raise ValueError("EventLogWriter format must be 'ndjson' or 'pickle', not " + str(format))
+        self.format = format
+        if isinstance(target, str):
+            self.file = open(target, mode + 'b' if format == 'pickle' else mode)
+            self.owns_file = True
+        else:
+            self.file = target
+            self.owns_file = False
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.lock = threading.Lock()  # guards buffer
+        self.write_lock = threading.Lock()  # keeps batches in order when the thread and the caller flush together
+        self.closed = False
+        self.wake = threading.Event()
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.flush_periodically, name='EventLogWriter', daemon=True)
+            self.thread.start()
+
+    def write(self, event):
+        if self.format == 'pickle':
+            data = pickle.dumps(event, pickle.HIGHEST_PROTOCOL)
+        else:
+            data = json.dumps(event) + "\n"
+        with self.lock:
+            if self.closed:
+                raise ValueError("write to a closed EventLogWriter")
+            self.buffer.append(data)
+            full = len(self.buffer) >= self.flush_size
+        if full:
+            if self.thread is not None:
+                self.wake.set()
+            else:
+                self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                batch = self.buffer
+                self.buffer = []
+            if batch:
+                self.file.write((b"" if self.format == 'pickle' else "").join(batch))
+            self.file.flush()
+
+    def flush_periodically(self):
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        with self.lock:
+            self.closed = True
+        if self.thread is not None:
+            self.wake.set()
+            self.thread.join()
+        self.flush()
+        if self.owns_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Writers for log files given by path, shared by every agent logging to the same path and closed at exit
+path_writers = dict()
+
+
+def event_log_writer(path, format='ndjson'):
+    key = (path, format)
+    if key not in path_writers or path_writers[key].closed:
+        path_writers[key] = EventLogWriter(path, format=format)
+    return path_writers[key]
+
+
+@atexit.register
+def close_event_logs():
+    for writer in list(path_writers.values()):
+        writer.close()
+    path_writers.clear()
+
+
+# Generate the events in a log written by EventLogWriter
+def read_event_log(path, format='ndjson'):
+    if format == 'pickle':
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+    else:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+# Writes events as columns instead of lines, in a directory of chunk files of up to chunk_size events each: Parquet
+# through pyarrow if it is installed, otherwise NumPy .npz files. Nested dicts are flattened into columns with dotted
+# names, e.g. agent.id. The column types are inferred from the first chunk of events: bool, int, float, str, or json
+# for anything else, stored as JSON text. Values missing from an event or not fitting their column are null, and keys
+# not in the schema and values that don't fit are kept as JSON in the 'extra' column. read_columns loads any subset
+# of the columns back. It has the same write, flush and close methods as EventLogWriter. As with a file opened with
+# mode 'w', chunk files already in the directory are removed; with mode 'a' new chunks follow them.
+class ColumnarEventWriter(object):
+
+    def __init__(self, directory, chunk_size=100000, format=None, mode='w'):
+        if format is None:
+            format = 'parquet' if pyarrow is not None else 'npz'
+        if format == 'parquet' and pyarrow is None:
+            raise ImportError("writing Parquet needs pyarrow, use format='npz' instead")
+        if format not in ['parquet', 'npz']:
+            raise ValueError("ColumnarEventWriter format must be 'parquet' or 'npz', not " + str(format))
+        if mode not in ['w', 'a']:
+            raise ValueError("ColumnarEventWriter mode must be 'w' or 'a', not " + str(mode))
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.format = format
+        self.schema = None  # list of (column, type) pairs
+        self.rows = []  # flattened events waiting to be written
+        self.chunks = 0
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+        for path in chunk_paths(directory):
+            if mode == 'w':
+                os.remove(path)
+            else:
+                self.chunks += 1
+
+    def write(self, event):
+        if self.closed:
+            raise ValueError("write to a closed ColumnarEventWriter")
+        self.rows.append(flatten_event(event if isinstance(event, dict) else {'value': event}))
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.schema is None:
+            self.schema = infer_schema(self.rows)
+        columns = dict((name, []) for (name, _) in self.schema)
+        extra = []
+        for row in self.rows:
+            leftover = dict(row)
+            for (name, column_type) in self.schema:
+                value = leftover.pop(name, None)
+                if value is not None and not fits(value, column_type):
+                    leftover[name] = value
+                    value = None
+                if column_type == 'json' and value is not None:
+                    value = json.dumps(value, default=json_default)
+                columns[name].append(value)
+            extra.append(json.dumps(leftover, default=json_default) if leftover else None)
+        path = os.path.join(self.directory, 'part-%05d.%s' % (self.chunks, self.format))
+        if self.format == 'parquet':
+            arrays = [pyarrow.array(columns[name], type=arrow_types[column_type])
+                      for (name, column_type) in self.schema] + [pyarrow.array(extra, type=pyarrow.string())]
+            names = [name for (name, _) in self.schema] + ['extra']
+            pyarrow.parquet.write_table(pyarrow.Table.from_arrays(arrays, names=names), path)
+        else:
+            arrays = dict()
+            for (name, column_type) in self.schema + [('extra', 'str')]:
+                values = extra if name == 'extra' else columns[name]
+                valid = numpy.array([value is not None for value in values], dtype=bool)
+                fill = numpy_fill[column_type]
+                arrays[name] = numpy.array([fill if value is None else value for value in values],
+                                           dtype=numpy_types[column_type])
+                arrays[name + '.valid'] = valid
+            numpy.savez(path, **arrays)
+        self.chunks += 1
+        self.rows = []
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+
+arrow_types = dict() if pyarrow is None else \
+    {'bool': pyarrow.bool_(), 'int': pyarrow.int64(), 'float': pyarrow.float64(), 'str': pyarrow.string(),
+     'json': pyarrow.string()}
+numpy_types = {'bool': bool, 'int': numpy.int64, 'float': numpy.float64, 'str': str, 'json': str}
+numpy_fill = {'bool': False, 'int': 0, 'float': numpy.nan, 'str': '', 'json': ''}
+
+
+# Let json.dumps write NumPy scalars and arrays, as the Python values they hold
+def json_default(value):
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    raise TypeError("Object of type " + type(value).__name__ + " is not JSON serializable")
+
+
+def flatten_event(event, prefix='', row=None):
+    if row is None:
+        row = dict()
+    for (key, value) in event.items():
+        if isinstance(value, dict) and value:
+            flatten_event(value, prefix + str(key) + '.', row)
+        else:
+            row[prefix + str(key)] = value
+    return row
+
+
+def value_type(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, numpy.integer)):
+        return 'int'
+    if isinstance(value, (float, numpy.floating)):
+        return 'float'
+    if isinstance(value, str):
+        return 'str'
+    return 'json'
+
+
+def fits(value, column_type):
+    found = value_type(value)
+    return found == column_type or column_type == 'json' or (column_type == 'float' and found == 'int')
+
+
+# Column names in order of first appearance, each with the narrowest type that fits all its values
+def infer_schema(rows):
+    types = dict()
+    for row in rows:
+        for (name, value) in row.items():
+            if value is None:
+                types.setdefault(name, None)
+                continue
+            found = value_type(value)
+            known = types.get(name)
+            if known is None or known == found:
+                types[name] = found
+            elif set([known, found]) == set(['int', 'float']):
+                types[name] = 'float'
+            else:
+                types[name] = 'json'
+    return [(name, 'json' if column_type is None else column_type) for (name, column_type) in types.items()
+            if name != 'extra']
+
+
+def chunk_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, 'part-*.parquet')) + glob.glob(os.path.join(directory, 'part-*.npz')))
+
+
+# Load columns written by ColumnarEventWriter, all of them if columns is None, as a dict of numpy masked arrays with
+# null values masked. Only the chunks' requested columns are read. A column missing from some chunks, e.g. ones
+# appended with a different schema, is masked for their events.
+def read_columns(directory, columns=None):
+    chunks = []  # (number of events, dict of the chunk's columns) for each chunk
+    for path in chunk_paths(directory):
+        parts = dict()
+        if path.endswith('.parquet'):
+            if pyarrow is None:
+                raise ImportError("reading Parquet needs pyarrow")
+            names = pyarrow.parquet.read_schema(path).names
+            table = pyarrow.parquet.read_table(path, columns=None if columns is None else
+                                               [name for name in columns if name in names])
+            for name in table.column_names:
+                column = table.column(name)
+                mask = column.is_null().to_numpy(zero_copy_only=False)
+                parts[name] = numpy.ma.MaskedArray(column.to_numpy(zero_copy_only=False), mask=mask)
+            chunks.append((pyarrow.parquet.read_metadata(path).num_rows, parts))
+        else:
+            with numpy.load(path) as chunk:
+                names = [name for name in chunk.files if not name.endswith('.valid')]
+                for name in (names if columns is None else [name for name in columns if name in names]):
+                    parts[name] = numpy.ma.MaskedArray(chunk[name], mask=~chunk[name + '.valid'])
+                chunks.append((len(chunk['extra.valid']), parts))
+    names = []
+    for (_, parts) in chunks:
+        names += [name for name in parts if name not in names]
+    result = dict()
+    for name in names:
+        dtype = [parts[name].dtype for (_, parts) in chunks if name in parts][0]
+        result[name] = numpy.ma.concatenate([parts[name] if name in parts else
+                                             numpy.ma.masked_all(length, dtype=dtype) for (length, parts) in chunks])
+    return result
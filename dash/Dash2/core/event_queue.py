@@ -0,0 +1,189 @@
+import bisect
+from heapq import heappush, heappop
+
+
+# Event queues for discrete event simulation, holding (time, agent_id) events. pop returns the earliest event, and
+# events at the same time in agent id order, so every queue gives the same simulation; peek returns it without
+# removing it. LocalWorkProcessor takes the
+# kind of queue to use, see make_event_queue.
+#
+# HeapEventQueue is a binary heap, O(log n) per operation. CalendarEventQueue (Brown's calendar queue) and
+# BucketedEventQueue hash events into buckets by time and are close to O(1) per operation when events are spread
+# over time, as when many agents wake up once a day; the bucket width should be around the typical gap between
+# an agent's events divided by the events per bucket wanted, and the calendar queue adapts it as it resizes.
+
+
+class HeapEventQueue(object):
+
+    def __init__(self):
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, time, agent_id):
+        heappush(self.heap, (time, agent_id))
+
+    def pop(self):
+        return heappop(self.heap)
+
+    def peek(self):
+        return self.heap[0]
+
+
+# Buckets each cover a width of time, and the calendar wraps around every len(buckets) * width seconds like the
+# days of a year, with each bucket kept sorted. The number of buckets doubles or halves to keep about one or two
+# events in each, and the width is then set from the spread of the pending events.
+class CalendarEventQueue(object):
+
+    min_buckets = 16
+
+    def __init__(self, bucket_width=3600.0, buckets=min_buckets):
+        self.width = float(bucket_width)
+        self.buckets = [[] for _ in range(buckets)]
+        self.size = 0
+        self.current = 0  # bucket holding the earliest events
+        self.number = 0  # number of the current bucket counting from time 0, time // width, without wrapping around
+
+    def __len__(self):
+        return self.size
+
+    def push(self, time, agent_id):
+        self.insert((time, agent_id))
+        self.size += 1
+        if self.size > 2 * len(self.buckets):
+            self.resize(2 * len(self.buckets))
+
+    def insert(self, event):
+        number = event[0] // self.width
+        index = int(number) % len(self.buckets)
+        bisect.insort(self.buckets[index], event)
+        if number < self.number:  # earlier than the current bucket, so start from this one
+            self.current = index
+            self.number = number
+
+    def pop(self):
+        if self.size == 0:
+            raise IndexError("pop from an empty event queue")
+        self.find()
+        self.size -= 1
+        event = self.buckets[self.current].pop(0)
+        if len(self.buckets) > self.min_buckets and self.size < len(self.buckets) // 2:
+            self.resize(len(self.buckets) // 2)
+        return event
+
+    def peek(self):
+        if self.size == 0:
+            raise IndexError("peek at an empty event queue")
+        self.find()
+        return self.buckets[self.current][0]
+
+    # Move the current bucket on to the one holding the earliest event
+    def find(self):
+        buckets = self.buckets
+        width = self.width
+        index = self.current
+        number = self.number
+        for _ in range(len(buckets)):
+            bucket = buckets[index]
+            if bucket and bucket[0][0] // width <= number:  # comparing numbers, not times, avoids rounding errors
+                self.current = index
+                self.number = number
+                return
+            index += 1
+            number += 1
+            if index == len(buckets):
+                index = 0
+        # Nothing in the coming year, so go straight to the bucket with the earliest event
+        self.current = min([i for i in range(len(buckets)) if buckets[i]], key=lambda i: buckets[i][0])
+        self.number = buckets[self.current][0][0] // width
+
+    def resize(self, buckets):
+        events = [event for bucket in self.buckets for event in bucket]
+        if len(events) > 1:
+            times = [event[0] for event in events]
+            spread = max(times) - min(times)
+            if spread > 0:
+                self.width = 3.0 * spread / len(events)
+        self.buckets = [[] for _ in range(buckets)]
+        self.number = float('inf')  # so the first insert sets the current bucket
+        for event in events:
+            self.insert(event)
+        if not events:
+            self.current = 0
+            self.number = 0
+
+
+# Events are grouped into buckets of a fixed width of time, kept in a dict, with a heap of the bucket numbers.
+# A bucket is sorted only when it becomes the earliest, so pushing an event into a later bucket is an append.
+class BucketedEventQueue(object):
+
+    def __init__(self, bucket_width=3600):
+        self.width = bucket_width
+        self.buckets = dict()  # later buckets, unsorted
+        self.keys = []  # heap of the numbers of the buckets in self.buckets
+        self.current_key = None
+        self.current = []  # the earliest bucket, sorted, with events before position already popped
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, time, agent_id):
+        event = (time, agent_id)
+        key = int(time // self.width)
+        if key == self.current_key:
+            bisect.insort(self.current, event, self.position)
+        else:
+            if self.current_key is not None and key < self.current_key:  # put the current bucket back
+                if self.position < len(self.current):
+                    self.add_to_bucket(self.current_key, self.current[self.position:])
+                self.current_key = None
+                self.current = []
+                self.position = 0
+            self.add_to_bucket(key, [event])
+        self.size += 1
+
+    def add_to_bucket(self, key, events):
+        if key in self.buckets:
+            self.buckets[key].extend(events)
+        else:
+            self.buckets[key] = list(events)
+            heappush(self.keys, key)
+
+    def pop(self):
+        if self.size == 0:
+            raise IndexError("pop from an empty event queue")
+        if self.position == len(self.current):
+            self.next_bucket()
+        event = self.current[self.position]
+        self.position += 1
+        self.size -= 1
+        return event
+
+    def peek(self):
+        if self.size == 0:
+            raise IndexError("peek at an empty event queue")
+        if self.position == len(self.current):
+            self.next_bucket()
+        return self.current[self.position]
+
+    def next_bucket(self):
+        self.current_key = heappop(self.keys)
+        self.current = self.buckets.pop(self.current_key)
+        self.current.sort()
+        self.position = 0
+
+
+event_queue_classes = {'heap': HeapEventQueue, 'calendar': CalendarEventQueue, 'bucketed': BucketedEventQueue}
+
+
+# Return an event queue given its kind, 'heap', 'calendar' or 'bucketed', with options for its constructor,
+# or return queue itself if it is already an event queue
+def make_event_queue(queue='heap', **options):
+    if not isinstance(queue, str):
+        return queue
+    if queue not in event_queue_classes:
+        raise ValueError("unknown event queue " + queue + ", should be one of " + str(sorted(event_queue_classes)))
+    return event_queue_classes[queue](**options)
@@ -0,0 +1,35 @@
+import csv
+import json
+
+
+# Generate (agent id, agent data) pairs from an initial state file one agent at a time. create_initial_state_fn can
+# return this so that LocalWorkProcessor schedules agents as they are read instead of after building a dict of all of
+# them, and with lazy_admission reads them only as the simulation reaches their first events, which needs the file to
+# be in order of the agents' first events, e.g. sorted by last_event_time; agents then see only the agents admitted
+# so far (see LocalWorkProcessor).
+# Files are read as NDJSON, one JSON object per agent, or CSV with a header row, by their extension unless format is
+# given. CSV values that look like numbers are converted to int or float, except the id, which is kept as written so
+# that ids such as '007' or 'nan' stay distinct, and empty values are left out.
+def stream_initial_state(path, id_field='id', format=None):
+    if format is None:
+        format = 'csv' if path.endswith('.csv') else 'ndjson'
+    with open(path, newline='' if format == 'csv' else None) as f:
+        if format == 'csv':
+            for row in csv.DictReader(f):
+                agent_data = dict((key, value if key == id_field else csv_value(value))
+                                  for (key, value) in row.items() if value != '')
+                yield agent_data[id_field], agent_data
+        else:
+            for line in f:
+                if line.strip():
+                    agent_data = json.loads(line)
+                    yield agent_data[id_field], agent_data
+
+
+def csv_value(value):
+    for number_type in (int, float):
+        try:
+            return number_type(value)
+        except ValueError:
+            pass
+    return value
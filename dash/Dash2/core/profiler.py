@@ -0,0 +1,107 @@
+# Opt-in timing of the phases of agents' decision cycles. Attaching a profiler to an agent wraps the agent's phase
+# methods on that instance only, so agents without a profiler run exactly as before. Wall time, CPU time and calls
+# are aggregated by agent class and by the stack of phases a call was made in, such as
+# Nurse;agent_decision_cycle;choose_action;system2_propose_action.
+#
+#   profiler = DecisionCycleProfiler()
+#   profiler.attach(agent)  # or set profiler on a Trial before it runs to attach to all its agents
+#   ...
+#   profiler.write_json('profile.json')
+#   profiler.write_stacks('profile.folded')  # collapsed stacks for flamegraph.pl or speedscope
+
+import json
+import time
+
+
+class DecisionCycleProfiler(object):
+
+    phases = ['agent_decision_cycle', 'system1_update', 'choose_action', 'system2_propose_action', 'perform_action',
+              'update_beliefs', 'system1_step']
+
+    def __init__(self, phases=None, cpu=True):
+        if phases is not None:
+            self.phases = phases
+        self.cpu = cpu  # measuring CPU time as well as wall time roughly doubles the cost of timing a call
+        # Maps each stack, a tuple of the agent class name and the phases of the calls it was made in, to
+        # [calls, wall time, cpu time, wall time of timed calls made inside it]
+        self.stats = dict()
+        self.stack = []  # stacks of the calls currently being timed, innermost last
+
+    def attach(self, agent):
+        class_name = agent.__class__.__name__
+        for phase in self.phases:
+            method = getattr(agent, phase, None)
+            if method is not None and phase not in agent.__dict__:
+                setattr(agent, phase, self.timed(class_name, phase, method))
+
+    def detach(self, agent):
+        for phase in self.phases:
+            if phase in agent.__dict__:
+                delattr(agent, phase)
+
+    def timed(self, class_name, phase, method):
+        stack = self.stack
+        process_time = time.process_time if self.cpu else float  # float() is 0.0
+
+        def timed_phase(*args, **kwargs):
+            key = (stack[-1] if stack else (class_name,)) + (phase,)
+            stack.append(key)
+            wall = time.perf_counter()
+            cpu = process_time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                cpu = process_time() - cpu
+                wall = time.perf_counter() - wall
+                stack.pop()
+                stats = self.stats
+                entry = stats.get(key)
+                if entry is None:
+                    entry = stats[key] = [0, 0.0, 0.0, 0.0]
+                entry[0] += 1
+                entry[1] += wall
+                entry[2] += cpu
+                if stack:  # count this call's time as spent in a child of the enclosing call
+                    parent = stats.get(stack[-1])
+                    if parent is None:
+                        parent = stats[stack[-1]] = [0, 0.0, 0.0, 0.0]
+                    parent[3] += wall
+        return timed_phase
+
+    def reset(self):
+        self.stats = dict()
+        del self.stack[:]
+
+    # Totals for each phase by agent class, as {class name: {phase: {'calls', 'wall', 'cpu'}}}
+    def summary(self):
+        result = dict()
+        for (stack, (calls, wall, cpu, _)) in self.stats.items():
+            phases = result.setdefault(stack[0], dict())
+            if stack[-1] in stack[1:-1]:
+                continue  # a recursive call, already counted in the outer call's time
+            totals = phases.setdefault(stack[-1], {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            totals['calls'] += calls
+            totals['wall'] += wall
+            totals['cpu'] += cpu
+        return result
+
+    def to_json(self):
+        stacks = [{'class': stack[0], 'stack': list(stack[1:]), 'calls': calls, 'wall': wall, 'cpu': cpu,
+                   'self_wall': wall - child_wall}
+                  for (stack, (calls, wall, cpu, child_wall)) in sorted(self.stats.items())]
+        return {'phases': self.summary(), 'stacks': stacks}
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    # Collapsed stack format, one line per stack with its own wall time in microseconds, excluding timed calls
+    # inside it
+    def stack_lines(self):
+        return [';'.join(stack) + ' ' + str(int(round((wall - child_wall) * 1e6)))
+                for (stack, (_, wall, _, child_wall)) in sorted(self.stats.items())]
+
+    def write_stacks(self, path):
+        with open(path, 'w') as f:
+            for line in self.stack_lines():
+                f.write(line + '\n')
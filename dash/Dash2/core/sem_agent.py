@@ -1,3 +1,4 @@
+import pandas
 from Dash2.core.des_agent import DESAgent
 from semopy import Model
 
@@ -5,6 +6,8 @@ class SEMAgent(DESAgent):
     """
     The Structural Equation Model (SEM) agent. This API defines the following methods:
     - agent_decision_cycle(self, **kwargs)
+    - batch_decision_cycle(self, agent_data_list, event_time, **kwargs)
+    - predict_cohort(self, agent_data_list)
     """
 
     def __init__(self, **kwargs):
@@ -32,6 +35,40 @@ class SEMAgent(DESAgent):
         self.event_counter += 1
         return False
 
+    ####################################################################################################################
+    # Decision step for a cohort of agents activated at the same time or in the same time window.
+    ####################################################################################################################
+    def batch_decision_cycle(self, agent_data_list, event_time, **kwargs):
+        """
+        Called when several agents are activated together. The model predicts for the whole cohort in one call, and
+        each agent's predictions are then centered and translated to actions as in agent_decision_cycle.
+        """
+        for preds in self.predict_cohort(agent_data_list):
+            self.prediction_to_actions(preds - preds.mean())
+            self.event_counter += 1
+        return [False] * len(agent_data_list)
+
+    ####################################################################################################################
+    # Predict for many agents at once
+    ####################################################################################################################
+    def predict_cohort(self, agent_data_list):
+        """
+        Gather the agents' data into one DataFrame, predict once and scatter the predictions back.
+        :param agent_data_list: each agent's data, a DataFrame, or a dict or Series for a single row
+        :return: list of DataFrames of each agent's predictions
+        """
+        if len(agent_data_list) == 0:
+            return []
+        frames = [agent_data if isinstance(agent_data, pandas.DataFrame) else pandas.DataFrame([agent_data])
+                  for agent_data in agent_data_list]
+        preds = self.model.predict(pandas.concat(frames, ignore_index=True))
+        result = []
+        start = 0
+        for frame in frames:
+            result.append(preds.iloc[start:start + len(frame)])
+            start += len(frame)
+        return result
+
     ####################################################################################################################
     # Read semopy model
     ####################################################################################################################
@@ -6,6 +6,9 @@
 # activation may affect system2 reasoning, or override it if the node chooses an action to
 # perform.
 
+import collections
+from Dash2.core.system2 import isVar, isGround
+
 
 class Node:
     default_decay = 0.1  # activation goes down by this much each cycle in the absence of spreading activation
@@ -20,6 +23,10 @@ class Node:
         self.neighbors = [] if neighbors is None else neighbors
         # This keeps track of whether activation should be passed to neighbors so we don't loop
         self.change_since_update = 0
+        # Sets of active nodes that this node joins while its activation is above zero, see System1Agent.index_node
+        self.active_sets = ()
+        # Set of nodes with pending change that this node joins when updated, used in worklist spreading
+        self.pending_set = None
 
     def __str__(self):
         return "N" + str(self.node_id) + ": " + str(self.fact) + ", " + str(self.activation)\
@@ -29,16 +36,28 @@ class Node:
         return self.__str__()
 
     def update(self, activation_increment):
+        was_active = self.activation > 0
         self.activation += activation_increment
         if self.activation < 0:
             self.activation = 0
         self.change_since_update += activation_increment
+        if self.pending_set is not None:
+            self.pending_set.add(self)
+        if (self.activation > 0) != was_active:
+            for active in self.active_sets:
+                if was_active:
+                    active.discard(self)
+                else:
+                    active.add(self)
 
+    # Returns the number of neighbors updated
     def spread(self):
         if self.change_since_update != 0:
             for neighbor in self.neighbors:
                 neighbor[0].update(self.change_since_update/3 * neighbor[1])
             self.change_since_update = 0
+            return len(self.neighbors)
+        return 0
 
     def apply_decay(self):
         self.update(0 - self.decay)
@@ -55,14 +74,149 @@ class Node:
             return 0
 
 
+# Keeps time for a system 1's decay and spreading of activation. Nodes with links, and nodes made while lazy decay is
+# off, are kept in nodes and decay and spread every cycle, in the order they were made. Other nodes are LazyDecayNodes,
+# which catch up with the clock when they are touched.
+class DecayClock:
+
+    def __init__(self):
+        self.time = 0  # decay steps so far
+        self.rounds = 0  # rounds of spreading activation so far
+        self.round_time = 0  # time of the last round
+        self.epsilon = 0  # change a node must have to spread in the last round, see System1Agent.spread_epsilon
+        self.nodes = []
+        self.in_order = True
+
+    def add(self, node):
+        if self.nodes and node.node_id < self.nodes[-1].node_id:
+            self.in_order = False
+        self.nodes.append(node)
+
+    def eager_nodes(self):
+        if not self.in_order:
+            self.nodes.sort(key=lambda node: node.node_id)
+            self.in_order = True
+        return self.nodes
+
+    def step(self):
+        self.time += 1
+        for node in self.nodes:
+            node.apply_decay()
+
+    def start_round(self, epsilon):
+        self.rounds += 1
+        self.round_time = self.time
+        self.epsilon = epsilon
+
+
+# A node without links, whose decay is applied lazily. Its activation and change are brought up to date with its
+# clock whenever they are read or updated, so a node that nothing touches costs nothing to decay. As the node has no
+# neighbors, its spreading only clears its change, which is also worked out on catching up. When the node is given
+# a neighbor with add_neighbor it joins the clock's nodes and decays every cycle from then on, so that it passes its
+# decay on to its neighbors as other nodes do.
+class LazyDecayNode(Node):
+
+    def __init__(self, node_id, fact, clock, **kwargs):
+        self.clock = clock
+        self.decayed_at = clock.time  # clock time the node's decay was last applied
+        self.round = clock.rounds  # round of spreading the node was last up to date with
+        Node.__init__(self, node_id, fact, **kwargs)
+        if self.neighbors:
+            self.decay_eagerly()
+
+    def behind(self):
+        return self.clock is not None and (self.decayed_at != self.clock.time or self.round != self.clock.rounds)
+
+    @property
+    def activation(self):
+        if self.behind():
+            self.catch_up()
+        return self._activation
+
+    @activation.setter
+    def activation(self, value):
+        if self.behind():
+            self.catch_up()
+        self._activation = value
+
+    @property
+    def change_since_update(self):
+        if self.behind():
+            self.catch_up()
+        return self._change_since_update
+
+    @change_since_update.setter
+    def change_since_update(self, value):
+        if self.behind():
+            self.catch_up()
+        self._change_since_update = value
+
+    # Apply the decay for the clock steps since the node was last up to date. Decaying k steps at once with the
+    # clamp at zero gives the same activation as k calls to apply_decay. The change is cleared by the last round of
+    # spreading since then if it was over epsilon at the time, see System1Agent.start_round; a node with a smaller
+    # change stays pending and is brought up to date every round until it is cleared, so this gives the same change
+    # as clearing it round by round as long as the decay is larger than epsilon. (With an epsilon at least as large
+    # as the decay the change can differ, which is only seen if the node is later given neighbors.)
+    def catch_up(self):
+        clock = self.clock
+        change = self._change_since_update - (clock.time - self.decayed_at) * self.decay
+        if self.round != clock.rounds and \
+                abs(self._change_since_update - (clock.round_time - self.decayed_at) * self.decay) > clock.epsilon:
+            change = -(clock.time - clock.round_time) * self.decay
+        was_active = self._activation > 0
+        self._activation = max(0, self._activation - (clock.time - self.decayed_at) * self.decay)
+        self._change_since_update = change
+        self.decayed_at = clock.time
+        self.round = clock.rounds
+        if was_active and self._activation == 0:
+            for active in self.active_sets:
+                active.discard(self)
+
+    def add_neighbor(self, node, link_strength=1):
+        if self.clock is not None:
+            self.decay_eagerly()
+        Node.add_neighbor(self, node, link_strength)
+
+    def decay_eagerly(self):
+        if self.behind():
+            self.catch_up()
+        self.clock.add(self)
+        self.clock = None
+        if self.pending_set is not None and self._change_since_update != 0:
+            self.pending_set.add(self)
+
+
 class System1Agent:
 
     def __init__(self):
         self.system1Fact = set()
         self.nodes = set()
         self.action_nodes = set()  # subset of nodes that suggest an action, for efficiency
+        # Nodes and action nodes whose activation is above zero, kept up to date by Node.update. Activation decays
+        # to zero, so these stay small and checking them for a positive threshold is much cheaper than scanning
+        # every node.
+        self.active_nodes = set()
+        self.active_action_nodes = set()
+        # If spread_epsilon is a number, spreading activation works through a list of the nodes whose change since
+        # their last spread is larger than epsilon, adding neighbors whose change grows past epsilon, and each node
+        # spreads at most once per cycle. Smaller changes stay pending until they add up to more than epsilon.
+        # If it is None, every node with any change spreads once per cycle. Either way nodes spread in the order
+        # they were made.
+        self.spread_epsilon = None
+        self.pending_nodes = set()  # nodes that may have change to spread, kept by Node.update in worklist mode
+        self.spread_updates = 0  # number of neighbor updates made in the last round of spreading activation
+        # With lazy_decay, nodes without links decay only when they are next touched (see LazyDecayNode), so decay
+        # and spreading cost time for the linked nodes only, with the same activations. Set it before the agent
+        # makes its nodes.
+        self.lazy_decay = True
+        self.decay_clock = DecayClock()
         self.fact_node_dict = dict()  # maps node facts to nodes
         self.neighbor_rules = dict()  # maps node fact predicates to lambdas
+        # Rules with fact patterns, indexed by predicate, arity and first argument, or None if it is a variable
+        self.pattern_rules = dict()
+        # Maps (predicate, arity) and (predicate, arity, position, argument) to the nodes whose facts have them.
+        # Built by the first call to nodes_matching and then kept up to date by fact_to_node.
+        self.argument_index = None
         self.trace_add_activation = False
         # Activation threshold at which actions suggested by system 1 will be considered over deliberation
         # A low threshold will produce more 'impulsive' actions
@@ -93,52 +247,205 @@ class System1Agent:
             print('adding activation to', n)
         n.update(activation_increment)
 
+    # Only nodes with neighbors take turns to spread their change, in the order they were made. A node without
+    # neighbors has no one to pass its change on to, and its change is cleared at the start of each round if it is
+    # over epsilon, as its spreading would, so that it can decay lazily until it is linked (see LazyDecayNode).
     def spreading_activation(self):
-        for node in self.nodes:
-            node.spread()
+        if self.spread_epsilon is None:
+            self.start_round(0)
+            self.pending_nodes.clear()
+            self.spread_updates = sum([node.spread() for node in self.decay_clock.eager_nodes() if node.neighbors])
+        else:
+            self.spread_worklist()
+
+    # Clear the change of pending nodes without neighbors, keeping those with a change of at most epsilon pending
+    def start_round(self, epsilon):
+        self.decay_clock.start_round(epsilon)
+        cleared = []
+        for node in self.pending_nodes:
+            if not node.neighbors:
+                if abs(node.change_since_update) > epsilon:
+                    node.change_since_update = 0
+                if node.change_since_update == 0:
+                    cleared.append(node)
+        self.pending_nodes.difference_update(cleared)
+
+    def spread_worklist(self):
+        epsilon = self.spread_epsilon
+        self.start_round(epsilon)
+        pending = self.pending_nodes
+        worklist = collections.deque(sorted([n for n in pending if abs(n.change_since_update) > epsilon],
+                                            key=lambda n: n.node_id))
+        spread = set()
+        self.spread_updates = 0
+        while worklist:
+            node = worklist.popleft()
+            if node not in spread and abs(node.change_since_update) > epsilon:
+                spread.add(node)
+                self.spread_updates += node.spread()
+                for (neighbor, _) in node.neighbors:
+                    if neighbor.neighbors and neighbor not in spread and abs(neighbor.change_since_update) > epsilon:
+                        worklist.append(neighbor)
+        # Pending nodes whose change is zero have nothing left to spread
+        pending.difference_update([n for n in pending if n.change_since_update == 0])
 
+    # Nodes with links decay now, and the others when they are next read, updated or spread
     def system1_decay(self):
-        for node in self.nodes:
-            node.apply_decay()
+        self.decay_clock.step()
 
+    # Reading activation may bring a node up to date and remove it from the active sets, so they are copied first
     def nodes_over_threshold(self, threshold=0.5):
-        return [n for n in self.nodes if n.activation >= threshold]
+        return [n for n in list(self.active_nodes if threshold > 0 else self.nodes) if n.activation >= threshold]
 
     def actions_over_threshold(self, threshold=0.5):
-        return [n for n in self.action_nodes if n.activation >= threshold]
+        return [n for n in list(self.active_action_nodes if threshold > 0 else self.action_nodes)
+                if n.activation >= threshold]
 
-    # Turn a fact into a unique key by writing brackets and elements into a string
-    # so ('hi', ('there', 'you')) becomes "[hi[there,you]]"
+    # Turn a fact into a key for fact_node_dict. Facts are normally tuples of strings and numbers, which are their
+    # own keys. Lists inside a fact are turned into tuples, so ('hi', ['there', 'you']) has the same key as
+    # ('hi', ('there', 'you')).
     def fact_to_key(self, fact):
-        if isinstance(fact, (list, tuple)):
-            result = "["
-            for sub_fact in fact:
-                result += ("," if len(result) > 1 else "") + self.fact_to_key(sub_fact)
-            return result + "]"
-        else:
+        try:
+            hash(fact)
+            return fact
+        except TypeError:
+            if isinstance(fact, (list, tuple)):
+                return tuple([self.fact_to_key(sub_fact) for sub_fact in fact])
             return str(fact)
 
     # Given a fact, return its node, creating a new one if needed.
     def fact_to_node(self, fact):
         key = self.fact_to_key(fact)
         if key not in self.fact_node_dict:
-            node = Node(len(self.nodes) + 1, fact)
+            if self.lazy_decay:
+                node = LazyDecayNode(len(self.nodes) + 1, fact, self.decay_clock)
+            else:
+                node = Node(len(self.nodes) + 1, fact)
+                self.decay_clock.add(node)
             self.fact_node_dict[key] = node
             self.nodes.add(node)
-            self.create_and_link_neighbors(node)
             if fact[0] == 'action':
                 self.action_nodes.add(node)
+            self.index_node(node)
+            node.pending_set = self.pending_nodes
+            if self.argument_index is not None:
+                self.index_arguments(node)
+            self.create_and_link_neighbors(node)
         return self.fact_node_dict[key]
 
+    # Have the node keep the agent's active node sets up to date as its activation rises above or falls to zero
+    def index_node(self, node):
+        if node in self.action_nodes:
+            node.active_sets = (self.active_nodes, self.active_action_nodes)
+        else:
+            node.active_sets = (self.active_nodes,)
+        if node.activation > 0:
+            for active in node.active_sets:
+                active.add(node)
+
     # Apply neighbor creation rules to create or link nodes
     def create_and_link_neighbors(self, node):
         if node.fact[0] in self.neighbor_rules:
             for rule in self.neighbor_rules[node.fact[0]]:
                 rule(node)
+        if self.pattern_rules:
+            for key in rule_keys(node.fact):
+                for (pattern, rule) in self.pattern_rules.get(key, []):
+                    bindings = match_fact(pattern, node.fact, {})
+                    if bindings is not False:
+                        rule(node, bindings)
 
     # Create a spreading activation rule, that sets up neighbors for nodes that match the rule
-    # and reinforcement strengths.
+    # and reinforcement strengths. node_pattern is either a predicate, and the action is called with each new
+    # node for a fact with that predicate, or a fact pattern such as ('seen', 'x'), and the action is called with
+    # each new node whose fact matches the pattern and the bindings of its variables. Pattern rules are indexed
+    # by their first argument as well as their predicate, so many rules for one predicate stay cheap to apply.
     def create_neighbor_rule(self, node_pattern, action):
+        if isinstance(node_pattern, (list, tuple)):
+            key = pattern_rule_key(node_pattern)
+            if key not in self.pattern_rules:
+                self.pattern_rules[key] = []
+            self.pattern_rules[key].append((node_pattern, action))
+            return
         if node_pattern not in self.neighbor_rules:
             self.neighbor_rules[node_pattern] = []
         self.neighbor_rules[node_pattern].append(action)
+
+    # Return a list of (node, bindings) pairs for the existing nodes whose facts match a pattern, so a rule can
+    # link a new node to all its related nodes at once. Candidates are found in the argument index using the
+    # pattern's least common constant argument rather than by scanning every node.
+    def nodes_matching(self, pattern):
+        if self.argument_index is None:
+            self.argument_index = dict()
+            for node in self.nodes:
+                self.index_arguments(node)
+        candidates = self.argument_index.get((pattern[0], len(pattern)), [])
+        for (position, arg) in enumerate(pattern[1:], 1):
+            if isGround(arg):
+                try:
+                    nodes = self.argument_index.get((pattern[0], len(pattern), position, arg), [])
+                except TypeError:  # arguments containing lists aren't indexed
+                    continue
+                if len(nodes) < len(candidates):
+                    candidates = nodes
+        matches = []
+        for node in candidates:
+            bindings = match_fact(pattern, node.fact, {})
+            if bindings is not False:
+                matches.append((node, bindings))
+        return matches
+
+    def index_arguments(self, node):
+        fact = node.fact
+        keys = [(fact[0], len(fact))]
+        for (position, arg) in enumerate(fact[1:], 1):
+            keys.append((fact[0], len(fact), position, arg))
+        for key in keys:
+            try:
+                if key not in self.argument_index:
+                    self.argument_index[key] = []
+            except TypeError:
+                continue
+            self.argument_index[key].append(node)
+
+
+# Match a fact pattern against a node's fact, returning the bindings of the pattern's variables or False.
+# Pattern variables are as in system 2, while everything in the fact is taken as a constant.
+def match_fact(pattern, fact, bindings):
+    if isinstance(pattern, (list, tuple)):
+        if not isinstance(fact, (list, tuple)) or len(pattern) != len(fact) or (pattern and pattern[0] != fact[0]):
+            return False
+        for (sub_pattern, sub_fact) in zip(pattern[1:], fact[1:]):
+            bindings = match_fact(sub_pattern, sub_fact, bindings)
+            if bindings is False:
+                return False
+        return bindings
+    elif isVar(pattern):
+        if pattern in bindings:
+            return bindings if bindings[pattern] == fact else False
+        bindings[pattern] = fact
+        return bindings
+    return bindings if pattern == fact else False
+
+
+# The key a pattern rule is indexed under: its predicate, arity and first argument, or None if that argument
+# contains variables or can't be hashed
+def pattern_rule_key(pattern):
+    first = pattern[1] if len(pattern) > 1 and isGround(pattern[1]) else None
+    try:
+        hash(first)
+    except TypeError:
+        first = None
+    return (pattern[0], len(pattern), first)
+
+
+# The keys of the pattern rules that may match a fact
+def rule_keys(fact):
+    keys = [(fact[0], len(fact), None)]
+    if len(fact) > 1 and fact[1] is not None:
+        try:
+            hash(fact[1])
+            keys.append((fact[0], len(fact), fact[1]))
+        except TypeError:
+            pass
+    return keys
@@ -0,0 +1,440 @@
+# A spreading activation engine for system 1 that keeps the network in arrays, for networks with many nodes.
+
+# Activation, pending change, decay and valence are numpy vectors indexed by node, and the links form a sparse
+# matrix, so one spreading or decay step is a single sparse matrix-vector product or vector operation rather than
+# a loop over Node objects. Spreading is synchronous: every node passes on the change it had at the start of the step.
+#
+# To use it, put MatrixSystem1Agent ahead of DASHAction's System1Agent in the agent's bases, as with the custom
+# system 1 in tutorial/example_agents.py:
+#
+#   class MatrixDASHAction(DASHAction, MatrixSystem1Agent):
+#       def __init__(self):
+#           DASHAction.__init__(self, system1_class=MatrixSystem1Agent)
+
+import array
+import numpy
+import scipy.sparse
+from Dash2.core.system1 import Node, System1Agent
+
+
+class ActivationNetwork(object):
+
+    initial_capacity = 64
+
+    def __init__(self):
+        self.size = 0  # number of nodes
+        self.activation = numpy.zeros(self.initial_capacity)
+        self.change = numpy.zeros(self.initial_capacity)
+        self.decay = numpy.zeros(self.initial_capacity)
+        self.valence = numpy.zeros(self.initial_capacity)
+        self.is_action = numpy.zeros(self.initial_capacity, dtype=bool)
+        # Links are appended to typed arrays and indexed when next needed, as the spreading matrix and, if a node's
+        # neighbors are asked for, in compressed sparse row form by source. Entry [i, j] of the matrix is the strength of the link from
+        # node j to node i, so multiplying it by the change vector spreads the change.
+        self.link_source = array.array('i')
+        self.link_target = array.array('i')
+        self.link_strength = array.array('d')
+        self.neighbor_index = None  # (start, targets, strengths), the links from node i are start[i]:start[i + 1]
+        self.matrix = None
+        self.facts = []  # the fact for each index
+        self.nodes = []  # the MatrixNode handle for each index
+
+    def add_node(self, activation=0, valence=0, decay=Node.default_decay, is_action=False):
+        if self.size == len(self.activation):
+            self.grow(2 * self.size)
+        index = self.size
+        self.size += 1
+        self.activation[index] = activation
+        self.change[index] = 0
+        self.decay[index] = decay
+        self.valence[index] = valence
+        self.is_action[index] = is_action
+        self.neighbor_index = None
+        self.matrix = None
+        return index
+
+    # Return the node for a fact and whether it was created. A network of its own always creates the node,
+    # since the agent has already checked its fact_node_dict.
+    def find_or_add_node(self, key, fact, is_action=False):
+        index = self.add_node(is_action=is_action)
+        self.facts.append(fact)
+        self.nodes.append(MatrixNode(self, index))
+        return self.nodes[index], True
+
+    def node(self, index):
+        return self.nodes[index]
+
+    # The agents that have a handle on each node of the network, given the agent whose network it is
+    def agents(self, agent):
+        return [agent]
+
+    def grow(self, capacity):
+        for name in ['activation', 'change', 'decay', 'valence', 'is_action']:
+            old = getattr(self, name)
+            new = numpy.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add_link(self, source, target, strength=1):
+        self.link_source.append(source)
+        self.link_target.append(target)
+        self.link_strength.append(strength)
+        self.neighbor_index = None
+        self.matrix = None
+
+    def neighbor_arrays(self):
+        if self.neighbor_index is None:
+            sources = numpy.array(self.link_source, dtype=numpy.int32)
+            order = numpy.argsort(sources, kind='stable')  # keeps each node's links in the order they were added
+            start = numpy.zeros(self.size + 1, dtype=numpy.int32)
+            numpy.cumsum(numpy.bincount(sources, minlength=self.size), out=start[1:])
+            self.neighbor_index = (start, numpy.array(self.link_target, dtype=numpy.int32)[order],
+                                   numpy.array(self.link_strength)[order])
+        return self.neighbor_index
+
+    # A list of (target index, strength) pairs for the links from a node
+    def node_links(self, index):
+        (start, targets, strengths) = self.neighbor_arrays()
+        return list(zip(targets[start[index]:start[index + 1]].tolist(),
+                        strengths[start[index]:start[index + 1]].tolist()))
+
+    # The number of links from each node, counting duplicates
+    @property
+    def out_degree(self):
+        self.spreading_matrix()
+        return self.link_count
+
+    def spreading_matrix(self):
+        if self.matrix is None:
+            sources = numpy.array(self.link_source, dtype=numpy.int32)
+            # Duplicate links are summed, as they were applied one after another by Node.spread
+            self.matrix = scipy.sparse.csr_matrix((numpy.array(self.link_strength),
+                                                   (numpy.array(self.link_target, dtype=numpy.int32), sources)),
+                                                  shape=(self.size, self.size))
+            self.link_count = numpy.bincount(sources, minlength=self.size)
+        return self.matrix
+
+    # Same as Node.update for a single node
+    def update(self, index, increment):
+        self.activation[index] = max(self.activation[index] + increment, 0)
+        self.change[index] += increment
+
+    # Same as Node.update for every node at once
+    def update_all(self, increments):
+        n = self.size
+        numpy.maximum(self.activation[:n] + increments, 0, out=self.activation[:n])
+        self.change[:n] += increments
+
+    # Each node passes a third of its change since the last spread to its neighbors, scaled by the link strength.
+    # Returns the number of neighbor updates, as Node.spread does.
+    def spread(self):
+        n = self.size
+        change = self.change[:n]
+        if n == 0 or not change.any():
+            return 0
+        matrix = self.spreading_matrix()
+        increments = matrix.dot(change / 3)
+        updates = int(self.out_degree[change != 0].sum())
+        change[:] = 0
+        self.update_all(increments)
+        return updates
+
+    def apply_decay(self):
+        self.update_all(-self.decay[:self.size])
+
+    def indices_over_threshold(self, threshold, actions_only=False):
+        over = self.activation[:self.size] >= threshold
+        if actions_only:
+            over &= self.is_action[:self.size]
+        return numpy.flatnonzero(over)
+
+
+# A handle on one node of an ActivationNetwork. It is a Node, with the same attributes, for neighbor rules and other
+# code that reads or updates nodes, but its state, including the fact, lives in the network's arrays. It only sets
+# the slots for the network and index, so it never makes the instance dict it inherits from Node.
+class MatrixNode(Node):
+
+    __slots__ = ('network', 'index')
+
+    active_sets = ()  # the network keeps track of active nodes itself
+    pending_set = None
+
+    def __init__(self, network, index):
+        self.network = network
+        self.index = index
+
+    def __str__(self):
+        return "N" + str(self.node_id) + ": " + str(self.fact) + ", " + str(self.activation)
+
+    @property
+    def node_id(self):
+        return self.index + 1
+
+    @property
+    def fact(self):
+        return self.network.facts[self.index]
+
+    @property
+    def activation(self):
+        return float(self.network.activation[self.index])
+
+    @activation.setter
+    def activation(self, value):
+        self.network.activation[self.index] = value
+
+    @property
+    def change_since_update(self):
+        return float(self.network.change[self.index])
+
+    @change_since_update.setter
+    def change_since_update(self, value):
+        self.network.change[self.index] = value
+
+    @property
+    def decay(self):
+        return float(self.network.decay[self.index])
+
+    @decay.setter
+    def decay(self, value):
+        self.network.decay[self.index] = value
+
+    @property
+    def valence(self):
+        return float(self.network.valence[self.index])
+
+    @valence.setter
+    def valence(self, value):
+        self.network.valence[self.index] = value
+
+    # A list of (node, link_strength) pairs as for Node, built from the network. Use add_neighbor to add links.
+    @property
+    def neighbors(self):
+        return [(self.network.node(target), strength) for (target, strength) in self.network.node_links(self.index)]
+
+    def update(self, activation_increment):
+        self.network.update(self.index, activation_increment)
+
+    def spread(self):
+        change = self.network.change[self.index]
+        if change != 0:
+            links = self.network.node_links(self.index)
+            for (target, strength) in links:
+                self.network.update(target, change / 3 * strength)
+            self.network.change[self.index] = 0
+            return len(links)
+        return 0
+
+    def add_neighbor(self, node, link_strength=1):
+        self.network.add_link(self.index, node.index, link_strength)
+
+
+class MatrixSystem1Agent(System1Agent):
+
+    def __init__(self):
+        System1Agent.__init__(self)
+        self.network = ActivationNetwork()
+
+    def spreading_activation(self):
+        self.spread_updates = self.network.spread()
+
+    def system1_decay(self):
+        self.network.apply_decay()
+
+    def nodes_over_threshold(self, threshold=0.5):
+        return [self.network.node(i) for i in self.network.indices_over_threshold(threshold)]
+
+    def actions_over_threshold(self, threshold=0.5):
+        return [self.network.node(i) for i in self.network.indices_over_threshold(threshold, actions_only=True)]
+
+    # Given a fact, return its node, creating a new one if needed. A new node in a population is added to every
+    # agent in it, and the neighbor rules are run once, by the agent that created it, as the links are shared.
+    def fact_to_node(self, fact):
+        key = self.fact_to_key(fact)
+        if key not in self.fact_node_dict:
+            node, created = self.network.find_or_add_node(key, fact, is_action=fact[0] == 'action')
+            if created:
+                for agent in self.network.agents(self):
+                    agent.add_node_handle(key, agent.network.node(node.index))
+                self.create_and_link_neighbors(node)
+            else:
+                self.add_node_handle(key, node)
+        return self.fact_node_dict[key]
+
+    def add_node_handle(self, key, node):
+        self.fact_node_dict[key] = node
+        self.nodes.add(node)
+        if node.fact[0] == 'action':
+            self.action_nodes.add(node)
+        if self.argument_index is not None:
+            self.index_arguments(node)
+
+
+# The activation networks of a population of agents, such as a ward of nurses, that share one vocabulary of nodes
+# and one set of links. Activation and pending change are matrices with a row per node and a column per agent, so
+# that one sparse product spreads every agent's change, and decay and valence are per node and shared by all agents. Every agent has a handle on every node.
+#
+# Agents join with add_agent before they have any nodes of their own. While batched is True, the loop driving the
+# agents calls system1_update_all once per tick before any agent proposes actions, spreading every agent's column in
+# one sparse matrix product, and system1_step_all once after they have all acted, decaying every column at once. The
+# agents' own system1_update and system1_step then leave their columns alone, so each agent's system 1 spreads and decays once
+# per tick rather than at each point of its decision cycle. A Trial with system1_population set does this. With
+# batched False, each agent's system1_update and system1_step work on its own column when called, as if it had a network
+# of its own.
+class System1Population(ActivationNetwork):
+
+    initial_members = 16
+
+    def __init__(self, batched=True):
+        ActivationNetwork.__init__(self)
+        self.batched = batched
+        self.members = 0  # number of agents
+        self.member_agents = []
+        self.activation = numpy.zeros((self.initial_capacity, self.initial_members))
+        self.change = numpy.zeros((self.initial_capacity, self.initial_members))
+        self.node_indices = dict()  # maps node keys to indices, shared by every agent
+        self.spread_updates = 0  # number of neighbor updates made by all the agents in the last system1_update_all
+
+    def add_agent(self, agent):
+        if agent.network.size > 0:
+            raise ValueError("agents must join a System1Population before they have any nodes")
+        if self.members == self.activation.shape[1]:
+            self.resize(2 * self.members, self.activation.shape[0])
+        agent.network = PopulationColumn(self, self.members)
+        self.members += 1
+        self.member_agents.append(agent)
+        for (key, index) in self.node_indices.items():
+            agent.add_node_handle(key, agent.network.node(index))
+        return agent.network
+
+    def add_node(self, activation=0, valence=0, decay=Node.default_decay, is_action=False):
+        if self.size == self.activation.shape[0]:
+            self.resize(self.activation.shape[1], 2 * self.size)
+        index = self.size
+        self.size += 1
+        self.activation[index] = activation
+        self.change[index] = 0
+        self.decay[index] = decay
+        self.valence[index] = valence
+        self.is_action[index] = is_action
+        self.neighbor_index = None
+        self.matrix = None
+        return index
+
+    def grow(self, capacity):
+        self.resize(self.activation.shape[1], capacity)
+
+    def resize(self, member_capacity, capacity):
+        for name in ['activation', 'change']:
+            old = getattr(self, name)
+            new = numpy.zeros((capacity, member_capacity))
+            new[:self.size, :self.members] = old[:self.size, :self.members]
+            setattr(self, name, new)
+        if capacity != len(self.decay):
+            for name in ['decay', 'valence', 'is_action']:
+                old = getattr(self, name)
+                new = numpy.zeros(capacity, dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, name, new)
+
+    # Spread every agent's change to its neighbors at once, as ActivationNetwork.spread does for one agent
+    def system1_update_all(self):
+        n = self.size
+        change = self.change[:n, :self.members]
+        self.spread_updates = 0
+        if n == 0 or not change.any():
+            return 0
+        increments = self.spreading_matrix().dot(change / 3)
+        self.spread_updates = int(self.out_degree.dot(numpy.count_nonzero(change, axis=1)))
+        change[:] = increments  # the change was all spread, leaving only the increments
+        self.add_to_activation(increments)
+        return self.spread_updates
+
+    # Decay every agent's activation at once
+    def system1_step_all(self):
+        decay = self.decay[:self.size, numpy.newaxis]
+        self.change[:self.size, :self.members] -= decay
+        self.add_to_activation(-decay)
+
+    # Same as update_all for every agent, leaving the change to the caller. Works in place, as the matrices are large.
+    def add_to_activation(self, increments):
+        activation = self.activation[:self.size, :self.members]
+        activation += increments
+        numpy.maximum(activation, 0, out=activation)
+
+
+# One agent's view of a System1Population, used as the agent's network. It reads and writes the agent's column of
+# the population and creates node handles for the agent as they are needed.
+class PopulationColumn(ActivationNetwork):
+
+    def __init__(self, population, column):
+        self.population = population
+        self.column = column
+        self.handles = dict()
+
+    @property
+    def size(self):
+        return self.population.size
+
+    @property
+    def activation(self):
+        return self.population.activation[:, self.column]
+
+    @property
+    def change(self):
+        return self.population.change[:, self.column]
+
+    @property
+    def decay(self):
+        return self.population.decay
+
+    @property
+    def valence(self):
+        return self.population.valence
+
+    @property
+    def is_action(self):
+        return self.population.is_action
+
+    @property
+    def facts(self):
+        return self.population.facts
+
+    def add_link(self, source, target, strength=1):
+        self.population.add_link(source, target, strength)
+
+    def neighbor_arrays(self):
+        return self.population.neighbor_arrays()
+
+    @property
+    def out_degree(self):
+        return self.population.out_degree
+
+    def spreading_matrix(self):
+        return self.population.spreading_matrix()
+
+    def find_or_add_node(self, key, fact, is_action=False):
+        population = self.population
+        created = key not in population.node_indices
+        if created:
+            population.node_indices[key] = population.add_node(is_action=is_action)
+            population.facts.append(fact)
+        return self.node(population.node_indices[key]), created
+
+    def node(self, index):
+        if index not in self.handles:
+            self.handles[index] = MatrixNode(self, index)
+        return self.handles[index]
+
+    def agents(self, agent):
+        return self.population.member_agents
+
+    # In a batched population the column is spread and decayed with all the others by system1_update_all and
+    # system1_step_all, which count the neighbor updates for the whole population
+    def spread(self):
+        if self.population.batched:
+            return 0
+        return ActivationNetwork.spread(self)
+
+    def apply_decay(self):
+        if not self.population.batched:
+            ActivationNetwork.apply_decay(self)
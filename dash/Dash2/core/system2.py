@@ -1,28 +1,30 @@
 # Contains code relating to goal decomposition and mental model projection
 from Dash2.core.string_aux import convert_camel
 import ast
+import functools
+import sys
 import time
-import collections
+import math
+import random
+import statistics
 import abc
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 
 class System2Agent:
     __metaclass__ = abc.ABCMeta
 
     def __init__(self):
-        self.goalWeightDict = dict()
-        self.goalRequirementsDict = dict()
+        # The goal weights, goal requirements, transients, projection, trigger and utility rules start out shared
+        # with every other agent through base_program, and are copied when the agent changes them (see own_rules).
+        # base_program declares 'forget' as transient.
+        self.use_program(base_program)
         self.primitiveActionDict = dict()
+        self.primitiveFunctionCache = dict()  # maps predicates to the methods that perform them, see primitive_function
         self.knownDict = dict()
         self.knownFalseDict = dict()
-        self.transientDict = dict()
-        self.transientDict['forget'] = [('forget', 'x')]  # Forget should be transient so you can keep forgetting things
-        # Commenting out the line above will break something, but I need to be able to get past a 'forget'
-        # clause in the middle of some goal requirements, which will never happen if forget is transient.
-        # I think the best answer right now might be to add some judicious forget([forget(x)]) statements
-        self.projectionRuleDict = dict()
-        self.triggerRules = []
-        self.utilityRules = []
+        self.term_table = None  # if set to a TermTable, facts are interned in it as they are recorded
 
         # Read the agent definition in a simpler syntax and create the appropriate definitions
         self.traceLoad = False
@@ -33,8 +35,63 @@ class System2Agent:
         self.traceForget = False
         self.traceProject = False
 
+        # With use_plan_cache set, after the action chosen by reasoning succeeds, the next action is found by carrying
+        # on through the requirements body it came from instead of searching again from the top goal, as long as
+        # nothing learned since could change the search (see resume_plan). The counters show how often this worked.
+        self.use_plan_cache = False
+        self.plan_cache_hits = 0
+        self.plan_cache_misses = 0
+        self.plan_frames = None  # (goal, requirements, bindings, index) for each body on the path to the last action, innermost first
+        self.failed_lookups = None  # goals that were not known when the plan was made, listed by predicate
+        self.recording_lookups = False  # whether failed lookups are being recorded, only while planning
+        self.learned_facts = None  # facts that became known since the last action was chosen
+
     def system2_propose_action(self):
-        return self.choose_action_by_reasoning()
+        if not self.use_plan_cache:
+            return self.choose_action_by_reasoning()
+        action = self.resume_plan()
+        if action is not None:
+            self.plan_cache_hits += 1
+        else:
+            self.plan_cache_misses += 1
+            self.plan_frames = None
+            self.failed_lookups = dict()
+            self.recording_lookups = True
+            try:
+                action = self.choose_action_by_reasoning()
+            finally:
+                self.recording_lookups = False
+        self.learned_facts = []
+        return action
+
+    # Return the action after the last one in its requirements body, or None if the goal tree has to be searched
+    # again. That needs the last action to be known now, so that it succeeded, and no fact learned since then to match
+    # a goal that wasn't known when the plan was made, other than the action itself. Facts learned in that way only
+    # add to what was known, so a full search would take the same path down to this body. Anything that becomes
+    # known false, is forgotten or changes the rules discards the plan.
+    def resume_plan(self):
+        if not self.plan_frames or self.learned_facts is None:
+            return None
+        (goal, requirements, bindings, index) = self.plan_frames[0]
+        step = substitute(requirements[1][index], bindings)
+        for fact in self.learned_facts:
+            for failed in self.failed_lookups.get(fact[0], ()):
+                if failed != step and unify(failed, fact) is not False:
+                    return None
+        known_bindings = self.isKnown(step)
+        if known_bindings is False:
+            return None
+        outer_frames = self.plan_frames[1:]
+        self.plan_frames = None
+        self.recording_lookups = True  # the rest of the body is part of the plan
+        try:
+            action = self.nextAction(goal, requirements, {**bindings, **known_bindings}, 0, index + 1)
+        finally:
+            self.recording_lookups = False
+        if self.plan_frames is None or action is None or isinstance(action, list):
+            return None  # the body is finished or failed, which the full search handles
+        self.plan_frames += outer_frames
+        return action
 
     def choose_action_by_reasoning(self):
         goal = self.chooseGoal()
@@ -54,27 +111,83 @@ class System2Agent:
             return False
         if predicate in self.primitiveActionDict:
             return True
-        if hasattr(self, predicate) and callable(getattr(self, predicate)):
-            return True
-        underscore_action = convert_camel(predicate)
-        if hasattr(self, underscore_action) and callable(getattr(self, underscore_action)):
-            return True
-        return False
+        return self.primitive_function(predicate) is not None
+
+    # Return the function that performs a primitive action with this predicate, or None if there isn't one.
+    # Method names are resolved once per class and cached on the agent, and bound when the function is asked for, so
+    # the camelCase conversion is not repeated in the planning loop and the agent doesn't hold references to itself.
+    # A callable set on the agent itself is found too. The cache is reset when primitive actions are declared.
+    def primitive_function(self, predicate):
+        name = self.primitiveFunctionCache.get(predicate)
+        if name is None:
+            function = self.primitiveActionDict.get(predicate, predicate)
+            if not isinstance(function, str):
+                return function
+            name = primitive_method_name(self.__class__, function)  # function is the name declared or the predicate
+            if name is None:
+                for name in primitive_names(function):
+                    if callable(self.__dict__.get(name)):
+                        return self.__dict__[name]
+                return None
+            self.primitiveFunctionCache[predicate] = name
+        return getattr(self, name)
 
-    # Point to the internal structures of the other agent, typically to save space
+    # Point to the internal structures of the other agent, typically to save space. The rules are shared
+    # as a compiled program, so that either agent changing its rules later doesn't affect the other.
     def use_system2(self, agent):
-        self.goalWeightDict = agent.goalWeightDict
-        self.goalRequirementsDict = agent.goalRequirementsDict
+        if agent.system2Program is None:
+            agent.use_program(freeze_rules(agent))
+        self.use_program(agent.system2Program)
         self.primitiveActionDict = agent.primitiveActionDict
+        self.primitiveFunctionCache = dict()
+        self.term_table = agent.term_table
         #self.knownDict = agent.knownDict  # These are dynamic structures that should be separate for each agent
         #self.knownFalseDict = agent.knownFalseDict
-        self.transientDict = agent.transientDict
-        self.projectionRuleDict = agent.projectionRuleDict
-        self.triggerRules = agent.triggerRules
-        self.utilityRules = agent.utilityRules
-
 
+    # Point the agent's rules at a compiled program, which is shared and must not be changed in place
+    def use_program(self, program):
+        self.plan_frames = None
+        self.system2Program = program
+        self.goalWeightDict = program.goalWeightDict
+        self.goalRequirementsDict = program.goalRequirementsDict
+        self.transientDict = program.transientDict
+        self.projectionRuleDict = program.projectionRuleDict
+        self.triggerRules = program.triggerRules
+        self.utilityRules = program.utilityRules
+
+    # Copy on write: an agent sharing a compiled program takes its own copy of the rules before changing them
+    def own_rules(self):
+        self.plan_frames = None
+        if self.system2Program is not None:
+            self.goalWeightDict = dict(self.goalWeightDict)
+            self.goalRequirementsDict = dict([(head, list(clauses)) for (head, clauses) in self.goalRequirementsDict.items()])
+            self.transientDict = dict([(head, list(terms)) for (head, terms) in self.transientDict.items()])
+            self.projectionRuleDict = dict([(head, list(rules)) for (head, rules) in self.projectionRuleDict.items()])
+            self.triggerRules = list(self.triggerRules)
+            self.utilityRules = [list(rule) for rule in self.utilityRules]
+            self.system2Program = None
+
+    # Agent definitions are compiled once into a program that is shared by every agent reading the same definition
+    # on top of the same rules, e.g. every instance of a class that calls readAgent in its constructor.
+    # 'known' and 'primitive' lines apply to each agent and are replayed on it. An agent that has changed its own
+    # rules reads the definition directly.
     def readAgent(self, string):
+        if self.system2Program is None:
+            self.parseAgent(string)
+            return
+        key = (self.system2Program, string)
+        if key not in compiled_programs:
+            compiler = ProgramCompiler(self.system2Program, self)
+            compiler.parseAgent(string)
+            compiled_programs[key] = freeze_rules(compiler, compiler.known_facts, compiler.primitive_lines)
+        program = compiled_programs[key]
+        self.use_program(program)
+        for fact in program.known:
+            self.knownTuple(fact)
+        for primitives in program.primitives:
+            self.primitiveActions(primitives)
+
+    def parseAgent(self, string):
         # state is used for multi-line statements like goalRequirements
         # and projection rules
         state = 0
@@ -194,6 +307,7 @@ class System2Agent:
         head = goal
         if isinstance(goal, (list, tuple)):
             head = goal[0]
+        self.own_rules()
         if head not in self.projectionRuleDict:
             self.projectionRuleDict[head] = []
         effects = self.read_effect_lines(lines[1:])
@@ -204,6 +318,7 @@ class System2Agent:
             print("Reading trigger rule from", lines)
         trigger = self.readGoalTuple(lines[0][lines[0].find(" "):].strip())
         effects = self.read_effect_lines(lines[1:])  # trigger effects are just like project rule effects
+        self.own_rules()
         self.triggerRules.append((trigger, effects))
 
     def read_effect_lines(self, lines):
@@ -251,6 +366,7 @@ class System2Agent:
     # Lines are of the form condition -> incr, and each match to condition increments
     # utility by that amount.
     def readUtility(self, lines):
+        self.own_rules()
         for line in lines[1:]:
             if self.traceProject:
                 print("reading utility from", line)
@@ -264,6 +380,7 @@ class System2Agent:
         predicate = goal
         if isinstance(goal, (list,tuple)):
             predicate = goal[0]
+        self.own_rules()
         if predicate not in self.transientDict:
             self.transientDict[predicate] = []
         self.transientDict[predicate].append(goal)
@@ -271,11 +388,13 @@ class System2Agent:
             print("Transient:", self.transientDict)
 
     def goalWeight(self, goal, weight):
+        self.own_rules()
         self.goalWeightDict[goal] = weight
 
     def goalRequirements(self, goal, requirements):
         # Treat as append, index by goal name (head)
         # and collate the goal itself with the body
+        self.own_rules()
         if goal[0] not in self.goalRequirementsDict:
             self.goalRequirementsDict[goal[0]] = []
         self.goalRequirementsDict[goal[0]].append((goal, requirements))
@@ -286,6 +405,7 @@ class System2Agent:
 
     def clearGoalsAndPlans(self):
         # Remove goals and plans, allowing new behaviors while leaving primitive actions
+        self.own_rules()
         self.goalWeightDict = {}
         self.goalRequirementsDict = {}
         self.projectionRuleDict = {}
@@ -301,11 +421,17 @@ class System2Agent:
 
     def addTuple(self, t, adict):
         if t[0] not in adict:
-            adict[t[0]] = []
+            adict[t[0]] = FactList()
+        if self.term_table is not None:
+            t = self.term_table.intern(t)
         if t not in adict[t[0]]:
             if self.traceKnown:
                 print("recording as known", t)
             adict[t[0]].append(t)
+            if adict is not self.knownDict:
+                self.plan_frames = None
+            elif self.learned_facts is not None:
+                self.learned_facts.append(t)
 
     def known(self, predicate, arguments=[]):
         self.knownTuple(tuple([predicate]) + tuple(arguments))  # this allows arguments to be any iterable
@@ -367,8 +493,10 @@ class System2Agent:
 
     # Recursively move through subgoals and return the next primitive action
     # To add: return False if a subgoal is knownFalse
-    def nextAction(self, goal, requirements, bindings, indent):
-        for candidate in requirements[1]:
+    # start is the index of the first requirement to inspect, used when resuming a plan
+    def nextAction(self, goal, requirements, bindings, indent, start=0):
+        for index in range(start, len(requirements[1])):
+            candidate = requirements[1][index]
             subbed = substitute(candidate, bindings)
             if self.traceGoals:
                 print('  '*indent, "inspecting requirement", subbed, "from", candidate)
@@ -385,6 +513,8 @@ class System2Agent:
             elif self.isPrimitive(subbed):
                 if self.traceGoals:
                     print('  '*indent, "returning primitive", subbed)
+                if self.use_plan_cache:
+                    self.plan_frames = [(goal, requirements, bindings, index)]
                 return subbed
             elif self.isGoal(subbed):
                 action = self.chooseActionForGoals([subbed], indent + 2)
@@ -398,6 +528,8 @@ class System2Agent:
                         print('  '*indent, "from subgoaling, old bindings were", old_bindings, "and now are", bindings)
                     continue
                 else:
+                    if action is not None and self.plan_frames is not None:
+                        self.plan_frames.append((goal, requirements, bindings, index))
                     return action
             else:
                 print('  '*indent, subbed, "is not a goal or primitive or already known")
@@ -414,7 +546,10 @@ class System2Agent:
     # Known kind of conflates other ways of knowing things with knowing that a
     # subgoal has been performed
     def isKnown(self, goal):
-        return self.isIn(goal, self.knownDict)
+        bindings = self.isIn(goal, self.knownDict)
+        if bindings is False and self.recording_lookups:
+            self.failed_lookups.setdefault(goal[0], []).append(goal)
+        return bindings
 
     def isKnownFalse(self, goal):
         return self.isIn(goal, self.knownFalseDict)
@@ -438,7 +573,13 @@ class System2Agent:
 
     def isIn(self, goal, adict):
         if goal[0] in adict:
-            for term in adict[goal[0]]:
+            facts = adict[goal[0]]
+            # When every fact for the predicate is ground, a ground goal matches exactly when it is one of them
+            if isinstance(facts, FactList) and facts.all_ground and isGround(goal):
+                found = facts.find_ground(goal)
+                if found is not None:
+                    return {} if found else False
+            for term in facts:
                 bindings = unify(goal, term)
                 if bindings is not False:  # Since {} means success with no new bindings
                     return bindings
@@ -464,6 +605,8 @@ class System2Agent:
                     for fact in to_remove:
                         d[predicate].remove(fact)
                         forgotten.append(fact)
+        if forgotten:
+            self.plan_frames = None
         return [{}]  # succeed as a primitive action, with no bindings
 
     def findGoalRequirements(self, goal):
@@ -483,9 +626,16 @@ class System2Agent:
     ## Projection
     #################
 
-    def prefer_plan(self, plan_a, plan_b, initialWorld=None):
+    # With n_samples set, the plans are compared by sampling rollouts (see compare_plans_sampled) instead of
+    # projecting every effect deterministically.
+    def prefer_plan(self, plan_a, plan_b, initialWorld=None, n_samples=None, seed=None, confidence=0.95,
+                    processes=None):
         if initialWorld == None:  # by default, start from what's known in the world
             initialWorld=self.knownList()
+        if n_samples is not None:
+            comparison = self.compare_plans_sampled(plan_a, plan_b, initialWorld, n_samples, seed, confidence,
+                                                    processes)
+            return comparison['prefer_a']
         if self.traceProject:
             print('initial world for a:')
             for fact in initialWorld:
@@ -503,6 +653,82 @@ class System2Agent:
             print('a:', plan_a, exp_a, 'b:', plan_b, exp_b)
         return exp_a > exp_b
 
+    # Compare two plans by Monte-Carlo rollouts. Rollouts are drawn in rounds of rollouts_per_test for both plans
+    # until the confidence interval on the difference in expected utility excludes zero or n_samples rollouts per plan
+    # have been drawn. Each round is split into seeded chunks that are spread across the worker processes, so the
+    # result depends on the seed but not on the number of processes.
+    # The difference is tested after every round from min_rollouts_to_decide on, so each test uses a Bonferroni
+    # interval at confidence 1 - (1 - confidence) / tests, keeping the chance of deciding wrongly below 1 - confidence.
+    # Returns a dict with the estimate and interval for each plan and whether the preference was decided early.
+    def compare_plans_sampled(self, plan_a, plan_b, initialWorld=None, n_samples=1000, seed=None, confidence=0.95,
+                              processes=None):
+        if initialWorld is None:
+            initialWorld = self.knownList()
+        rng = random.Random(seed)
+        z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2.0)
+        tests = max(1, -(-n_samples // rollouts_per_test) - max(1, -(-min_rollouts_to_decide // rollouts_per_test)) + 1)
+        z_test = statistics.NormalDist().inv_cdf(1 - (1 - confidence) / (2.0 * tests))
+        utilities_a, utilities_b = [], []
+        decided = False
+        executor = ProcessPoolExecutor(processes) if processes is not None and processes > 1 else None
+        try:
+            while len(utilities_a) < n_samples:
+                n = min(rollouts_per_test, n_samples - len(utilities_a))
+                utilities_a += self.sample_utilities(plan_a, initialWorld, n, rng, executor)
+                utilities_b += self.sample_utilities(plan_b, initialWorld, n, rng, executor)
+                mean_a, _, var_a = mean_interval(utilities_a, z)
+                mean_b, _, var_b = mean_interval(utilities_b, z)
+                diff_half_width = z_test * math.sqrt(var_a / len(utilities_a) + var_b / len(utilities_b))
+                if len(utilities_a) >= min_rollouts_to_decide and abs(mean_a - mean_b) > diff_half_width:
+                    decided = True
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        mean_a, half_a, _ = mean_interval(utilities_a, z)
+        mean_b, half_b, _ = mean_interval(utilities_b, z)
+        if self.traceProject:
+            print('sampled a:', plan_a, mean_a, '+/-', half_a, 'b:', plan_b, mean_b, '+/-', half_b,
+                  'after', len(utilities_a), 'rollouts', 'decided' if decided else 'undecided')
+        return {'prefer_a': mean_a > mean_b, 'decided': decided, 'rollouts': len(utilities_a),
+                'a': (mean_a, (mean_a - half_a, mean_a + half_a)),
+                'b': (mean_b, (mean_b - half_b, mean_b + half_b))}
+
+    # Estimate the expected utility of a plan from n_samples rollouts.
+    # Returns the estimate and its confidence interval as (mean, (low, high)).
+    def sampled_expected_utility(self, plan, initialWorld=None, n_samples=1000, seed=None, confidence=0.95,
+                                 processes=None):
+        if initialWorld is None:
+            initialWorld = self.knownList()
+        z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2.0)
+        executor = ProcessPoolExecutor(processes) if processes is not None and processes > 1 else None
+        try:
+            utilities = self.sample_utilities(plan, initialWorld, n_samples, random.Random(seed), executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        mean, half_width, _ = mean_interval(utilities, z)
+        return mean, (mean - half_width, mean + half_width)
+
+    # Return the utilities of n_samples rollouts of the plan. Each chunk of rollouts gets its own seed drawn from
+    # rng, so the result only depends on the seed and not on whether an executor is used.
+    def sample_utilities(self, plan, initialWorld, n_samples, rng, executor=None):
+        program = (self.projectionRuleDict, self.triggerRules, self.utilityRules)
+        chunks = []
+        while n_samples > 0:
+            chunks.append((min(rollout_chunk_size, n_samples), rng.getrandbits(32)))
+            n_samples -= rollout_chunk_size
+        if executor is None:
+            results = [self.rollout_utilities(plan, initialWorld, n, chunk_seed) for (n, chunk_seed) in chunks]
+        else:
+            results = executor.map(run_rollouts, *zip(*[(program, plan, initialWorld, n, chunk_seed)
+                                                        for (n, chunk_seed) in chunks]))
+        return [utility for result in results for utility in result]
+
+    def rollout_utilities(self, plan, initialWorld, n_samples, seed):
+        rng = random.Random(seed)
+        return [self.utility(self.project_sample(plan, initialWorld, rng)) for _ in range(n_samples)]
+
     # recursively count the elements in an s-expression
     def my_size(self, x):
         if type(x) in [list, tuple]:
@@ -536,8 +762,16 @@ class System2Agent:
             print("Projecting", plan, "\n  yields", worlds)
         return worlds
 
-    # Project a single step by finding the appropriate projection rule
-    def project_step(self, step, world):
+    # Project one sampled rollout of the plan. Each probabilistic effect fires with its probability according to rng.
+    def project_sample(self, plan, state, rng):
+        world = state
+        for step in plan:
+            world = self.project_step(step, world, rng)[0]
+        return world
+
+    # Project a single step by finding the appropriate projection rule. If rng is given, probabilistic effects
+    # are sampled, otherwise every effect whose precondition holds is applied.
+    def project_step(self, step, world, rng=None):
         if self.traceProject:
             print('projecting', step, 'on', world)
         head = step   # predicate for the rule, which is the step if it's a string..
@@ -555,7 +789,7 @@ class System2Agent:
                     matched = True
                     if self.traceProject:
                         print("Rule", rule, "matches with bindings", bindings)
-                    world, copied = self.apply_effects_list(rule[1], world, bindings, copied)
+                    world, copied = self.apply_effects_list(rule[1], world, bindings, copied, rng)
                     #return [world]  Now want to add triggers in the same function
                     break
         # Default effect if no rule matched
@@ -565,22 +799,25 @@ class System2Agent:
             if not copied:
                 world = list(world)
                 copied = True
-            world = world + [('performed', step)]
+            performed = ('performed', step)
+            world = world + [performed if self.term_table is None else self.term_table.lookup(performed)]
         # Next run any triggers that match (will match them every step henceforth, but could add an effect to stop that)
         for trigger in self.triggerRules:
             all_bindings = allMatches(trigger[0], world, [bindings])
             for trigger_bindings in all_bindings:
-                world, copied = self.apply_effects_list(trigger[1], world, trigger_bindings, copied)
+                world, copied = self.apply_effects_list(trigger[1], world, trigger_bindings, copied, rng)
         return [world]
 
-    def apply_effects_list(self, effects, world, bindings, copied):
+    def apply_effects_list(self, effects, world, bindings, copied, rng=None):
         for effect in effects:
+            if rng is not None and not effect.fires(bindings, rng):
+                continue
             if effect.precondition is True or match_precond(substitute(effect.precondition, bindings), world):
                 # As soon as we know there will be a change make sure this is a copy
                 if not copied:
                     world = list(world)
                     copied = True  # but only need to copy once
-                world = effect.update_world(world, bindings)
+                world = effect.update_world(world, bindings, self.term_table)
         return world, copied
 
 
@@ -601,6 +838,120 @@ class System2Agent:
         return [{}]
 
 
+# A dict that can't be changed in place, used for the rules in a compiled program
+class FrozenDict(dict):
+
+    def immutable(self, *args, **kwargs):
+        raise TypeError("compiled agent programs are shared and can't be changed, call own_rules first")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = immutable
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+# The rules read from agent definitions, frozen so they can be shared by any number of agents. Lists of rules
+# become tuples. known and primitives hold the facts and primitive declarations that readAgent applies to each agent.
+class AgentProgram(object):
+
+    def __init__(self, goalWeightDict, goalRequirementsDict, transientDict, projectionRuleDict, triggerRules,
+                 utilityRules, known=(), primitives=()):
+        self.goalWeightDict = FrozenDict(goalWeightDict)
+        self.goalRequirementsDict = FrozenDict([(head, tuple(clauses)) for (head, clauses) in goalRequirementsDict.items()])
+        self.transientDict = FrozenDict([(head, tuple(terms)) for (head, terms) in transientDict.items()])
+        self.projectionRuleDict = FrozenDict([(head, tuple(rules)) for (head, rules) in projectionRuleDict.items()])
+        self.triggerRules = tuple(triggerRules)
+        self.utilityRules = tuple([tuple(rule) for rule in utilityRules])
+        self.known = tuple(known)
+        self.primitives = tuple(primitives)
+
+
+# Compile the current rules of an agent into a program
+def freeze_rules(agent, known=(), primitives=()):
+    return AgentProgram(agent.goalWeightDict, agent.goalRequirementsDict, agent.transientDict,
+                        agent.projectionRuleDict, agent.triggerRules, agent.utilityRules, known, primitives)
+
+
+# Reads an agent definition on top of an existing program, recording the known facts and primitive declarations
+# instead of applying them. Trace settings are taken from the agent being loaded.
+class ProgramCompiler(System2Agent):
+
+    def __init__(self, program, agent):
+        System2Agent.__init__(self)
+        self.use_program(program)
+        self.own_rules()
+        self.traceLoad = agent.traceLoad
+        self.traceParse = agent.traceParse
+        self.traceProject = agent.traceProject
+        self.known_facts = []
+        self.primitive_lines = []
+
+    def knownTuple(self, t):
+        self.known_facts.append(t)
+
+    def primitiveActions(self, l):
+        self.primitive_lines.append(l)
+
+
+# Compiled programs keyed by the program they extend and the definition read
+compiled_programs = dict()
+# The program every agent starts from.
+# 'forget' is transient so you can keep forgetting things.
+# Removing it will break something, but I need to be able to get past a 'forget'
+# clause in the middle of some goal requirements, which will never happen if forget is transient.
+# I think the best answer right now might be to add some judicious forget([forget(x)]) statements
+base_program = AgentProgram({}, {}, {'forget': [('forget', 'x')]}, {}, [], [])
+
+
+# Maps (class, predicate) to the name of the method that performs the predicate as a primitive action, or None
+primitive_method_names = dict()
+# Maps each predicate to the names a method performing it may have: the predicate and its camelCase converted
+primitive_name_pairs = dict()
+
+
+def primitive_method_name(cls, predicate):
+    key = (cls, predicate)
+    if key not in primitive_method_names:
+        primitive_method_names[key] = None
+        for name in primitive_names(predicate):
+            if callable(getattr(cls, name, None)):
+                primitive_method_names[key] = name
+                break
+    return primitive_method_names[key]
+
+
+def primitive_names(predicate):
+    names = primitive_name_pairs.get(predicate)
+    if names is None:
+        names = primitive_name_pairs[predicate] = (predicate, convert_camel(predicate))
+    return names
+
+
+# Rollouts are sent to worker processes in chunks of this size, sampled plans are compared after every
+# rollouts_per_test rollouts of each, and preferences are not decided on fewer than min_rollouts_to_decide
+rollout_chunk_size = 50
+rollouts_per_test = 4 * rollout_chunk_size
+min_rollouts_to_decide = 100
+
+
+# Run sampled rollouts in a worker process. The program is the agent's projection, trigger and utility rules,
+# which are loaded into a bare System2Agent since the agent itself may hold sockets or other unpicklable state.
+def run_rollouts(program, plan, initialWorld, n_samples, seed):
+    projector = System2Agent()
+    (projector.projectionRuleDict, projector.triggerRules, projector.utilityRules) = program
+    return projector.rollout_utilities(plan, initialWorld, n_samples, seed)
+
+
+# Return the mean of a list of samples, the half-width of its confidence interval for the normal quantile z,
+# and the sample variance.
+def mean_interval(values, z):
+    mean = sum(values) / float(len(values))
+    if len(values) < 2:
+        return mean, 0.0, 0.0
+    variance = sum([(v - mean) ** 2 for v in values]) / (len(values) - 1)
+    return mean, z * math.sqrt(variance / len(values)), variance
+
+
 def match_precond(precond, world):
     if precond is True:
         return True
@@ -662,10 +1013,22 @@ class Effect(object):
     def __repr__(self):
         return "<effect: %s -> %s %s>" % (self.precondition, '+' if self.addOrDelete == self.add else '-', self.term)
 
-    # return a world after this effect happens in the input world (list of facts)
-    def update_world(self, world, bindings):
+    # Decide whether the effect happens in a sampled rollout. The probability may be a variable bound by the rule.
+    def fires(self, bindings, rng):
+        probability = self.probability
+        if isinstance(probability, str):
+            probability = bindings.get(probability, 1)
+        if not isinstance(probability, (int, float)):
+            return True
+        return rng.random() < probability
+
+    # return a world after this effect happens in the input world (list of facts), using the canonical instance of
+    # the fact from term_table if there is one
+    def update_world(self, world, bindings, term_table=None):
         if isinstance(self.term, (list, tuple)):
             fact = substitute(self.term, bindings)
+            if term_table is not None:
+                fact = term_table.lookup(fact)
         else:
             fact = self.term
         if self.addOrDelete == Effect.add:
@@ -676,6 +1039,185 @@ class Effect(object):
         return world
 
 
+# Hash-consing table for terms: one canonical instance of each distinct hashable term, whose sub-terms are canonical
+# too. Agents whose term_table is set to the same table, e.g. every agent of a Trial with its term_table set, or an
+# agent and those that use_system2 it, intern the facts they record in it, so a fact known by many agents is stored
+# once and equal facts are usually the same object, letting list membership and equality tests succeed on identity
+# before comparing structure. The table lives as long as the trial or agents holding it. Projection only looks facts
+# up, so sampled rollouts don't fill the table. A table may be shared by agents running in different threads.
+# Terms such as ('p', 1) and ('p', True) are equal but each keeps its own constants: a term only gets a canonical
+# instance whose constants are of the same types, and is otherwise left as it is.
+class TermTable(object):
+
+    def __init__(self):
+        self.canonical = dict()  # maps each term to its canonical instance
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.canonical)
+
+    # Return the canonical instance of term, adding it to the table if necessary. Terms containing lists can't be
+    # hashed and are returned with their elements interned.
+    def intern(self, term):
+        if isinstance(term, str):
+            return sys.intern(term)
+        if isinstance(term, list):
+            return [self.intern(x) for x in term]
+        if not isinstance(term, tuple):
+            return term  # numbers and other constants are left alone so that e.g. True is not replaced by 1
+        try:
+            found = self.canonical.get(term)
+        except TypeError:  # contains a list
+            return tuple([self.intern(x) for x in term])
+        if found is not None:
+            return found if same_types(found, term) else tuple([self.intern(x) for x in term])
+        term = tuple([self.intern(x) for x in term])
+        with self.lock:
+            found = self.canonical.setdefault(term, term)
+        return found if found is term or same_types(found, term) else term
+
+    def __getstate__(self):
+        return {'canonical': self.canonical}
+
+    def __setstate__(self, state):
+        self.canonical = state['canonical']
+        self.lock = threading.Lock()
+
+    # Return the canonical instance of term if the table has one, or term itself, without adding to the table
+    def lookup(self, term):
+        try:
+            found = self.canonical.get(term)
+        except TypeError:
+            return term
+        return found if found is not None and same_types(found, term) else term
+
+
+# Whether two equal terms are made of constants of the same types
+def same_types(term, other):
+    if type(term) is not type(other):
+        return False
+    if isinstance(term, (tuple, list)):
+        for (x, y) in zip(term, other):
+            if x is not y and not same_types(x, y):
+                return False
+    return True
+
+
+# The list of facts stored for one predicate in knownDict and similar dicts. Once it holds index_size facts it also
+# keeps them in a set, so membership is a set lookup, and it records whether all its facts are ground, in which case
+# isIn can decide a ground goal without unifying against each fact. Short lists, which most are, just scan their
+# facts and take no more space than a list. Every method that changes the list keeps the set and flag up to date.
+class FactList(list):
+
+    __slots__ = ('index', 'all_ground')
+
+    index_size = 8
+
+    def __init__(self, facts=()):
+        list.__init__(self)
+        self.index = None
+        self.all_ground = True
+        self.extend(facts)
+
+    def __reduce__(self):
+        return FactList, (list(self),)
+
+    def __contains__(self, fact):
+        if self.index is not None:
+            try:
+                return fact in self.index
+            except TypeError:  # a fact containing a list is only equal to facts that aren't in the set
+                pass
+        return list.__contains__(self, fact)
+
+    # For a ground goal when all the facts are ground, return whether the goal is one of them, or None if the
+    # goal can't be hashed. (Unify treats lists and tuples alike, so those goals still need to be unified.)
+    def find_ground(self, goal):
+        try:
+            hash(goal)
+        except TypeError:
+            return None
+        return goal in self
+
+    # Note a fact that has been added to the list
+    def added(self, fact):
+        try:
+            hash(fact)
+        except TypeError:
+            self.all_ground = False
+            return
+        if self.all_ground and not isGround(fact):
+            self.all_ground = False
+        if self.index is not None:
+            self.index.add(fact)
+        elif len(self) >= self.index_size:
+            self.reindex()
+
+    def reindex(self):
+        self.all_ground = True
+        self.index = set()
+        for fact in self:
+            try:
+                self.index.add(fact)
+            except TypeError:
+                self.all_ground = False
+                continue
+            if self.all_ground and not isGround(fact):
+                self.all_ground = False
+        if len(self) < self.index_size:
+            self.index = None
+
+    def append(self, fact):
+        list.append(self, fact)
+        self.added(fact)
+
+    def extend(self, facts):
+        for fact in facts:
+            self.append(fact)
+
+    def __iadd__(self, facts):
+        self.extend(facts)
+        return self
+
+    def insert(self, position, fact):
+        list.insert(self, position, fact)
+        self.added(fact)
+
+    def remove(self, fact):
+        list.remove(self, fact)
+        self.removed(fact)
+
+    def pop(self, position=-1):
+        fact = list.pop(self, position)
+        self.removed(fact)
+        return fact
+
+    # Note a fact that has been taken out of the list, which may still hold an equal fact
+    def removed(self, fact):
+        if self.index is not None and not list.__contains__(self, fact):
+            try:
+                self.index.discard(fact)
+            except TypeError:
+                pass
+
+    def __setitem__(self, position, value):
+        list.__setitem__(self, position, value)
+        self.reindex()
+
+    def __delitem__(self, position):
+        list.__delitem__(self, position)
+        self.reindex()
+
+    def __imul__(self, n):
+        list.__imul__(self, n)
+        self.reindex()
+        return self
+
+    def clear(self):
+        list.clear(self)
+        self.reindex()
+
+
 # Just clarifies the code a little
 def isConstant(term):
     return not isVar(term)
@@ -687,10 +1229,26 @@ def isVar(term):
     return isinstance(term, str) and not term.startswith("_")
 
 
+# True if the term has no variables. As in unify, the first element of a tuple is its predicate, not an argument.
+def isGround(term):
+    if isinstance(term, (list, tuple)):
+        for arg in term[1:]:
+            if not isGround(arg):
+                return False
+        return True
+    return not isVar(term)
+
+
 # Substitute bindings in tuple representation of a term,
 # where the first argument is the predicate.
 # Needs to support structure in the term arguments.
+# Tuples none of whose leaves are bound are returned unchanged rather than rebuilt, so only the paths
+# leading to bound variables are copied. Lists are always copied, as they may be changed by the caller.
 def substitute(predicate, bindings):
+    if isinstance(predicate, tuple):
+        info = substitution_info(predicate)
+        if info is not None and info[0].isdisjoint(bindings):
+            return predicate
     if isinstance(predicate, (list, tuple)):
         args = [substitute_argument(arg, bindings) for arg in predicate[1:]]
         return tuple([predicate[0]] + args)
@@ -701,11 +1259,57 @@ def substitute_argument(arg, bindings):
     if isinstance(arg, list):
         return [substitute_argument(x, bindings) for x in arg]
     elif isinstance(arg, tuple):
+        info = substitution_info(arg)
+        if info is not None and info[0].isdisjoint(bindings) and not info[1] in bindings:
+            return arg
         return tuple([substitute_argument(x, bindings) for x in arg])
-    elif not isinstance(arg, collections.Hashable) or arg not in bindings:
+    try:
+        return bindings.get(arg, arg)
+    except TypeError:  # not hashable, so can't be bound
         return arg
-    else:
-        return bindings[arg]
+
+
+# Return (leaves of the arguments, hashable head or None) for a tuple, or None if the tuple contains a list.
+# As in substitute, the head of a top-level term is never replaced but the head of a nested tuple may be.
+# The results are cached by the term itself, so equal terms, such as a rule body and its interned copies, share an
+# entry and the least recently used are dropped when the cache is full. Rule bodies are substituted every cycle and
+# stay in the cache. Terms that can't be hashed are not cached.
+def substitution_info(term):
+    try:
+        return substitution_cache(term)
+    except TypeError:
+        return term_substitution_info(term)
+
+
+def term_substitution_info(term):
+    leaves = set()
+    for arg in term[1:]:
+        if isinstance(arg, list):
+            return None
+        elif isinstance(arg, tuple):
+            arg_info = substitution_info(arg)
+            if arg_info is None:
+                return None
+            leaves.update(arg_info[0])
+            if arg_info[1] is not None:
+                leaves.add(arg_info[1])
+        else:
+            try:
+                leaves.add(arg)
+            except TypeError:
+                pass
+    head = term[0] if term else None
+    if isinstance(head, (list, tuple)):
+        return None
+    try:
+        hash(head)
+    except TypeError:
+        head = None
+    return frozenset(leaves), head
+
+
+substitution_cache_size = 100000
+substitution_cache = functools.lru_cache(maxsize=substitution_cache_size)(term_substitution_info)
 
 traceUnify = False
 
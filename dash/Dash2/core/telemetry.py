@@ -0,0 +1,162 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Progress and throughput metrics for a run of a LocalWorkProcessor or WorkProcessor. Most metrics are read from the
+# processor when a snapshot is taken, from its event_counter (or iteration), event_queue and time, so the simulation
+# loop pays only for count_action, a dict update per action taken. Snapshots hold
+#   events, iterations, events_per_second since the start and recent_events_per_second since the last snapshot,
+#   queue_depth, simulated_time and simulated_seconds_per_wall_second, rss_bytes, and actions, counts by action name
+# and are published with publish(): served over HTTP as JSON at / and in Prometheus text format at /metrics, and/or
+# written every interval seconds to a Prometheus text file, e.g. for node_exporter's textfile collector.
+class Telemetry(object):
+
+    def __init__(self, source, prefix='dash_'):
+        self.source = source
+        self.prefix = prefix
+        self.actions = dict()
+        self.started = None  # wall clock time of start()
+        self.start_time = None  # simulated time at start()
+        self.last = None  # (wall clock time, events) at the last snapshot
+        self.server = None
+        self.writer = None
+        self.path = None  # Prometheus text file written by the writer thread
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.started = time.time()
+        self.start_time = getattr(self.source, 'time', None)  # set when resuming from a checkpoint
+        if not isinstance(self.start_time, (int, float)):
+            self.start_time = getattr(self.source, 'start_time', None)
+        self.last = (self.started, self.events())
+
+    # Count an action returned by an agent's decision cycle, by name for DASH actions such as ('doWork', 'x')
+    def count_action(self, action):
+        if action is None or isinstance(action, bool):
+            return
+        if isinstance(action, (tuple, list)) and action:
+            action = action[0]
+        action = str(action)
+        self.actions[action] = self.actions.get(action, 0) + 1
+
+    def events(self):
+        events = getattr(self.source, 'event_counter', None)
+        return events if events is not None else getattr(self.source, 'iteration', 0)
+
+    def snapshot(self):
+        if self.started is None:
+            self.start()
+        now = time.time()
+        events = self.events()
+        wall = now - self.started
+        (last_wall, last_events) = self.last
+        self.last = (now, events)
+        metrics = {'wall_seconds': wall,
+                   'events': events,
+                   'iterations': getattr(self.source, 'iteration', 0),
+                   'events_per_second': events / wall if wall > 0 else 0.0,
+                   'recent_events_per_second': (events - last_events) / (now - last_wall) if now > last_wall else 0.0,
+                   'rss_bytes': rss_bytes(),
+                   'actions': dict(self.actions)}
+        queue = getattr(self.source, 'event_queue', None)
+        if queue is not None:
+            metrics['queue_depth'] = len(queue)
+        simulated_time = getattr(self.source, 'time', None)
+        if isinstance(simulated_time, (int, float)) and not isinstance(simulated_time, bool):
+            metrics['simulated_time'] = simulated_time
+            if isinstance(self.start_time, (int, float)) and wall > 0:
+                metrics['simulated_seconds_per_wall_second'] = (simulated_time - self.start_time) / wall
+        return metrics
+
+    def prometheus_text(self, metrics=None):
+        if metrics is None:
+            metrics = self.snapshot()
+        lines = []
+        for (name, value) in sorted(metrics.items()):
+            if name == 'actions' or value is None:
+                continue
+            metric = self.prefix + (name + '_total' if name in ['events', 'iterations'] else name)
+            lines.append('# TYPE ' + metric + (' counter' if metric.endswith('_total') else ' gauge'))
+            lines.append(metric + ' ' + repr(value))
+        if metrics['actions']:
+            metric = self.prefix + 'actions_total'
+            lines.append('# TYPE ' + metric + ' counter')
+            for (action, count) in sorted(metrics['actions'].items()):
+                label = action.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                lines.append(metric + '{action="' + label + '"} ' + str(count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(temporary, path)
+
+    # Serve metrics on port, if given, and write them to path every interval seconds, if given, until close()
+    def publish(self, port=None, path=None, interval=10.0, host='127.0.0.1'):
+        if self.started is None:
+            self.start()
+        self.stopped.clear()
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+            self.server.telemetry = self
+            threading.Thread(target=self.server.serve_forever, name='Telemetry server', daemon=True).start()
+        if path is not None:
+            self.path = path
+            self.writer = threading.Thread(target=self.write_periodically, args=(path, interval), name='Telemetry',
+                                           daemon=True)
+            self.writer.start()
+
+    def write_periodically(self, path, interval):
+        while not self.stopped.wait(interval):
+            self.write_prometheus(path)
+
+    def close(self):
+        self.stopped.set()
+        if self.writer is not None:
+            self.writer.join()
+            self.write_prometheus(self.path)  # final values
+            self.writer = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        telemetry = self.server.telemetry
+        if self.path.split('?')[0] == '/metrics':
+            body = telemetry.prometheus_text().encode()
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            body = json.dumps(telemetry.snapshot()).encode()
+            content_type = 'application/json'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Resident set size of this process, or its peak where the current size can't be read
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
@@ -26,6 +26,13 @@ class Trial(object):
             setattr(self, attr, data[attr])
         self.iteration = 0
         self.zk = zk
+        # If set to a batched System1Population, its agents' system 1s are spread together before each iteration
+        # and decayed together after it
+        self.system1_population = None
+        # If set to a DecisionCycleProfiler, it is attached to the agents when the trial runs
+        self.profiler = None
+        # If set to a TermTable, the System2 facts that the agents record during the run are interned in it
+        self.term_table = None
 
         if zk is not None:
             self.exp_id = exp_id
@@ -85,10 +92,14 @@ class Trial(object):
 
     # Default method to run one iteration of the trial: run one iteration of every active agent
     def run_one_iteration(self):
+        if self.system1_population is not None and self.system1_population.batched:
+            self.system1_population.system1_update_all()
         for agent in self.agents:
             if not self.agent_should_stop(agent):
                 next_action = agent.agent_loop(max_iterations=1, disconnect_at_end=False)  # don't disconnect since will run again
                 self.process_after_agent_action(agent, next_action)
+        if self.system1_population is not None and self.system1_population.batched:
+            self.system1_population.system1_step_all()
 
     def run(self):
         self.initialize()
@@ -98,6 +109,10 @@ class Trial(object):
         else: # overridden in each subclass to do something useful
             for agent in self.agents:
                 agent.traceLoop = False
+                if self.profiler is not None:
+                    self.profiler.attach(agent)
+                if self.term_table is not None and hasattr(agent, 'term_table'):
+                    agent.term_table = self.term_table
             while not self.should_stop():
                 self.run_one_iteration()
                 self.process_after_iteration()
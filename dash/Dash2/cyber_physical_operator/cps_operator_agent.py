@@ -8,7 +8,6 @@ import sys; sys.path.extend(['../../'])
 
 from Dash2.core.dash_agent import DASHAgent
 from Dash2.core.system2 import isVar
-from Dash2.core.string_aux import convert_camel
 from Dash2.core.system2 import System2Agent, substitute
 from Dash2.core.system1 import System1Agent
 from Dash2.core.client import Client
@@ -132,21 +131,15 @@ class OperatorDashAction(Client, System1Agent, System2Agent):
                 self.primitiveActionDict[item] = item  # store the name and look for the function at planning time
             else:
                 self.primitiveActionDict[item[0]] = item[1]
+        self.primitiveFunctionCache = dict()  # resolved functions may now be out of date
+        self.plan_frames = None  # and so may a cached plan
 
-    # This format is now inefficient since we have different ways that a predicate can be a primitive action
+    # The function is found by primitive_function in system2, which caches it for the agent
     def perform_action(self, action):
         if self.isPrimitive(action):
-            predicate = action[0]
-            if predicate in self.primitiveActionDict:
-                function = self.primitiveActionDict[action[0]]
-            elif hasattr(self, predicate) and callable(getattr(self, predicate)):
-                function = getattr(self, predicate)
-            else:
-                underscore_action = convert_camel(predicate)
-                if hasattr(self, underscore_action) and callable(getattr(self, underscore_action)):
-                    function = getattr(self, underscore_action)
-                else:
-                    return
+            function = self.primitive_function(action[0])
+            if function is None:
+                return
             return function(action)
 
     def update_beliefs(self, result, action):
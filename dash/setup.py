@@ -10,5 +10,5 @@ setup(name='Dash2',
       author='Jim Blythe <blythe@isi.edu>', 
       license='MIT',                        
       packages=find_packages(exclude=['papers', 'docs']),
-      install_requires=['numpy', 'pandas']
+      install_requires=['numpy', 'pandas', 'scipy']
 )
@@ -0,0 +1,63 @@
+# Shared by the tests that run discrete event simulations: agents, initial states, and a test case that runs
+# processors in a temporary directory
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from Dash2.core.des_work_processor import LocalWorkProcessor
+from Dash2.core.event_log import read_event_log
+
+start_time = 1483228800  # 2017-01-01
+
+
+# Agents acting every one to three hours, logging each event. Subclasses change what they do and log.
+class HourlyAgent(object):
+
+    def next_event_time(self, agent_data, curr_time, start_time, max_time):
+        next_time = curr_time + 3600 * (1 + agent_data['id'] % 3)
+        return next_time if next_time < max_time else None
+
+    def agent_decision_cycle(self, agent_data, event_time, agents):
+        self.hub.json_log_file.write({'t': event_time, 'id': agent_data['id']})
+
+
+# The data of agent i, whose last events are spread over the first half hour
+def agent_data(i, **fields):
+    return dict({'id': i, 'last_event_time': start_time + (i % 4) * 600}, **fields)
+
+
+# An initial state function for LocalWorkProcessor, giving agents 0 to size - 1 the data make_data(i)
+def initial_state(size, make_data=agent_data):
+    return lambda training_data, initial_state, **kwargs: dict((i, make_data(i)) for i in range(size))
+
+
+class SimulationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    # A processor running from 2017-01-01 to the end of end_date, writing its log to name in the test's directory
+    def make_processor(self, name, agent, initial_state_fn, end_date='2017-01-03', processor_class=LocalWorkProcessor,
+                       **kwargs):
+        with redirect_stdout(io.StringIO()):
+            return processor_class(self.path(name), '2017-01-01', end_date, agent, initial_state_fn,
+                                   training_file=None, initial_state_file=None, **kwargs)
+
+    # Make a processor as above and run it quietly
+    def run_processor(self, name, agent, initial_state_fn, **kwargs):
+        processor = self.make_processor(name, agent, initial_state_fn, **kwargs)
+        with redirect_stdout(io.StringIO()):
+            processor.run_experiment()
+        return processor
+
+    def read_log(self, name):
+        return list(read_event_log(self.path(name)))
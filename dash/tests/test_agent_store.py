@@ -0,0 +1,161 @@
+import copy
+import io
+import os
+import pickle
+import shutil
+import unittest
+from contextlib import redirect_stdout
+import numpy
+from Dash2.core.agent_store import AgentStore, AgentRecord, agent_tuples, detached
+from des_helpers import HourlyAgent, SimulationTestCase, agent_data, initial_state
+
+fields = [('last_event_time', 'i8'), ('count', 'i4'), ('name', 'U8')]
+
+
+def population(size=5):
+    return dict(('a%d' % i, {'last_event_time': 10 + i, 'count': i, 'name': 'n%d' % i, 'friends': ['a%d' % (i + 1)]})
+                for i in range(size))
+
+
+class AgentStoreTest(SimulationTestCase):
+
+    def make_store(self, path=None, agents=None):
+        store = AgentStore(fields, path=path and self.path(path), capacity=2)
+        for agent_id, agent_data in (agents or population()).items():
+            store[agent_id] = agent_data
+        return store
+
+    def assertSameAgents(self, store, agents):
+        self.assertEqual(list(store), list(agents))
+        self.assertEqual(dict((agent_id, dict(store[agent_id])) for agent_id in store), agents)
+
+    def test_dict_round_trip(self):
+        for path in [None, 'agents.dat']:
+            store = self.make_store(path)
+            self.assertSameAgents(store, population())
+            record = store['a3']
+            self.assertIsInstance(record, AgentRecord)
+            record['count'] += 2
+            record['mood'] = 'ok'
+            del record['friends']
+            self.assertEqual(dict(store['a3']), {'last_event_time': 13, 'count': 5, 'name': 'n3', 'mood': 'ok'})
+            self.assertEqual(detached(record), dict(record))
+            store['a3'] = store['a3']
+            self.assertEqual(dict(store['a3']), {'last_event_time': 13, 'count': 5, 'name': 'n3', 'mood': 'ok'})
+            self.assertEqual([dict(agent_data) for (_, agent_data) in agent_tuples(None, store)],
+                             [dict(store[agent_id]) for agent_id in store])
+            self.assertRaises(TypeError, store.__delitem__, 'a1')
+
+    def test_memmap_reopen(self):
+        store = self.make_store('agents.dat', population(40))
+        store['a7']['count'] = 70
+        store.flush()
+        copied = self.path('copy.dat')
+        shutil.copyfile(store.path, copied)
+        store['a7']['count'] = 71  # after the copy
+        reopened = AgentStore.reopen(copy.deepcopy(store.layout()), copied)
+        self.assertIsInstance(reopened.array, numpy.memmap)
+        self.assertEqual(reopened.path, store.path)
+        self.assertEqual(reopened['a7']['count'], 70)
+        reopened['a40'] = {'count': 1}
+        self.assertEqual(dict(reopened['a40']), {'count': 1})
+
+    def test_unset_fields_are_missing(self):
+        for path in [None, 'agents.dat']:
+            store = self.make_store(path, {'a': {'count': 3}, 'b': {'name': 'bee', 'last_event_time': 5}})
+            record = store['a']
+            self.assertNotIn('last_event_time', record)
+            self.assertIn('count', record)
+            self.assertRaises(KeyError, record.__getitem__, 'name')
+            self.assertEqual(record.get('name', 'none'), 'none')
+            self.assertEqual((list(record), len(record)), (['count'], 1))
+            record['name'] = 'ay'
+            del store['b']['last_event_time']
+            self.assertRaises(KeyError, store['b'].__delitem__, 'count')
+            store = pickle.loads(pickle.dumps(store))
+            self.assertEqual(dict(store['a']), {'count': 3, 'name': 'ay'})
+            self.assertEqual(dict(store['b']), {'name': 'bee'})
+            store['a'] = {'friends': []}
+            self.assertEqual(dict(store['a']), {'friends': []})
+
+    def test_pickle(self):
+        for path in [None, 'agents.dat']:
+            store = pickle.loads(pickle.dumps(self.make_store(path)))
+            self.assertIsNone(store.path)
+            self.assertSameAgents(store, population())
+
+    def test_copy_on_write(self):
+        store = self.make_store('agents.dat')
+        store.copy_on_write()
+        store['a1']['count'] = 100
+        store.flush()
+        self.assertEqual(store['a1']['count'], 100)
+        self.assertEqual(AgentStore.reopen(store.layout())['a1']['count'], 1)
+
+
+# Agents acting every one to three hours, counting their events in the store
+class CountingAgent(HourlyAgent):
+
+    def agent_decision_cycle(self, agent_data, event_time, agents):
+        agent_data['count'] += 1
+        seen = agents[(agent_data['id'] + 1) % len(agents)][1]['count']
+        self.hub.json_log_file.write({'t': event_time, 'id': agent_data['id'], 'count': agent_data['count'],
+                                      'seen': seen})
+
+
+# Some agents have no last_event_time, and are never scheduled
+def some_scheduled(i):
+    data = {'id': i, 'count': 0}
+    if i % 5:
+        data['last_event_time'] = agent_data(i)['last_event_time']
+    return data
+
+
+class StorePopulationTest(SimulationTestCase):
+
+    # The initial event queue and the log of a day's run
+    def run_counting(self, name, initial_state_fn):
+        processor = self.make_processor(name, CountingAgent(), initial_state_fn, end_date='2017-01-02')
+        queue = sorted(processor.events_heap)
+        with redirect_stdout(io.StringIO()):
+            processor.run_experiment()
+        return queue, self.read_log(name)
+
+    def test_store_schedules_the_same_agents_as_a_dict(self):
+        def in_store(*args, **kwargs):
+            store = AgentStore([('id', 'i8'), ('count', 'i8'), ('last_event_time', 'i8')])
+            for i in range(40):
+                store[i] = some_scheduled(i)
+            return store
+        (queue, log) = self.run_counting('dict.json', initial_state(40, some_scheduled))
+        self.assertEqual(len(queue), 32)
+        self.assertEqual(self.run_counting('store.json', in_store), (queue, log))
+
+
+class CheckpointedStoreTest(SimulationTestCase):
+
+    def initial_state(self, training_data, initial_state, **kwargs):
+        store = AgentStore([('id', 'i8'), ('count', 'i8'), ('last_event_time', 'i8')], path=self.path('agents.dat'))
+        for i in range(40):
+            store[i] = agent_data(i, count=0)
+        return store
+
+    def run_counting(self, name, **kwargs):
+        return self.run_processor(name, CountingAgent(), self.initial_state, end_date='2017-01-04', **kwargs)
+
+    def test_resume_maps_the_store(self):
+        self.run_counting('whole.json')
+        whole = self.read_log('whole.json')
+        checkpoints = self.path('checkpoints')
+        self.run_counting('resumed.json', checkpoint_dir=checkpoints, checkpoint_every=50, max_iterations=500)
+        self.assertTrue(any(name.endswith('.dat') for name in os.listdir(checkpoints)))
+        self.assertEqual(len([name for name in os.listdir(checkpoints) if name.endswith('.dat')]), 1)
+        resumed = self.run_counting('resumed.json', resume_from=checkpoints)
+        self.assertIsInstance(resumed.agents_data, AgentStore)
+        self.assertIsInstance(resumed.agents_data.array, numpy.memmap)
+        self.assertEqual(resumed.agents_data.path, self.path('agents.dat'))
+        self.assertEqual(self.read_log('resumed.json'), whole)
+
+
+if __name__ == '__main__':
+    unittest.main()
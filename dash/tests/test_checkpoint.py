@@ -0,0 +1,59 @@
+import random
+import unittest
+import numpy
+from Dash2.core.event_log import read_columns
+from des_helpers import SimulationTestCase, initial_state
+
+
+# Agents drawing their next event times and data from both random generators, so that a resumed run only matches
+# if the generators' states are restored too
+class RandomAgent(object):
+
+    def next_event_time(self, agent_data, curr_time, start_time, max_time):
+        next_time = curr_time + random.randrange(600, 7200) + int(numpy.random.randint(0, 60))
+        return next_time if next_time < max_time else None
+
+    def agent_decision_cycle(self, agent_data, event_time, agents):
+        agent_data['count'] = agent_data.get('count', 0) + 1
+        agent_data['sum'] = agent_data.get('sum', 0) + random.random()
+        self.hub.json_log_file.write({'t': event_time, 'id': agent_data['id'], 'c': agent_data['count'],
+                                      's': agent_data['sum']})
+
+
+class CheckpointTest(SimulationTestCase):
+
+    def run_checkpointed(self, name, seed=1, **kwargs):
+        random.seed(seed)
+        numpy.random.seed(seed)
+        return self.run_processor(name, RandomAgent(), initial_state(100), end_date='2017-01-04', log_chunk_size=500,
+                                  **kwargs)
+
+    def read(self, name, output_format):
+        if output_format == 'lines':
+            return self.read_log(name)
+        columns = read_columns(self.path(name))
+        return list(zip(*[columns[key].tolist() for key in ['t', 'id', 'c', 's']]))
+
+    def test_resume_matches_uninterrupted_run(self):
+        for output_format in ['lines', 'columnar']:
+            for queue in ['heap', 'calendar']:
+                name = output_format + '-' + queue
+                options = dict(output_format=output_format, event_queue=queue)
+                whole = self.run_checkpointed(name + '-whole', **options)
+                checkpoints = self.path(name + '-checkpoints')
+                # stops at iteration 1000, after its last checkpoint at 970
+                self.run_checkpointed(name, checkpoint_dir=checkpoints, checkpoint_every=97, max_iterations=1000,
+                                      **options)
+                resumed = self.run_checkpointed(name, seed=99, resume_from=checkpoints, checkpoint_dir=checkpoints,
+                                                checkpoint_every=97, **options)
+                self.assertEqual(resumed.iteration, whole.iteration)
+                self.assertEqual(resumed.event_counter, whole.event_counter)
+                self.assertEqual(self.read(name, output_format), self.read(name + '-whole', output_format), name)
+
+    def test_lazy_admission_is_not_checkpointed(self):
+        self.assertRaises(ValueError, self.run_checkpointed, 'lazy', checkpoint_dir=self.path('c'),
+                          lazy_admission=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import unittest
+from unittest import mock
+from Dash2.core.des_work_processor import ParallelWorkProcessor
+from Dash2.core.event_log import read_event_log
+from des_helpers import HourlyAgent, SimulationTestCase, initial_state
+
+
+class CohortAgent(HourlyAgent):
+
+    def __init__(self):
+        self.batches = []
+
+    def batch_decision_cycle(self, agent_data_list, event_time, event_times, agents):
+        self.batches.append(event_times)
+        return [self.agent_decision_cycle(agent_data, agent_time, agents)
+                for agent_data, agent_time in zip(agent_data_list, event_times)]
+
+
+class LocalWorkProcessorTest(SimulationTestCase):
+
+    def run_logged(self, name, agent=None, **kwargs):
+        processor = self.run_processor(name, agent or HourlyAgent(), initial_state(40), **kwargs)
+        return processor, self.read_log(name)
+
+    def test_batches_match_single_events(self):
+        (_, single) = self.run_logged('single.json')
+        (_, batched) = self.run_logged('batched.json', batch_events=True)
+        self.assertEqual(batched, single)
+
+    def test_batch_window_keeps_time_moving_forward(self):
+        agent = CohortAgent()
+        self.run_logged('window.json', agent, batch_events=True, batch_window=5400)
+        self.assertTrue(any(len(event_times) > 1 and min(event_times) < max(event_times)
+                            for event_times in agent.batches))
+        for (previous, batch) in zip(agent.batches, agent.batches[1:]):
+            self.assertGreaterEqual(min(batch), max(previous))
+
+
+class ParallelWorkProcessorTest(SimulationTestCase):
+
+    def make_parallel(self, name, agent=None, **kwargs):
+        return self.make_processor(name, agent or HourlyAgent(), initial_state(40),
+                                   processor_class=ParallelWorkProcessor, **kwargs)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_same_events_as_one_process(self):
+        self.run_processor('single.json', HourlyAgent(), initial_state(40))
+        single = self.read_log('single.json')
+        processor = self.run_processor('parallel.json', HourlyAgent(), initial_state(40),
+                                       processor_class=ParallelWorkProcessor, processes=3, lookahead=3600)
+        parallel = self.read_log('parallel.json')
+        times = [event['t'] for event in parallel]
+        self.assertEqual(times, sorted(times))
+        key = lambda event: (event['t'], event['id'])
+        self.assertEqual(parallel, sorted(single, key=key))
+        self.assertGreater(processor.windows, 1)
+        self.run_processor('parallel.pkl', HourlyAgent(), initial_state(40), processor_class=ParallelWorkProcessor,
+                           processes=3, lookahead=3600, log_format='pickle')
+        self.assertEqual(list(read_event_log(self.path('parallel.pkl'), 'pickle')), parallel)
+
+    def test_lookahead_is_required(self):
+        self.assertRaises(ValueError, self.make_parallel, 'parallel.json')
+        self.assertRaises(ValueError, self.make_parallel, 'parallel.json', lookahead=0)
+        agent = HourlyAgent()
+        agent.min_event_interval = 1800
+        self.assertEqual(self.make_parallel('parallel.json', agent).lookahead, 1800)
+
+    def test_needs_fork(self):
+        with mock.patch('multiprocessing.get_all_start_methods', return_value=['spawn']):
+            self.assertRaises(RuntimeError, self.make_parallel, 'parallel.json', lookahead=3600)
+
+
+if __name__ == '__main__':
+    unittest.main()
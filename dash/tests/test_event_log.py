@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from Dash2.core.event_log import EventLogWriter, ColumnarEventWriter, read_event_log, read_columns, chunk_paths, \
+    pyarrow
+
+
+# Events as an agent might log them, with a nested dict, a value missing from some and one of a different type
+def make_events(n):
+    events = []
+    for i in range(n):
+        event = {'t': 1483228800 + 60 * i, 'id': 'a%d' % (i % 7), 'agent': {'mood': i % 3, 'score': i / 4.0}}
+        if i % 4:
+            event['action'] = 'act%d' % (i % 2)
+        if i % 9 == 8:
+            event['agent']['mood'] = 'cross'
+        events.append(event)
+    return events
+
+
+class EventLogWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Counts on both sides of each flush, with and without the background thread
+    def test_round_trip(self):
+        for log_format in ['ndjson', 'pickle']:
+            for background in [False, True]:
+                for n in [0, 1, 6, 7, 8, 21]:
+                    path = os.path.join(self.directory, '%s-%s-%d' % (log_format, background, n))
+                    events = make_events(n)
+                    with EventLogWriter(path, format=log_format, flush_size=7, flush_interval=0.01,
+                                        background=background, mode='w') as writer:
+                        for event in events:
+                            writer.write(event)
+                            event['t'] = None  # events are serialized when written
+                    self.assertEqual(list(read_event_log(path, log_format)), make_events(n), path)
+
+    def test_pickle_keeps_python_types(self):
+        path = os.path.join(self.directory, 'log.pkl')
+        with EventLogWriter(path, format='pickle', background=False, mode='w') as writer:
+            writer.write({'action': ('doWork', 'x'), 'ids': {1, 2}})
+        self.assertEqual(list(read_event_log(path, 'pickle')), [{'action': ('doWork', 'x'), 'ids': {1, 2}}])
+
+    def test_flushes_in_batches(self):
+        path = os.path.join(self.directory, 'log.json')
+        writer = EventLogWriter(path, flush_size=5, background=False, mode='w')
+        for event in make_events(9):
+            writer.write(event)
+        self.assertEqual(len(list(read_event_log(path))), 5)
+        writer.flush()
+        self.assertEqual(list(read_event_log(path)), json.loads(json.dumps(make_events(9))))
+        writer.close()
+        self.assertRaises(ValueError, writer.write, {})
+        self.assertRaises(ValueError, EventLogWriter, path, format='csv')
+
+
+class ColumnarEventWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def formats(self):
+        return ['npz', 'parquet'] if pyarrow is not None else ['npz']
+
+    def write(self, name, events, log_format, mode='w'):
+        directory = os.path.join(self.directory, name)
+        writer = ColumnarEventWriter(directory, chunk_size=5, format=log_format, mode=mode)
+        for event in events:
+            writer.write(event)
+        writer.close()
+        return directory
+
+    # The events as read back: each column's values, None where masked, and the leftovers from the extra column
+    def read(self, directory):
+        columns = read_columns(directory)
+        events = [dict() for _ in range(len(columns['extra']) if columns else 0)]
+        for (name, values) in columns.items():
+            for (event, value) in zip(events, values.tolist()):
+                if value is None:
+                    continue
+                if name == 'extra':
+                    event.update(json.loads(value))
+                else:
+                    event[name] = value
+        return events
+
+    def test_round_trip_across_chunks(self):
+        for log_format in self.formats():
+            for n in [0, 4, 5, 6, 15, 23]:
+                directory = self.write('%s-%d' % (log_format, n), make_events(n), log_format)
+                self.assertEqual(len(chunk_paths(directory)), -(-n // 5))
+                expected = []
+                for event in make_events(n):
+                    flat = dict((key, value) for (key, value) in event.items() if key != 'agent')
+                    flat.update({'agent.mood': event['agent']['mood'], 'agent.score': event['agent']['score']})
+                    expected.append(flat)
+                self.assertEqual(self.read(directory), expected, directory)
+
+    def test_empty_log(self):
+        for log_format in self.formats():
+            directory = self.write('empty-' + log_format, [], log_format)
+            self.assertEqual(chunk_paths(directory), [])
+            self.assertEqual(read_columns(directory), {})
+
+    def test_only_requested_columns_are_read(self):
+        for log_format in self.formats():
+            directory = self.write('some-' + log_format, make_events(12), log_format)
+            columns = read_columns(directory, ['t', 'action', 'missing'])
+            self.assertEqual(sorted(columns), ['action', 't'])
+            self.assertEqual(columns['t'].tolist(), [event['t'] for event in make_events(12)])
+            self.assertEqual(columns['action'].mask.tolist(), [i % 4 == 0 for i in range(12)])
+
+    def test_append_and_overwrite(self):
+        for log_format in self.formats():
+            name = 'append-' + log_format
+            self.write(name, make_events(7), log_format)
+            directory = self.write(name, make_events(12)[7:], log_format, mode='a')
+            self.assertEqual(len(chunk_paths(directory)), 3)
+            self.assertEqual(read_columns(directory)['t'].tolist(), [event['t'] for event in make_events(12)])
+            self.write(name, make_events(3), log_format)
+            self.assertEqual(len(chunk_paths(directory)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import random
+import unittest
+from Dash2.core.event_queue import HeapEventQueue, make_event_queue
+
+
+class EventQueueTest(unittest.TestCase):
+
+    # Events popped from the queue while pushing new ones, as a simulation does: each popped agent is pushed again
+    # after a random gap, some at the same time as others and some far ahead
+    def run_queue(self, queue, agents=200, pops=5000):
+        rng = random.Random(3)
+        for agent_id in range(agents):
+            queue.push(rng.choice([0, 60, 3600, rng.randint(0, 86400)]), agent_id)
+        popped = []
+        for _ in range(pops):
+            self.assertEqual(queue.peek(), queue.peek())
+            peeked = queue.peek()
+            (time, agent_id) = queue.pop()
+            self.assertEqual(peeked, (time, agent_id))
+            popped.append((time, agent_id))
+            queue.push(time + rng.choice([0, 1, 3600, 86400, rng.randint(1, 30 * 86400)]), agent_id)
+        self.assertEqual(len(queue), agents)
+        while len(queue) > 0:
+            popped.append(queue.pop())
+        return popped
+
+    def test_queues_pop_in_heap_order(self):
+        expected = self.run_queue(HeapEventQueue())
+        self.assertEqual(expected, sorted(expected))
+        for (queue, options) in [('calendar', {}), ('calendar', {'bucket_width': 1}), ('bucketed', {}),
+                                 ('bucketed', {'bucket_width': 86400})]:
+            self.assertEqual(self.run_queue(make_event_queue(queue, **options)), expected, queue + str(options))
+
+    def test_unknown_queue(self):
+        self.assertRaises(ValueError, make_event_queue, 'fifo')
+
+
+if __name__ == '__main__':
+    unittest.main()
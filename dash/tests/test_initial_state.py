@@ -0,0 +1,58 @@
+import unittest
+from Dash2.core.initial_state import stream_initial_state
+from des_helpers import SimulationTestCase
+
+
+# Agents acting every one to three hours, logging how many agents they can see
+class CensusAgent(object):
+
+    def next_event_time(self, agent_data, curr_time, start_time, max_time):
+        next_time = curr_time + 3600 * (1 + agent_data['n'] % 3)
+        return next_time if next_time < max_time else None
+
+    def agent_decision_cycle(self, agent_data, event_time, agents):
+        self.hub.json_log_file.write({'t': event_time, 'id': agent_data['id'], 'seen': len(agents)})
+
+
+class StreamInitialStateTest(SimulationTestCase):
+
+    def write(self, name, text):
+        path = self.path(name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_csv_ids_stay_strings(self):
+        path = self.write('agents.csv', 'id,n,last_event_time,score,tag\n'
+                                        '007,1,1483228800,0.5,x\n7,2,1483228800,,nan\nnan,3,1483228800,inf,\n')
+        agents = list(stream_initial_state(path))
+        self.assertEqual([agent_id for (agent_id, _) in agents], ['007', '7', 'nan'])
+        self.assertEqual(agents[0][1], {'id': '007', 'n': 1, 'last_event_time': 1483228800, 'score': 0.5, 'tag': 'x'})
+        self.assertNotIn('score', agents[1][1])
+        self.assertNotEqual(agents[1][1]['tag'], agents[1][1]['tag'])  # nan
+        self.assertEqual(agents[2][1]['score'], float('inf'))
+        self.assertNotIn('tag', agents[2][1])
+
+    def test_ndjson(self):
+        path = self.write('agents.ndjson', '{"id": 7, "n": 1}\n\n{"id": "007", "n": 2}\n')
+        self.assertEqual(list(stream_initial_state(path)), [(7, {'id': 7, 'n': 1}), ('007', {'id': '007', 'n': 2})])
+
+    def run_census(self, name, path, **kwargs):
+        self.run_processor(name, CensusAgent(), lambda *args, **_: stream_initial_state(path), end_date='2017-01-02',
+                           **kwargs)
+        return self.read_log(name)
+
+    def test_lazy_admission_sees_admitted_agents(self):
+        path = self.write('agents.csv', 'id,n,last_event_time\n' +
+                          ''.join('a%d,%d,%d\n' % (i, i, 1483228800 + 3 * 3600 * i) for i in range(12)))
+        eager = self.run_census('eager.json', path)
+        lazy = self.run_census('lazy.json', path, lazy_admission=True)
+        self.assertEqual([(event['t'], event['id']) for event in lazy], [(event['t'], event['id']) for event in eager])
+        self.assertEqual(set(event['seen'] for event in eager), {12})
+        seen = [event['seen'] for event in lazy]
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual((seen[0], seen[-1]), (1, 12))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from Dash2.core.profiler import DecisionCycleProfiler
+
+
+# An agent whose decision cycle goes through the profiled phases, spending a known time performing actions
+class Clerk(object):
+
+    def __init__(self):
+        self.log = []
+
+    def agent_decision_cycle(self):
+        self.system1_update()
+        action = self.choose_action()
+        self.update_beliefs(self.perform_action(action), action)
+        self.system1_step()
+        return action
+
+    def system1_update(self):
+        pass
+
+    def choose_action(self):
+        return self.system2_propose_action(len(self.log))
+
+    def system2_propose_action(self, n):
+        return ('file', n)
+
+    def perform_action(self, action):
+        time.sleep(0.002)
+        return [{}]
+
+    def update_beliefs(self, result, action):
+        self.log.append(action)
+
+    def system1_step(self):
+        pass
+
+
+# Deliberates by calling choose_action again, to check recursive calls are only counted once in the summary
+class Deliberator(Clerk):
+
+    def choose_action(self, depth=2):
+        if depth > 0:
+            return self.choose_action(depth - 1)
+        return Clerk.choose_action(self)
+
+
+class DecisionCycleProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_phases_are_counted_and_timed(self):
+        profiler = DecisionCycleProfiler()
+        agents = [Clerk(), Clerk()]
+        for agent in agents:
+            profiler.attach(agent)
+        for _ in range(5):
+            for agent in agents:
+                agent.agent_decision_cycle()
+        phases = profiler.summary()['Clerk']
+        self.assertEqual(sorted(phases), sorted(DecisionCycleProfiler.phases))
+        for phase in DecisionCycleProfiler.phases:
+            self.assertEqual(phases[phase]['calls'], 10, phase)
+        self.assertGreaterEqual(phases['perform_action']['wall'], 10 * 0.002)
+        self.assertGreaterEqual(phases['agent_decision_cycle']['wall'], phases['perform_action']['wall'])
+        self.assertLess(phases['perform_action']['cpu'], phases['perform_action']['wall'])
+        stacks = dict((tuple(entry['stack']), entry) for entry in profiler.to_json()['stacks'])
+        nested = ('agent_decision_cycle', 'choose_action', 'system2_propose_action')
+        self.assertEqual(stacks[nested]['calls'], 10)
+        cycle = stacks[('agent_decision_cycle',)]
+        self.assertGreaterEqual(cycle['self_wall'], 0)
+        self.assertLess(cycle['self_wall'], cycle['wall'] - phases['perform_action']['wall'] + 1e-9)
+        path = os.path.join(self.directory, 'profile.json')
+        profiler.write_json(path)
+        with open(path) as f:
+            self.assertEqual(json.load(f)['phases']['Clerk']['choose_action']['calls'], 10)
+        path = os.path.join(self.directory, 'profile.folded')
+        profiler.write_stacks(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('Clerk;' + ';'.join(nested), [line.rsplit(' ', 1)[0] for line in lines])
+        self.assertTrue(all(int(line.rsplit(' ', 1)[1]) >= 0 for line in lines))
+        profiler.reset()
+        self.assertEqual(profiler.summary(), {})
+
+    def test_recursive_calls_are_counted_once(self):
+        profiler = DecisionCycleProfiler()
+        agent = Deliberator()
+        profiler.attach(agent)
+        for _ in range(4):
+            agent.agent_decision_cycle()
+        self.assertEqual(profiler.summary()['Deliberator']['choose_action']['calls'], 4)
+        stacks = dict((tuple(entry['stack']), entry['calls']) for entry in profiler.to_json()['stacks'])
+        self.assertEqual(stacks[('agent_decision_cycle',) + ('choose_action',) * 3], 4)
+        self.assertEqual(stacks[('agent_decision_cycle',) + ('choose_action',) * 3 + ('system2_propose_action',)], 4)
+
+    def test_profiling_off_is_a_no_op(self):
+        (plain, profiled) = (Clerk(), Clerk())
+        profiler = DecisionCycleProfiler(cpu=False)
+        profiler.attach(profiled)
+        for _ in range(3):
+            self.assertEqual(plain.agent_decision_cycle(), profiled.agent_decision_cycle())
+        self.assertEqual(plain.log, profiled.log)
+        self.assertEqual(plain.__dict__, {'log': plain.log})
+        self.assertEqual(profiler.summary()['Clerk']['perform_action']['cpu'], 0.0)
+        stats = dict((stack, list(entry)) for (stack, entry) in profiler.stats.items())
+        profiler.detach(profiled)
+        self.assertEqual(profiled.__dict__, {'log': profiled.log})
+        profiled.agent_decision_cycle()
+        self.assertEqual(profiler.stats, stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
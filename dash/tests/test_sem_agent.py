@@ -0,0 +1,62 @@
+import importlib.util
+import unittest
+
+available = all(importlib.util.find_spec(module) is not None for module in ['pandas', 'semopy'])
+if available:
+    import pandas
+    from Dash2.core.sem_agent import SEMAgent
+
+
+# Stands in for a fitted semopy model, predicting from each row alone and counting the calls
+class StubModel(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, data):
+        self.calls += 1
+        return pandas.DataFrame({'y': data['x'] * 2 + data['z'], 'w': data['x'] - data['z']}, index=data.index)
+
+
+@unittest.skipUnless(available, 'needs pandas and semopy')
+class PredictCohortTest(unittest.TestCase):
+
+    def make_agent(self):
+        agent = SEMAgent()
+        agent.model = StubModel()
+        agent.predictions = []
+        agent.prediction_to_actions = agent.predictions.append
+        return agent
+
+    def cohort(self):
+        return [pandas.DataFrame({'x': [1.0, 2.0, 3.0], 'z': [0.5, 0.0, 1.0]}),
+                {'x': 4.0, 'z': 2.0},
+                pandas.Series({'x': -1.0, 'z': 3.0}),
+                pandas.DataFrame({'x': [5.0, 6.0], 'z': [1.0, 1.0]}, index=[7, 8])]
+
+    def test_one_call_per_cohort(self):
+        agent = self.make_agent()
+        self.assertEqual(agent.predict_cohort([]), [])
+        preds = agent.predict_cohort(self.cohort())
+        self.assertEqual(agent.model.calls, 1)
+        self.assertEqual([len(p) for p in preds], [3, 1, 1, 2])
+        single = self.make_agent()
+        for (agent_data, cohort_preds) in zip(self.cohort(), preds):
+            frame = agent_data if isinstance(agent_data, pandas.DataFrame) else pandas.DataFrame([agent_data])
+            expected = single.model.predict(frame)
+            self.assertEqual(cohort_preds.values.tolist(), expected.values.tolist())
+
+    def test_batch_matches_agent_decision_cycle(self):
+        batch = self.make_agent()
+        self.assertEqual(batch.batch_decision_cycle(self.cohort(), 0), [False] * 4)
+        single = self.make_agent()
+        for agent_data in self.cohort():
+            frame = agent_data if isinstance(agent_data, pandas.DataFrame) else pandas.DataFrame([agent_data])
+            single.agent_decision_cycle(agent_data=frame)
+        self.assertEqual(batch.event_counter, single.event_counter)
+        self.assertEqual([p.values.tolist() for p in batch.predictions],
+                         [p.values.tolist() for p in single.predictions])
+
+
+if __name__ == '__main__':
+    unittest.main()
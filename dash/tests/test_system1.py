@@ -0,0 +1,202 @@
+import random
+import unittest
+from Dash2.core.system1 import System1Agent, Node, LazyDecayNode, DecayClock
+
+
+# A system 1 with links among some of its nodes, given activation at random and new links as it runs, recording
+# the nodes over threshold each cycle and the activations at the end
+def run_linked_agent(lazy_decay, spread_epsilon, cycles=40, seed=3):
+    agent = System1Agent()
+    agent.lazy_decay = lazy_decay
+    agent.spread_epsilon = spread_epsilon
+    rng = random.Random(seed)
+    facts = [('p', i) for i in range(60)] + [('action', 'a' + str(i)) for i in range(10)]
+    nodes = [agent.fact_to_node(fact) for fact in facts]
+    for _ in range(50):
+        (source, target) = rng.sample(nodes[:40], 2)
+        source.add_neighbor(target, rng.choice([1, -1, 0.5]))
+    history = []
+    for cycle in range(cycles):
+        for fact in rng.sample(facts, 4):
+            agent.add_activation(fact, rng.random())
+        agent.system1_update()
+        history.append((sorted(n.fact for n in agent.nodes_over_threshold(0.2)),
+                        sorted(n.fact for n in agent.actions_over_threshold(0.1))))
+        if cycle % 5 == 2:  # links to nodes that have been decaying lazily
+            (source, target) = rng.sample(nodes, 2)
+            source.add_neighbor(target, rng.choice([1, -1]))
+        agent.system1_step()
+    return [(n.activation, n.change_since_update) for n in nodes], history
+
+
+class LazyDecayTest(unittest.TestCase):
+
+    def test_lazy_decay_matches_eager_decay(self):
+        for spread_epsilon in [None, 0, 0.01, 0.05]:
+            for seed in range(3):
+                (eager, eager_history) = run_linked_agent(False, spread_epsilon, seed=seed)
+                (lazy, lazy_history) = run_linked_agent(True, spread_epsilon, seed=seed)
+                self.assertEqual(eager_history, lazy_history)
+                for ((eager_activation, eager_change), (lazy_activation, lazy_change)) in zip(eager, lazy):
+                    self.assertAlmostEqual(eager_activation, lazy_activation)
+                    self.assertAlmostEqual(eager_change, lazy_change)
+
+    def test_lazy_node_catches_up_with_clamp(self):
+        clock = DecayClock()
+        eager = Node(1, ('p',))
+        lazy = LazyDecayNode(1, ('p',), clock)
+        for step in range(34):
+            if step % 7 == 0:
+                eager.update(0.45)
+                lazy.update(0.45)
+            eager.apply_decay()
+            clock.time += 1
+            self.assertAlmostEqual(eager.activation, lazy.activation)
+        self.assertEqual(lazy.activation, 0)
+
+    def test_only_unlinked_nodes_decay_lazily(self):
+        agent = System1Agent()
+        (linked, target, unlinked) = [agent.fact_to_node(('p', i)) for i in range(3)]
+        self.assertIs(type(linked), LazyDecayNode)
+        linked.add_neighbor(target)
+        self.assertEqual(agent.decay_clock.nodes, [linked])
+        for node in [linked, unlinked]:
+            node.update(0.5)
+        agent.system1_step()
+        self.assertAlmostEqual(linked._activation, 0.4)
+        self.assertAlmostEqual(unlinked._activation, 0.5)  # not yet brought up to date
+        self.assertAlmostEqual(unlinked.activation, 0.4)
+        agent = System1Agent()
+        agent.lazy_decay = False
+        self.assertIs(type(agent.fact_to_node(('p', 1))), Node)
+
+# A system 1 whose links form a tree, each node linked from one node made before it, recording the activations of
+# all its nodes and the neighbor updates made each cycle
+def run_tree_agent(spread_epsilon, cycles=30, seed=1):
+    agent = System1Agent()
+    agent.spread_epsilon = spread_epsilon
+    rng = random.Random(seed)
+    facts = [('p', i) for i in range(80)]
+    nodes = [agent.fact_to_node(fact) for fact in facts]
+    for (i, node) in enumerate(nodes[1:50], 1):
+        nodes[rng.randrange(i)].add_neighbor(node, rng.choice([1, -1, 0.5]))
+    activations = []
+    updates = []
+    for _ in range(cycles):
+        for fact in rng.sample(facts, 4):
+            agent.add_activation(fact, rng.random())
+        agent.system1_update()
+        activations.append([n.activation for n in nodes])
+        updates.append(agent.spread_updates)
+        agent.system1_step()
+    return activations, updates
+
+
+class WorklistTest(unittest.TestCase):
+
+    def test_worklist_matches_full_sweep(self):
+        (swept, sweep_updates) = run_tree_agent(None)
+        (worked, worklist_updates) = run_tree_agent(0)
+        for (swept_cycle, worked_cycle) in zip(swept, worked):
+            for (a, b) in zip(swept_cycle, worked_cycle):
+                self.assertAlmostEqual(a, b)
+        self.assertEqual(sweep_updates, worklist_updates)
+
+    def test_epsilon_cuts_updates(self):
+        (_, updates) = run_tree_agent(0)
+        (_, fewer_updates) = run_tree_agent(0.05)
+        self.assertLess(sum(fewer_updates), sum(updates))
+        self.assertGreater(sum(fewer_updates), 0)
+
+
+class ActiveSetTest(unittest.TestCase):
+
+    def test_active_sets_match_full_scan(self):
+        for spread_epsilon in [None, 0.01]:
+            agent = System1Agent()
+            agent.spread_epsilon = spread_epsilon
+            rng = random.Random(2)
+            facts = [('p', i) for i in range(60)] + [('action', 'a' + str(i)) for i in range(20)]
+            nodes = [agent.fact_to_node(fact) for fact in facts]
+            for _ in range(60):
+                (source, target) = rng.sample(nodes, 2)
+                source.add_neighbor(target, rng.choice([1, -1]))
+            for _ in range(40):
+                for fact in rng.sample(facts, 5):
+                    agent.add_activation(fact, rng.random() - 0.2)
+                agent.system1_update()
+                for threshold in [0.05, 0.2, 0.5]:
+                    self.assertEqual(set(agent.nodes_over_threshold(threshold)),
+                                     set(n for n in nodes if n.activation >= threshold))
+                    self.assertEqual(set(agent.actions_over_threshold(threshold)),
+                                     set(n for n in nodes if n.fact[0] == 'action' and n.activation >= threshold))
+                self.assertEqual(set(agent.nodes_over_threshold(0)), set(nodes))
+                agent.system1_step()
+            self.assertEqual(agent.active_nodes, set(n for n in nodes if n.activation > 0))
+
+
+class FactKeyTest(unittest.TestCase):
+
+    def test_equal_facts_share_a_node(self):
+        agent = System1Agent()
+        node = agent.fact_to_node(('hi', ('there', 'you')))
+        self.assertIs(agent.fact_to_node(('hi', ['there', 'you'])), node)
+        self.assertIs(agent.fact_to_node(['hi', ['there', 'you']]), node)
+        self.assertIsNot(agent.fact_to_node(('hi', ('there', 'me'))), node)
+        self.assertIsNot(agent.fact_to_node(('hi', 'there', 'you')), node)
+        self.assertEqual(agent.fact_to_key(('hi', ('there', 'you'))), ('hi', ('there', 'you')))
+        self.assertEqual(agent.fact_to_key(('a', {'b': 1})), ('a', "{'b': 1}"))
+        agent.add_activation(['hi', ['there', 'you']], 0.4)
+        self.assertAlmostEqual(node.activation, 0.4)
+        self.assertEqual(len(agent.nodes), 3)
+
+
+class PatternRuleTest(unittest.TestCase):
+
+    # Links each new ('likes', person, thing) node to the nodes for the thing, as the rule for the pattern sees them
+    def make_agent(self):
+        agent = System1Agent()
+        fired = []
+
+        def link_to_thing(node, bindings):
+            fired.append((node.fact, dict(bindings)))
+            for (other, _) in agent.nodes_matching(('thing', bindings['t'], 'kind')):
+                node.add_neighbor(other)
+        agent.create_neighbor_rule(('likes', '_ann', 't'), link_to_thing)
+        agent.create_neighbor_rule(('likes', 'p', 'p'), lambda node, bindings: fired.append((node.fact, 'self')))
+        return agent, fired
+
+    def test_rules_fire_for_matching_facts(self):
+        (agent, fired) = self.make_agent()
+        for fact in [('thing', '_tea', '_drink'), ('thing', '_cake', '_food'), ('thing', '_tea', '_leaf', '_x')]:
+            agent.fact_to_node(fact)
+        likes_tea = agent.fact_to_node(('likes', '_ann', '_tea'))
+        agent.fact_to_node(('likes', '_bob', '_tea'))
+        agent.fact_to_node(('likes', '_ann', '_tea', '_lots'))
+        agent.fact_to_node(('likes', '_cat', '_cat'))
+        agent.fact_to_node(('hates', '_ann', '_tea'))
+        self.assertEqual(fired, [(('likes', '_ann', '_tea'), {'t': '_tea'}), (('likes', '_cat', '_cat'), 'self')])
+        self.assertEqual([n.fact for (n, _) in likes_tea.neighbors], [('thing', '_tea', '_drink')])
+
+    def test_argument_index_follows_new_nodes(self):
+        (agent, _) = self.make_agent()
+        agent.fact_to_node(('thing', '_tea', '_drink'))
+        self.assertEqual([n.fact for (n, _) in agent.nodes_matching(('thing', '_tea', 'kind'))],
+                         [('thing', '_tea', '_drink')])
+        agent.fact_to_node(('thing', '_tea', '_leaf'))  # indexed as it is made
+        agent.fact_to_node(('thing', '_cake', '_food'))
+        agent.fact_to_node(('thing', '_tea'))
+        agent.fact_to_node(('thing', ['_tea'], '_list'))
+        likes_tea = agent.fact_to_node(('likes', '_ann', '_tea'))
+        self.assertEqual(sorted(n.fact for (n, _) in likes_tea.neighbors),
+                         [('thing', '_tea', '_drink'), ('thing', '_tea', '_leaf')])
+        self.assertEqual(sorted((n.fact, bindings['k']) for (n, bindings) in agent.nodes_matching(('thing', 't', 'k'))
+                                if bindings['t'] == '_tea'),
+                         [(('thing', '_tea', '_drink'), '_drink'), (('thing', '_tea', '_leaf'), '_leaf')])
+        self.assertEqual([n.fact for (n, _) in agent.nodes_matching(('thing', ['_tea'], 'k'))],
+                         [('thing', ['_tea'], '_list')])
+        self.assertEqual(agent.nodes_matching(('thing', '_milk', 'k')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import random
+import unittest
+from Dash2.core.system1 import Node
+from Dash2.core.system1_matrix import MatrixSystem1Agent, System1Population
+
+
+class System1PopulationTest(unittest.TestCase):
+
+    def add_agent(self, population):
+        agent = MatrixSystem1Agent()
+        if population is not None:
+            population.add_agent(agent)
+
+        def link_action(node):
+            action = agent.fact_to_node(('action', node.fact[1]))
+            node.add_neighbor(action, 1)
+            action.add_neighbor(node, -0.5)
+        agent.create_neighbor_rule('seen', link_action)
+        return agent
+
+    # Each tick, each agent goes through system 1 as in DASHAction's decision cycle, recording what system 1
+    # proposes. A batched population is spread before the agents act and decayed after, as a Trial does, and the
+    # agents' own calls leave their columns alone. Unbatched, each agent spreads once at the start of the tick and
+    # decays once at the end, on its own. The vocabulary is made up front, as nodes another agent made still decay,
+    # and spread the decay, in an agent's column.
+    def run_population(self, batched, cycles=30):
+        population = System1Population(batched)
+        agents = [self.add_agent(population) for _ in range(8)]
+        self.make_vocabulary(agents[0])
+        proposals = []
+        for cycle in range(cycles):
+            rng = random.Random(cycle)
+            if batched:
+                population.system1_update_all()
+            for agent in agents:
+                agent.system1_update()
+                proposals.append(sorted(str(action) for action in agent.system1_propose_actions()))
+                agent.add_activation(('seen', rng.randrange(20)), 0.4)
+                if batched:
+                    agent.system1_update()
+                proposals.append(sorted(str(action) for action in agent.system1_propose_actions()))
+                agent.system1_step()
+            if batched:
+                population.system1_step_all()
+        activations = [dict((str(key), node.activation) for (key, node) in agent.fact_node_dict.items())
+                       for agent in agents]
+        return population, agents, proposals, activations
+
+    def test_batched_matches_unbatched(self):
+        (_, _, batched_proposals, batched_activations) = self.run_population(True)
+        (_, _, proposals, activations) = self.run_population(False)
+        self.assertEqual(batched_proposals, proposals)
+        self.assertTrue(any(proposals))
+        for (batched_activation, activation) in zip(batched_activations, activations):
+            self.assertSameActivations(batched_activation, activation)
+
+    # The same agents, each with a network of its own
+    def test_batched_matches_separate_networks(self):
+        (population, _, _, batched_activations) = self.run_population(True)
+        agents = [self.add_agent(None) for _ in range(8)]
+        for agent in agents:
+            self.make_vocabulary(agent)
+        for cycle in range(30):
+            rng = random.Random(cycle)
+            for agent in agents:
+                agent.system1_update()
+                agent.add_activation(('seen', rng.randrange(20)), 0.4)
+                agent.system1_step()
+        for (agent, activations) in zip(agents, batched_activations):
+            self.assertSameActivations(activations, dict((str(key), node.activation)
+                                                         for (key, node) in agent.fact_node_dict.items()))
+
+    def make_vocabulary(self, agent):
+        for i in range(20):
+            agent.fact_to_node(('seen', i))
+
+    # The sums may be taken in a different order
+    def assertSameActivations(self, activations, expected):
+        self.assertEqual(sorted(activations), sorted(expected))
+        for key in activations:
+            self.assertAlmostEqual(activations[key], expected[key], places=9, msg=key)
+
+    def test_nodes_are_added_to_every_agent(self):
+        (population, agents, _, _) = self.run_population(True, cycles=5)
+        for agent in agents:
+            self.assertEqual(len(agent.fact_node_dict), population.size)
+            self.assertEqual(len(agent.nodes), population.size)
+            self.assertEqual(len(agent.action_nodes), population.size // 2)
+        late = self.add_agent(population)
+        self.assertEqual(len(late.nodes), population.size)
+
+
+class MatrixNodeTest(unittest.TestCase):
+
+    def test_matrix_node_looks_like_node(self):
+        agent = MatrixSystem1Agent()
+        node = agent.fact_to_node(('seen', 1))
+        action = agent.fact_to_node(('action', 'go'))
+        node.add_neighbor(action, 0.5)
+        node.update(0.6)
+        self.assertIsInstance(node, Node)
+        self.assertFalse(hasattr(node, '__dict__') and node.__dict__)
+        self.assertEqual((node.node_id, node.fact, node.decay, node.valence), (1, ('seen', 1), Node.default_decay, 0))
+        self.assertEqual([(neighbor.fact, strength) for (neighbor, strength) in node.neighbors], [(('action', 'go'), 0.5)])
+        self.assertEqual(list(agent.network.out_degree), [1, 0])
+        self.assertEqual(node.spread(), 1)
+        self.assertAlmostEqual(action.activation, 0.1)
+        self.assertEqual(action.node_to_action(), ('go',))
+        node.apply_decay()
+        self.assertAlmostEqual(node.activation, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
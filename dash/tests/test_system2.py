@@ -0,0 +1,358 @@
+import io
+import random
+import unittest
+from contextlib import redirect_stdout
+from Dash2.core.dash_action import DASHAction
+from Dash2.core.system2 import System2Agent, FactList, TermTable, base_program, compiled_programs, isGround, unify, \
+    substitute, substitution_cache, substitution_cache_size
+
+
+class Worker(DASHAction):
+
+    program = """
+goalWeight doWork(_all) 1
+
+goalRequirements doWork(x)
+  prepare(x)
+  shift(x)
+  forget([prepare(x), shift(x), doWork(x), gather(x, y), check(y), step(y, z), finish(y), clean(x), task(x)])
+
+goalRequirements prepare(x)
+  gather(x, y)
+  check(y)
+
+goalRequirements shift(x)
+  task(x)
+  task(x)
+  clean(x)
+
+goalRequirements task(x)
+  step(x, a)
+  step(a, b)
+  finish(b)
+"""
+
+    def __init__(self, fail_rate, use_plan_cache):
+        DASHAction.__init__(self)
+        self.readAgent(self.program)
+        self.traceLoop = False
+        self.use_plan_cache = use_plan_cache
+        self.rng = random.Random(7)
+        self.fail_rate = fail_rate
+        self.primitiveActions([(p, self.act) for p in ['gather', 'check', 'step', 'finish', 'clean']])
+
+    # Binds the action's variables to one of a few constants, or fails at fail_rate
+    def act(self, action):
+        if self.rng.random() < self.fail_rate:
+            return []
+        return [dict((v, '_' + str(self.rng.randrange(3))) for v in action[1:]
+                     if isinstance(v, str) and not v.startswith('_'))]
+
+
+class PlanCacheTest(unittest.TestCase):
+
+    def run_worker(self, fail_rate, use_plan_cache, cycles=300):
+        worker = Worker(fail_rate, use_plan_cache)
+        actions = []
+        with redirect_stdout(io.StringIO()):
+            action = worker.agent_decision_cycle(next_action=None)
+            while action is not None and len(actions) < cycles:
+                actions.append(action)
+                action = worker.agent_decision_cycle(next_action=action)
+        return actions, worker
+
+    def test_cached_plans_choose_the_same_actions(self):
+        for fail_rate in [0.0, 0.2]:
+            (uncached, _) = self.run_worker(fail_rate, False)
+            (cached, worker) = self.run_worker(fail_rate, True)
+            self.assertEqual(cached, uncached)
+            self.assertGreater(worker.plan_cache_hits, 0)
+
+    def test_failed_lookups_are_only_recorded_while_planning(self):
+        (_, worker) = self.run_worker(0.0, True, cycles=50)
+        recorded = sum(len(goals) for goals in worker.failed_lookups.values())
+        for _ in range(100):
+            worker.isKnown(('unknown', '_x'))
+        self.assertEqual(sum(len(goals) for goals in worker.failed_lookups.values()), recorded)
+        self.assertNotIn('unknown', worker.failed_lookups)
+
+
+class CompiledProgramTest(unittest.TestCase):
+
+    def test_agents_of_a_class_share_one_program(self):
+        (a, b) = (Worker(0.0, False), Worker(0.0, False))
+        self.assertIsNotNone(a.system2Program)
+        self.assertIs(a.system2Program, b.system2Program)
+        self.assertIs(a.system2Program, compiled_programs[(base_program, Worker.program)])
+        self.assertIs(a.goalRequirementsDict, b.goalRequirementsDict)
+        self.assertRaises(TypeError, a.goalRequirementsDict.__setitem__, 'rest', [])
+        # known facts in a shared definition are given to each agent
+        for agent in [a, b]:
+            agent.readAgent("known ready(_now)")
+        self.assertIs(a.system2Program, b.system2Program)
+        self.assertIsNot(a.knownDict, b.knownDict)
+        self.assertEqual([a.isKnown(('ready', '_now')), b.isKnown(('ready', '_now'))], [{}, {}])
+        a.forget(('forget', [('ready', '_now')]))
+        self.assertIs(a.isKnown(('ready', '_now')), False)
+        self.assertEqual(b.isKnown(('ready', '_now')), {})
+
+    def test_changed_rules_are_not_shared(self):
+        (a, b) = (Worker(0.0, False), Worker(0.0, False))
+        program = b.system2Program
+        programs = len(compiled_programs)
+        a.goalRequirements(('doWork', 'x'), [('rest', 'x')])
+        a.goalWeight(('rest', '_all'), 2)
+        self.assertIsNone(a.system2Program)
+        self.assertEqual(len(a.goalRequirementsDict['doWork']), 2)
+        for agent in [b, Worker(0.0, False)]:
+            self.assertIs(agent.system2Program, program)
+            self.assertEqual(len(agent.goalRequirementsDict['doWork']), 1)
+            self.assertNotIn(('rest', '_all'), agent.goalWeightDict)
+        self.assertEqual(len(program.goalRequirementsDict['doWork']), 1)
+        # an agent with its own rules reads definitions into them, leaving the compiled programs alone
+        a.readAgent("goalRequirements rest(x)\n  step(x, y)\n")
+        self.assertIn('rest', a.goalRequirementsDict)
+        self.assertNotIn('rest', b.goalRequirementsDict)
+        self.assertEqual(len(compiled_programs), programs)
+
+
+# A random fact or goal for predicate p: constants, including ones equal across types, variables if not ground,
+# and sometimes a nested term or a list
+def random_term(rng, ground=True, lists=True):
+    values = ['_a', '_b', '_c', 1, True, 2.0, 2]
+    if not ground:
+        values += ['x', 'y']
+    args = [rng.choice(values) for _ in range(rng.randrange(1, 3))]
+    if rng.random() < 0.2:
+        args.append(('q', rng.choice(values)))
+    elif lists and rng.random() < 0.1:
+        args.append([rng.choice(values), rng.choice(values)])
+    return tuple(['p'] + args)
+
+
+# What isIn finds by unifying against every fact in turn
+def scan(goal, facts):
+    for fact in facts:
+        bindings = unify(goal, fact)
+        if bindings is not False:
+            return bindings
+    return False
+
+
+class FactListTest(unittest.TestCase):
+
+    def check(self, agent, facts, goals, adict=None):
+        for goal in goals:
+            self.assertEqual(agent.isIn(goal, adict or {'p': facts}), scan(goal, list(facts)), goal)
+            self.assertEqual(goal in facts, goal in list(facts), goal)
+            if facts.all_ground and isGround(goal) and facts.find_ground(goal) is not None:
+                self.assertEqual(facts.find_ground(goal), scan(goal, list(facts)) is not False, goal)
+
+    # Facts are added and taken out in every way a list allows, checking goals against a linear scan after each.
+    # The facts are first all ground, so isIn looks ground goals up in the index, then some are not.
+    def test_isIn_matches_a_linear_scan(self):
+        agent = System2Agent()
+        rng = random.Random(5)
+        for ground in [True, False]:
+            facts = FactList()
+            for _ in range(300):
+                change = rng.random()
+                if change < 0.5 or not facts:
+                    facts.append(random_term(rng, ground or rng.random() < 0.8, not ground))
+                elif change < 0.6:
+                    facts.insert(rng.randrange(len(facts) + 1), random_term(rng, lists=not ground))
+                elif change < 0.7:
+                    facts.remove(rng.choice(facts))
+                elif change < 0.8:
+                    facts.pop(rng.randrange(len(facts)))
+                elif change < 0.9:
+                    facts[rng.randrange(len(facts))] = random_term(rng, lists=not ground)
+                else:
+                    del facts[rng.randrange(len(facts))]
+                goals = [random_term(rng) for _ in range(5)] + [random_term(rng, False) for _ in range(3)]
+                self.check(agent, facts, goals + [rng.choice(facts)] if facts else goals)
+            if ground:
+                self.assertTrue(facts.all_ground)
+                self.assertIsNotNone(facts.index)
+
+    def test_negated_facts(self):
+        agent = System2Agent()
+        rng = random.Random(6)
+        for _ in range(40):
+            agent.knownFalseTuple(random_term(rng))
+        facts = agent.knownFalseDict['p']
+        self.assertIsInstance(facts, FactList)
+        for goal in [random_term(rng) for _ in range(50)] + [random_term(rng, False) for _ in range(20)]:
+            self.assertEqual(agent.isKnownFalse(goal), scan(goal, list(facts)), goal)
+            self.assertIs(agent.isKnown(goal), False)
+
+
+class TermTableTest(unittest.TestCase):
+
+    def test_interned_terms_equal_their_originals(self):
+        table = TermTable()
+        rng = random.Random(7)
+        terms = [random_term(rng, False) for _ in range(200)]
+        for term in terms:
+            interned = table.intern(term)
+            self.assertEqual(interned, term)
+            self.assertEqual(repr(interned), repr(term))
+            if not any(isinstance(x, list) for x in term):
+                self.assertEqual(hash(interned), hash(term))
+                if interned is table.canonical[term]:
+                    self.assertIs(table.intern(tuple(list(term))), interned)
+                    self.assertIs(table.lookup(tuple(list(term))), interned)
+        # equal terms with constants of other types keep them
+        self.assertIs(table.intern(('r', 1, 2.0)), table.intern(('r', 1, 2.0)))
+        self.assertEqual(repr(table.intern(('r', True, 2))), repr(('r', True, 2)))
+        self.assertEqual(repr(table.lookup(('r', 1.0, 2))), repr(('r', 1.0, 2)))
+
+    def test_interned_facts_are_found_by_plain_goals(self):
+        (plain, interned) = (System2Agent(), System2Agent())
+        interned.term_table = TermTable()
+        rng = random.Random(8)
+        for _ in range(60):
+            fact = random_term(rng)
+            plain.knownTuple(fact)
+            interned.knownTuple(fact)
+        self.assertEqual(interned.knownDict['p'], plain.knownDict['p'])
+        for goal in [random_term(rng) for _ in range(100)] + [random_term(rng, False) for _ in range(30)]:
+            self.assertEqual(interned.isKnown(goal), plain.isKnown(goal), goal)
+
+
+# Substitute without the cache, rebuilding every term
+def rebuild(term, bindings, top=True):
+    if isinstance(term, list):
+        return [rebuild(x, bindings, False) for x in term]
+    if isinstance(term, tuple):
+        return tuple([term[0] if top else rebuild(term[0], bindings, False)] +
+                     [rebuild(x, bindings, False) for x in term[1:]])
+    try:
+        return bindings.get(term, term)
+    except TypeError:
+        return term
+
+
+class SubstituteTest(unittest.TestCase):
+
+    # Terms are made afresh and dropped, so ids are reused, and equal terms of different types are mixed
+    def test_substitute_matches_rebuilding(self):
+        rng = random.Random(9)
+        for clear in [True, False]:
+            for _ in range(2000):
+                term = random_term(rng, False)
+                if rng.random() < 0.3:
+                    term = ('r', term, 'x', random_term(rng, False))
+                if rng.random() < 0.2:
+                    term = ('x', 'y') + term[1:]
+                bindings = dict((var, rng.choice(['_v', 1, ('f', 'y'), True])) for var in ['x', 'y', 'q']
+                                if rng.random() < 0.4)
+                if clear:
+                    substitution_cache.cache_clear()
+                for _ in range(2):
+                    result = substitute(term, bindings)
+                    self.assertEqual(result, rebuild(term, bindings), (term, bindings))
+                    self.assertEqual(repr(result), repr(rebuild(term, bindings)))
+        self.assertLessEqual(substitution_cache.cache_info().currsize, substitution_cache_size)
+
+
+# Agents recording which method performed each action
+class Performer(DASHAction):
+
+    def __init__(self):
+        DASHAction.__init__(self)
+        self.performed = []
+
+    def do_work(self, action):
+        self.performed.append('base')
+        return [{}]
+
+
+class Specialist(Performer):
+
+    def do_work(self, action):
+        self.performed.append('override')
+        return [{}]
+
+
+class PrimitiveDispatchTest(unittest.TestCase):
+
+    # Base and subclass agents take turns, so each finds its own method whichever class resolved the name first
+    def test_subclass_override(self):
+        agents = [Performer(), Specialist(), Performer(), Specialist()]
+        for _ in range(2):
+            for agent in agents:
+                self.assertEqual(agent.perform_action(('doWork', '_x')), [{}])
+        self.assertEqual([agent.performed for agent in agents], [['base'] * 2, ['override'] * 2] * 2)
+
+    def test_runtime_rebinding(self):
+        (agent, other) = (Performer(), Performer())
+        for performer in [agent, other]:
+            performer.perform_action(('doWork', '_x'))
+        agent.do_work = lambda action: agent.performed.append('instance') or [{}]
+        agent.perform_action(('doWork', '_x'))
+        other.perform_action(('doWork', '_x'))
+        agent.primitiveActions([('doWork', lambda action: agent.performed.append('declared') or [{}])])
+        agent.perform_action(('doWork', '_x'))
+        agent.primitiveActions(['doWork'])
+        agent.perform_action(('doWork', '_x'))
+        del agent.do_work
+        agent.perform_action(('doWork', '_x'))
+        self.assertEqual(agent.performed, ['base', 'instance', 'declared', 'instance', 'base'])
+        self.assertEqual(other.performed, ['base', 'base'])
+        # a callable set on the agent for a predicate the class has no method for
+        self.assertFalse(agent.isPrimitive(('sing',)))
+        agent.sing = lambda action: agent.performed.append('sing') or [{}]
+        self.assertTrue(agent.isPrimitive(('sing',)))
+        agent.perform_action(('sing',))
+        self.assertEqual(agent.performed[-1], 'sing')
+        del agent.sing
+        self.assertFalse(agent.isPrimitive(('sing',)))
+
+
+# Plans whose rollouts win with different probabilities
+class Gambler(System2Agent):
+
+    program = """
+project safe
+  0.5 + _win
+
+project coin
+  0.5 + _win
+
+project risky
+  0.9 + _win
+
+utility
+  _win -> 1
+"""
+
+    def __init__(self):
+        System2Agent.__init__(self)
+        self.readAgent(self.program)
+
+
+class SampledComparisonTest(unittest.TestCase):
+
+    def test_result_does_not_depend_on_processes(self):
+        agent = Gambler()
+        for (plan_b, n_samples) in [(['risky'], 2000), (['coin'], 1000)]:
+            expected = agent.compare_plans_sampled(['safe'], plan_b, [], n_samples=n_samples, seed=3)
+            for processes in [1, 2, 3]:
+                self.assertEqual(agent.compare_plans_sampled(['safe'], plan_b, [], n_samples=n_samples, seed=3,
+                                                             processes=processes), expected)
+
+    def test_stops_early_when_one_plan_dominates(self):
+        comparison = Gambler().compare_plans_sampled(['safe'], ['risky'], [], n_samples=5000, seed=3)
+        self.assertTrue(comparison['decided'])
+        self.assertFalse(comparison['prefer_a'])
+        self.assertLess(comparison['rollouts'], 5000)
+
+    def test_runs_to_n_samples_when_tied(self):
+        comparison = Gambler().compare_plans_sampled(['safe'], ['coin'], [], n_samples=1000, seed=3)
+        self.assertFalse(comparison['decided'])
+        self.assertEqual(comparison['rollouts'], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import re
+import unittest
+import urllib.error
+import urllib.request
+from Dash2.core.event_queue import HeapEventQueue
+from Dash2.core.telemetry import Telemetry
+from des_helpers import HourlyAgent, SimulationTestCase, initial_state
+
+
+# Agents acting every one to three hours, alternating between working and resting
+class ShiftAgent(HourlyAgent):
+
+    def agent_decision_cycle(self, agent_data, event_time, agents):
+        agent_data['shifts'] = agent_data.get('shifts', 0) + 1
+        if agent_data['shifts'] % 2:
+            self.hub.json_log_file.write({'t': event_time, 'id': agent_data['id'], 'a': 'work'})
+            return ('work', agent_data['id'])
+        self.hub.json_log_file.write({'t': event_time, 'id': agent_data['id'], 'a': 'rest'})
+        return 'rest'
+
+
+# A stand-in for a processor, with the attributes Telemetry reads
+class Source(object):
+
+    def __init__(self):
+        self.event_counter = 0
+        self.iteration = 0
+        self.time = 1000
+        self.start_time = 1000
+        self.event_queue = HeapEventQueue()
+
+
+# Parse Prometheus text format into {(metric, labels): value} and {metric: type}, failing on any other line
+def parse_prometheus(text):
+    samples = dict()
+    types = dict()
+    for line in text.splitlines():
+        match = re.match(r'# TYPE ([a-zA-Z_:][a-zA-Z0-9_:]*) (counter|gauge)$', line)
+        if match:
+            types[match.group(1)] = match.group(2)
+            continue
+        match = re.match(r'([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(.*)\})? (\S+)$', line)
+        if match is None:
+            raise ValueError("not a Prometheus line: " + line)
+        labels = tuple(re.findall(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"', match.group(3) or ''))
+        samples[(match.group(1), labels)] = float(match.group(4))
+    return samples, types
+
+
+class TelemetryTest(SimulationTestCase):
+
+    def test_actions_accumulate(self):
+        telemetry = Telemetry(Source())
+        for action in [('doWork', 'x'), ['doWork', 'y'], 'rest', None, True, False, ('doWork',)]:
+            telemetry.count_action(action)
+        self.assertEqual(telemetry.snapshot()['actions'], {'doWork': 3, 'rest': 1})
+        telemetry.count_action('rest')
+        self.assertEqual(telemetry.snapshot()['actions'], {'doWork': 3, 'rest': 2})
+
+    def test_processor_counts_every_action(self):
+        processor = self.run_processor('shifts.json', ShiftAgent(), initial_state(20), end_date='2017-01-04')
+        counts = dict()
+        for event in self.read_log('shifts.json'):
+            counts[event['a']] = counts.get(event['a'], 0) + 1
+        self.assertEqual(processor.telemetry.actions, counts)
+        self.assertEqual(sum(counts.values()), processor.telemetry.snapshot()['events'])
+
+    def test_prometheus_text_parses(self):
+        source = Source()
+        telemetry = Telemetry(source)
+        telemetry.start()
+        (source.event_counter, source.iteration, source.time) = (50, 40, 4600)
+        source.event_queue.push(5000, 'a')
+        for action in ['work', 'work', 'say "hi"\\', 'rest\n']:
+            telemetry.count_action(action)
+        (samples, types) = parse_prometheus(telemetry.prometheus_text())
+        for metric in ['dash_events_total', 'dash_iterations_total', 'dash_actions_total']:
+            self.assertEqual(types[metric], 'counter')
+        for metric in ['dash_events_per_second', 'dash_recent_events_per_second', 'dash_queue_depth',
+                       'dash_simulated_time', 'dash_simulated_seconds_per_wall_second', 'dash_wall_seconds']:
+            self.assertEqual(types[metric], 'gauge')
+        self.assertEqual(set(metric for (metric, _) in samples), set(types))
+        self.assertEqual(samples[('dash_events_total', ())], 50)
+        self.assertEqual(samples[('dash_iterations_total', ())], 40)
+        self.assertEqual(samples[('dash_queue_depth', ())], 1)
+        self.assertEqual(samples[('dash_simulated_time', ())], 4600)
+        self.assertEqual(dict((labels, value) for ((metric, labels), value) in samples.items()
+                              if metric == 'dash_actions_total'),
+                         {(('action', 'work'),): 2, (('action', 'say \\"hi\\"\\\\'),): 1, (('action', 'rest\\n'),): 1})
+
+    def test_http_endpoint(self):
+        source = Source()
+        source.event_counter = 7
+        telemetry = Telemetry(source)
+        path = self.path('metrics.prom')
+        telemetry.publish(port=0, path=path, interval=0.01)
+        port = telemetry.server.server_address[1]
+        telemetry.count_action('work')
+        with urllib.request.urlopen('http://127.0.0.1:%d/' % port, timeout=10) as response:
+            self.assertEqual(response.headers['Content-Type'], 'application/json')
+            snapshot = json.loads(response.read().decode())
+        self.assertEqual((snapshot['events'], snapshot['actions']), (7, {'work': 1}))
+        with urllib.request.urlopen('http://127.0.0.1:%d/metrics' % port, timeout=10) as response:
+            (samples, _) = parse_prometheus(response.read().decode())
+        self.assertEqual(samples[('dash_events_total', ())], 7)
+        source.event_counter = 9
+        telemetry.close()
+        self.assertIsNone(telemetry.server)
+        self.assertIsNone(telemetry.writer)
+        self.assertRaises(urllib.error.URLError, urllib.request.urlopen, 'http://127.0.0.1:%d/' % port, timeout=10)
+        # the file holds the final values
+        with open(path) as f:
+            self.assertEqual(parse_prometheus(f.read())[0][('dash_events_total', ())], 9)
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+
+if __name__ == '__main__':
+    unittest.main()